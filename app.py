@@ -1,64 +1,28 @@
 import os
 from dotenv import load_dotenv
-import pandas as pd
-import geopandas as gpd
-from flask import Flask, request, jsonify
-from utils import create_point_gdf, calculate_nearest_distances, calculate_nearest_distances_metro
-import joblib
-from sqlalchemy import create_engine, text
-from sqlalchemy.pool import NullPool
+from flask import Flask, request, jsonify, g, Response
 from datetime import datetime
 from flasgger import Swagger
-import subprocess
 import jwt
 import json
-import unicodedata
-
-from data_metrics import metricas_comuna
+import time
+
+from comparables import ComparablesCache, COMPARABLES_K, COMPARABLES_K_MAX
+from features import preparar_lote
+from persistence import crear_engine, PredictionWriter, INSERT_PREDICTION_SQL
+import instrumentation
+from instrumentation import etapa
+from prediction_cache import cache_desde_env, clave_canonica, firma_indice
+import model_store
+import serving_bundle
+import serving_core
+from serving_core import SERVING_BUNDLE_VERIFY, cargar_modelo, cargar_recursos, predecir_filas, respuesta_prediccion
 
 load_dotenv()
 
-# Utility: Get comuna from coordinates using spatial join
-def get_comuna_from_coords(lat, lon, comunas_gdf):
-    punto = gpd.GeoDataFrame(
-        geometry=gpd.points_from_xy([lon], [lat]),
-        crs=comunas_gdf.crs
-    )
-    join = gpd.sjoin(punto, comunas_gdf, how='left', predicate='within')
-    if join.empty or pd.isnull(join.iloc[0]['Comuna']):
-        raise ValueError("Coordenadas fuera de los límites de las comunas conocidas.")
-    return join.iloc[0]['Comuna']
-
-
-def normalize_str(s: str) -> str:
-    nfkd = unicodedata.normalize('NFD', s)
-    only_base = ''.join(ch for ch in nfkd if unicodedata.category(ch) != 'Mn')
-    return only_base.lower().strip()
-
-
 # Configuración
 
 SECRET_KEY = os.getenv('SECRET_KEY')
-MODEL_PATH = os.getenv('MODEL_PATH', 'modelo_valoracion.pkl')
-SHP_PATHS = {
-    'ed_superior': os.getenv('ED_SUPERIOR_SHP', 'data_preprocessed/ed_superior.parquet').strip("'\""),
-    'ed_escolar':  os.getenv('ED_ESCOLAR_SHP',  'data_preprocessed/ed_escolar.parquet').strip("'\""),
-    'comisarias':  os.getenv('COMISARIAS_SHP',  'data_preprocessed/comisarias.parquet').strip("'\""),
-    'salud':       os.getenv('SALUD_SHP',       'data_preprocessed/salud.parquet').strip("'\""),
-    'metro':       os.getenv('METRO_SHP',       'data_preprocessed/metro.parquet').strip("'\""),
-    'comunas':     os.getenv('COMUNAS_SHP',     'data_preprocessed/comunas.parquet').strip("'\"")
-}
-
-# carga archivo de comunas y regiones
-MAPPING_FILE = os.getenv('COMUNA_REGION_FILE', 'comunas.xlsx')
-map_df = pd.read_excel(MAPPING_FILE)
-map_df.columns = map_df.columns.str.strip()
-raw_map = dict(zip(map_df['Comuna'], map_df['Region']))
-
-COMUNA_REGION_MAP = {
-    normalize_str(comuna_name): region
-    for comuna_name, region in raw_map.items()
-}
 
 # --- Configuración de la Base de Datos MariaDB ---
 db_user = os.getenv('DB_USER')
@@ -67,26 +31,68 @@ db_host = os.getenv('HOST')
 db_port = os.getenv('DB_PORT', '3306')
 db_name = os.getenv('DB_NAME', 'ml_valoranet')
 # Añadimos charset utf8mb4 para compatibilidad de caracteres
-DB_URI = (
+# DATABASE_URL (p.ej. sqlite:///bench.sqlite en los benchmarks) reemplaza la conexión a MariaDB
+DB_URI = os.getenv('DATABASE_URL') or (
     f"mysql+pymysql://{db_user}:{db_pass}"
     f"@{db_host}:{db_port}/{db_name}"
 )
-engine = create_engine(
-    DB_URI,
-    poolclass=NullPool,
-    connect_args={"connect_timeout": 10})
-
+engine = crear_engine(DB_URI)
+
+# Escritura diferida (write-behind) de predicciones: la latencia de la BD sale del request
+DB_WRITE_BEHIND = os.getenv('DB_WRITE_BEHIND', 'false').lower() == 'true'
+prediction_writer = PredictionWriter.from_env(engine).register_atexit() if DB_WRITE_BEHIND else None
+
+
+# Comunas, regiones, índices espaciales y métricas por comuna (ver serving_core.py)
+recursos = cargar_recursos()
+COMUNA_REGION_MAP = recursos.comuna_region
+comuna_resolver = recursos.comuna_resolver
+spatial_index = recursos.spatial_index
+metricas_cache = recursos.metricas_cache
+comparables_cache = ComparablesCache(recursos.comparables_path)
+
+
+# Caché de predicciones (clave: features normalizadas + versión del modelo) y de distancias por coordenada
+prediction_cache = cache_desde_env('prediction', 10000, 3600)
+distance_cache = cache_desde_env('distance', 50000, 0)
+FIRMA_INDICE = firma_indice(spatial_index)
+# Con caché, un acierto igual se registra en model_predictions salvo PREDICTION_CACHE_PERSIST_HITS=false
+PREDICTION_CACHE_PERSIST_HITS = os.getenv('PREDICTION_CACHE_PERSIST_HITS', 'true').lower() == 'true'
+
+
+def al_cambiar_modelo(version: str):
+    global COMUNA_REGION_MAP, comuna_resolver, spatial_index, FIRMA_INDICE
+    # Todo lo que depende de la versión se carga primero y se cambia junto; model_holder cambia el modelo después
+    path = serving_bundle.ruta_bundle_version(version)
+    nuevo = None
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        nuevo = serving_bundle.cargar_bundle(path, verificar=SERVING_BUNDLE_VERIFY)
+    if nuevo is not None:
+        # Métricas por comuna, comparables, comunas e índices espaciales del bundle de la versión
+        COMUNA_REGION_MAP = nuevo.comuna_region
+        comuna_resolver = nuevo.comuna_resolver
+        spatial_index = nuevo.spatial_index
+        FIRMA_INDICE = firma_indice(spatial_index)
+        metricas_cache.set_tabla(nuevo.metricas)
+        if nuevo.comparables_path:
+            comparables_cache.set_path(nuevo.comparables_path)
+        else:
+            comparables_cache.invalidate()
+    else:
+        # Versión sin bundle: métricas y comparables desde DATA_METRICS_FILE, geodatos sin cambios
+        metricas_cache.invalidate()
+        comparables_cache.invalidate()
+    # Las predicciones de la versión anterior ya no se consultan (la versión es parte de la clave)
+    if prediction_cache is not None:
+        prediction_cache.clear()
 
-# Cargar el modelo serializado
-model = joblib.load(MODEL_PATH)
 
-# Cargar shapefiles en memoria
-ed_sup = gpd.read_parquet(SHP_PATHS['ed_superior'])
-ed_esc = gpd.read_parquet(SHP_PATHS['ed_escolar'])
-comi   = gpd.read_parquet(SHP_PATHS['comisarias'])
-salud  = gpd.read_parquet(SHP_PATHS['salud'])
-metro  = gpd.read_parquet(SHP_PATHS['metro'])
-comuna_file= gpd.read_parquet(SHP_PATHS['comunas']).to_crs(epsg=4326)
+# Cargar el modelo serializado; cada worker cambia en caliente a la versión publicada en CURRENT
+model_holder = model_store.ModelHolder(
+    cargar_modelo,
+    check_interval=float(os.getenv('MODEL_CHECK_INTERVAL', 2.0)),
+    on_swap=al_cambiar_modelo)
+retrain_jobs = model_store.RetrainJobs()
 
 
 
@@ -101,111 +107,306 @@ swagger = Swagger(app, template={
     }
 })
 
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 10000))
+
+# Métricas de latencia por etapa (ver instrumentation.py) y perfilador opcional de requests lentos
+perfilador = instrumentation.perfilador_desde_env()
+
+
+@app.before_request
+def iniciar_medicion():
+    g.t0 = time.perf_counter()
+    instrumentation.iniciar_request()
+    if perfilador is not None:
+        perfilador.iniciar()
+
+
+@app.after_request
+def registrar_medicion(response):
+    duracion = time.perf_counter() - g.get('t0', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'desconocido'
+    instrumentation.registro.observar('request_seconds', duracion, endpoint=endpoint, method=request.method)
+    instrumentation.registro.incrementar('requests_total', endpoint=endpoint, method=request.method,
+                                         status=str(response.status_code))
+    etapas = instrumentation.etapas_request()
+    if perfilador is not None:
+        path = perfilador.terminar(endpoint, duracion)
+        if path:
+            detalle = ', '.join(f"{nombre}={seg * 1000:.1f}ms" for nombre, seg in etapas)
+            app.logger.warning(f"Request lento {request.method} {endpoint}: {duracion * 1000:.1f}ms ({detalle}); perfil en {path}")
+    instrumentation.registro.volcar()
+    return response
+
+
+@instrumentation.registro.colector
+def metricas_de_estado() -> list:
+    familias = [('model_info', 'gauge', 'Versión del modelo activo en el worker.',
+                 [({'version': model_holder.version or 'sin_version'}, 1)])]
+    for nombre, cache in (('prediction', prediction_cache), ('distance', distance_cache)):
+        if cache is None:
+            continue
+        stats = cache.stats()
+        for campo in ('hits', 'misses', 'expired', 'evictions', 'errors', 'size'):
+            if campo in stats:
+                metrica, tipo = ('cache_size', 'gauge') if campo == 'size' else (f"cache_{campo}_total", 'counter')
+                familias.append((metrica, tipo, f"Caché: {campo}.", [({'cache': nombre}, stats[campo])]))
+    model = model_holder.get()[1]
+    if hasattr(model, 'stats'):
+        stats = model.stats()
+        familias.append(('region_models', 'gauge', 'Modelos por región: residentes, memoria y contadores del LRU.',
+                         [({'campo': k}, len(v) if isinstance(v, list) else v) for k, v in stats.items()]))
+    if prediction_writer is not None:
+        familias.append(('write_behind', 'gauge', 'Contadores de la escritura diferida de predicciones.',
+                         [({'campo': k}, v) for k, v in prediction_writer.stats().items() if isinstance(v, (int, float))]))
+    # Tiempos por etapa del entrenamiento que produjo la versión activa
+    version = model_holder.version
+    path = os.path.join(model_store.directorio_version(version) if version else '.', 'training_stages.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            etapas = json.load(f)
+        familias.append(('training_stage_last_seconds', 'gauge', 'Duración de cada etapa del último entrenamiento.',
+                         [({'stage': nombre}, v['segundos']) for nombre, v in etapas.items()]))
+    except (FileNotFoundError, ValueError):
+        pass
+    return familias
+
+
+def armar_registro(features: dict, prediction: float, requested_at: datetime) -> dict:
+    return serving_core.armar_registro(features, prediction, requested_at, metricas_cache)
+
+
+def guardar_predicciones(records: list):
+    with etapa('bd'):
+        if prediction_writer is not None:
+            prediction_writer.submit(records)
+            return
+        # Con varios registros el driver los envía como un único INSERT multi-fila
+        with engine.begin() as conn:
+            conn.execute(INSERT_PREDICTION_SQL, records)
+
+
+def predecir_con_cache(filas: list, version, model) -> list:
+    """
+    Como predecir_filas, pero consultando antes la caché de predicciones: solo
+    las filas sin acierto pasan por el modelo. Devuelve (prediccion, error, acierto).
+    """
+    claves = [clave_canonica(f, version) for f in filas] if prediction_cache is not None else [None] * len(filas)
+    cacheadas = [prediction_cache.get(c) if c else None for c in claves]
+    faltantes = [i for i, p in enumerate(cacheadas) if p is None]
+    resultados = [(p, None, True) for p in cacheadas]
+    if faltantes:
+        for i, (prediction, error) in zip(faltantes, predecir_filas([filas[i] for i in faltantes], model)):
+            resultados[i] = (prediction, error, False)
+            if error is None and claves[i]:
+                prediction_cache.set(claves[i], prediction)
+    return resultados
+
+
+def indice_comparables():
+    """Índice de comparables vigente, o None si no hay publicaciones que cargar."""
+    try:
+        return comparables_cache.get()
+    except (KeyError, OSError) as e:
+        app.logger.warning(f"Comparables no disponibles: {e}")
+        return None
+
+
+def k_comparables(valor) -> int:
+    # Sin valor o 'true': los COMPARABLES_K por defecto; un número: esa cantidad
+    if valor is None or str(valor).strip().lower() in ('', 'true'):
+        return COMPARABLES_K
+    try:
+        k = int(valor)
+    except (TypeError, ValueError):
+        k = 0
+    if not 1 <= k <= COMPARABLES_K_MAX:
+        raise ValueError(f"La cantidad de comparables debe ser un entero entre 1 y {COMPARABLES_K_MAX}")
+    return k
+
+
+def buscar_comparables(features: dict, k: int):
+    indice = indice_comparables()
+    if indice is None:
+        return None
+    with etapa('comparables'):
+        return indice.buscar(features, k)
+
+
+# El índice de comparables se arma al arrancar, no en el primer request
+indice_comparables()
+
+
 @app.route('/predict', methods=['POST'])
 def predict_endpoint():
     try:
         data = request.get_json(force=True)
-        lat = data.get('latitud')
-        lon = data.get('longitud')
-        if lat is None or lon is None:
-            return jsonify({'error': "Debes enviar las coordenadas 'latitud' y 'longitud'"}), 400
-
-        raw = data.get('Comuna') or data.get('comuna')
-        if raw:
-            comuna = normalize_str(raw)
-        else:
-            try:
-                fallback = get_comuna_from_coords(lat, lon, comuna_file).strip().lower()
-                comuna = normalize_str(fallback)
-            except ValueError as ve:
-                return jsonify({'error': str(ve)}), 400
-
-        # 3) Validar región
-        region = COMUNA_REGION_MAP.get(comuna)
-        if not region:
-            return jsonify({'error': f"Comuna '{comuna}' no está permitida"}), 400
-
-        # 4) Armar payload unificado
-        features = {**data, 'Comuna': comuna, 'Region': region, 'divisa': 'UF'}
-
-        # 5) Calcular distancias
-        punto = create_point_gdf(lat, lon)
-        features['distancia_ed_superior_km'] = calculate_nearest_distances(punto, ed_sup)[0]
-        features['distancia_ed_escolar_km']  = calculate_nearest_distances(punto, ed_esc)[0]
-        features['distancia_comisaria_km']   = calculate_nearest_distances(punto, comi)[0]
-        features['distancia_est_salud_km']   = calculate_nearest_distances(punto, salud)[0]
-        features['distancia_metro_km']       = calculate_nearest_distances_metro(punto, metro)[0]
-
-        # 6) Predecir
-        df_new = pd.DataFrame([features])
-        prediction = model.predict(df_new)[0]
-
-        # 7) Métricas por comuna
-        metricas_comuna_df = metricas_comuna()
-        metricas_comuna_df['comuna_norm'] = metricas_comuna_df['Comuna'].apply(normalize_str)
-        cm = metricas_comuna_df[metricas_comuna_df['comuna_norm'] == comuna]
-
-        if cm.empty:
-            avg_price_uf          = 0.0
-            superficie_util_prom  = 0.0
-            nro_propiedades       = 0
-        else:
-          comuna_metrics       = cm.iloc[0]
-          avg_price_uf            = comuna_metrics['avg_price_uf']
-          superficie_util_prom    = comuna_metrics['superficie']
-          nro_propiedades         = comuna_metrics['n_properties']
-
-        # 8) Guardar en BD
-        record = {
-            **features,
-            'antiguedad': 0,
-            'prediction_uf':       float(prediction),
-            'avg_price_uf':        float(avg_price_uf),
-            'avg_price_uf_m2':     float(superficie_util_prom),
-            'n_properties':        int(nro_propiedades),
-            'requested_at':        datetime.now()
-        }
-        insert_sql = text("""
-            INSERT INTO model_predictions (
-                divisa, tipo, superficie_util, superficie_total,
-                antiguedad, dormitorios, banos,
-                comuna, region, latitud, longitud,
-                distancia_ed_superior_km, distancia_ed_escolar_km,
-                distancia_comisaria_km, distancia_est_salud_km,
-                distancia_metro_km, prediction_uf,
-                avg_price_uf, avg_price_uf_m2, n_properties, requested_at
-            ) VALUES (
-                :divisa, :tipo, :superficie_util, :superficie_total,
-                :antiguedad, :dormitorios, :banos,
-                :Comuna, :Region, :latitud, :longitud,
-                :distancia_ed_superior_km, :distancia_ed_escolar_km,
-                :distancia_comisaria_km, :distancia_est_salud_km,
-                :distancia_metro_km, :prediction_uf,
-                :avg_price_uf, :avg_price_uf_m2, :n_properties, :requested_at
-            )
-        """)
-        with engine.begin() as conn:
-            conn.execute(insert_sql, record)
+        k = k_comparables(request.args['comparables']) if 'comparables' in request.args else None
+
+        # 1-5) Comuna, región y distancias
+        lote, errores = preparar_lote([data], comuna_resolver, COMUNA_REGION_MAP, spatial_index,
+                                      distance_cache, FIRMA_INDICE)
+        if errores[0]:
+            return jsonify({'error': errores[0]}), 400
+        features = lote[0]
+
+        # 6) Predecir, o tomar la predicción de la caché
+        version, model = model_holder.get()
+        prediction, error, acierto = predecir_con_cache([features], version, model)[0]
+        if error is not None:
+            return jsonify({'error': error}), 400
+
+        # 7-8) Métricas por comuna y guardar en BD
+        record = armar_registro(features, prediction, datetime.now())
+        if not acierto or PREDICTION_CACHE_PERSIST_HITS:
+            guardar_predicciones([record])
+
+        # 9) Respuesta JSON, con las publicaciones comparables si se pidieron (?comparables=k)
+        respuesta = respuesta_prediccion(record)
+        if k is not None:
+            respuesta['comparables'] = buscar_comparables(features, k)
+        return jsonify(respuesta), 200
+
+    except Exception as e:
+        app.logger.error(f"Error in predict_endpoint: {e}")
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_endpoint():
+    """
+    Estima el valor de varias propiedades en una sola llamada.
+    ---
+    tags:
+      - Valuaciones
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            propiedades:
+              type: array
+              items:
+                type: object
+    responses:
+      200:
+        description: Un resultado por propiedad, en el mismo orden; los elementos inválidos traen 'error'
+      400:
+        description: Cuerpo inválido
+    """
+    try:
+        data = request.get_json(force=True)
+        items = data.get('propiedades') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': "Debes enviar una lista no vacía en 'propiedades'"}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f"Máximo {BATCH_MAX_ITEMS} propiedades por lote"}), 400
+
+        # Comunas, regiones y distancias para todo el lote
+        lote, errores = preparar_lote(items, comuna_resolver, COMUNA_REGION_MAP, spatial_index,
+                                      distance_cache, FIRMA_INDICE)
+        validos = [i for i, err in enumerate(errores) if err is None]
+
+        # Una sola llamada al modelo para todas las filas válidas
+        _, model = model_holder.get()
+        requested_at = datetime.now()
+        registros = {}
+        for i, (prediction, error) in zip(validos, predecir_filas([lote[i] for i in validos], model)):
+            if error is None:
+                registros[i] = armar_registro(lote[i], prediction, requested_at)
+            else:
+                errores[i] = error
+
+        # Un solo INSERT multi-fila
+        if registros:
+            guardar_predicciones(list(registros.values()))
+
+        resultados = []
+        for i in range(len(items)):
+            if i in registros:
+                resultados.append({'index': i, **respuesta_prediccion(registros[i])})
+            else:
+                resultados.append({'index': i, 'error': errores[i]})
 
-        # 9) Respuesta JSON
         return jsonify({
-            'prediction_uf':                    float(prediction),
-            'comuna':                           comuna,
-            'valor_promedio_propiedades_comuna': float(avg_price_uf),
-            'superficie_util_promedio_comuna':   float(superficie_util_prom),
-            'cantidad_propiedades_comuna':       int(nro_propiedades)
+            'resultados': resultados,
+            'n_ok': len(registros),
+            'n_error': len(items) - len(registros)
         }), 200
 
     except Exception as e:
-        app.logger.error(f"Error in predict_endpoint: {e}")
+        app.logger.error(f"Error in predict_batch_endpoint: {e}")
         return jsonify({'error': str(e)}), 400
-        
 
 
-@app.route('/retrain', methods=['POST'])
-def retrain_endpoint():
+@app.route('/comparables', methods=['POST'])
+def comparables_endpoint():
+    """
+    Publicaciones del entrenamiento más parecidas a una propiedad, por ubicación y atributos.
+    ---
+    tags:
+      - Valuaciones
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required: [tipo, latitud, longitud]
+          properties:
+            tipo:
+              type: string
+            superficie_util:
+              type: number
+            superficie_total:
+              type: number
+            dormitorios:
+              type: integer
+            banos:
+              type: integer
+            latitud:
+              type: number
+            longitud:
+              type: number
+            k:
+              type: integer
+              description: Cantidad de comparables (por defecto COMPARABLES_K)
+    responses:
+      200:
+        description: Comparables ordenados del más al menos parecido
+      400:
+        description: Cuerpo inválido
+      503:
+        description: No hay publicaciones cargadas
+    """
+    try:
+        data = request.get_json(force=True)
+        if not isinstance(data, dict) or not data.get('tipo'):
+            return jsonify({'error': "Debes informar 'tipo'"}), 400
+        try:
+            float(data.get('latitud'))
+            float(data.get('longitud'))
+        except (TypeError, ValueError):
+            return jsonify({'error': "'latitud' y 'longitud' deben ser numéricas"}), 400
+        k = k_comparables(data.get('k'))
+
+        indice = indice_comparables()
+        if indice is None:
+            return jsonify({'error': 'No hay publicaciones cargadas para buscar comparables'}), 503
+        with etapa('comparables'):
+            comparables = indice.buscar(data, k)
+        if comparables is None:
+            return jsonify({'error': f"No hay publicaciones de tipo '{data['tipo']}'"}), 400
+        return jsonify({'comparables': comparables, 'k': k}), 200
 
-    # Autenticación
+    except Exception as e:
+        app.logger.error(f"Error in comparables_endpoint: {e}")
+        return jsonify({'error': str(e)}), 400
+
+
+def verificar_token():
+    # Devuelve una respuesta de error si el JWT no es válido, None si lo es
     auth = request.headers.get('Authorization', '')
     if not auth.startswith('Bearer '):
         return jsonify(error='Missing or invalid Authorization header'), 401
@@ -214,19 +415,97 @@ def retrain_endpoint():
         jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
     except jwt.InvalidTokenError:
         return jsonify(error='Invalid token'), 401
+    return None
+
+
+@app.route('/retrain', methods=['POST'])
+def retrain_endpoint():
+
+    # Autenticación
+    error = verificar_token()
+    if error is not None:
+        return error
+
+    # Lanzar entrenamiento en segundo plano
+    try:
+        job = retrain_jobs.lanzar()
+    except model_store.JobEnCurso as e:
+        return jsonify(status='running', message=str(e), job_id=e.job['job_id']), 409
+
+    return jsonify(status='accepted', job_id=job['job_id'], version=job['version'],
+                   status_url=f"/retrain/{job['job_id']}"), 202
+
 
-    # Lanzar entrenamiento (nota: esto bloqueará la petición)
-    proc = subprocess.run(['python3', 'train_model.py'], capture_output=True, text=True)
-    if proc.returncode != 0:
-        return jsonify(status='error', message=proc.stderr), 500
+@app.route('/retrain/<job_id>', methods=['GET'])
+def retrain_status_endpoint(job_id):
 
-    # Recargar modelo
-    global model
-    model = joblib.load(MODEL_PATH)
+    # Autenticación
+    error = verificar_token()
+    if error is not None:
+        return error
+
+    job = retrain_jobs.estado(job_id)
+    if job is None:
+        return jsonify(error=f"Job '{job_id}' no encontrado"), 404
+
+    respuesta = {**job, 'active_version': model_store.version_actual()}
+    if job['status'] == 'succeeded':
+        # Devolver token nuevo opcionalmente
+        respuesta['message'] = 'Model retrained'
+        respuesta['token'] = jwt.encode({'retrained_at': job['finished_at']}, SECRET_KEY, algorithm='HS256')
+    return jsonify(respuesta), 200
+
+@app.route('/metrics/db', methods=['GET'])
+def metrics_db_endpoint():
+    """
+    Estado del pool de conexiones y de la cola de escritura de predicciones.
+    ---
+    tags:
+      - Valuaciones
+    responses:
+      200:
+        description: Métricas de persistencia
+    """
+    return jsonify({
+        'pool': engine.pool.status(),
+        'write_behind': prediction_writer.stats() if prediction_writer is not None else None
+    }), 200
+
+
+@app.route('/metrics/cache', methods=['GET'])
+def metrics_cache_endpoint():
+    """
+    Aciertos y fallos de las cachés de predicciones y de distancias, y modelos por región residentes (por worker).
+    ---
+    tags:
+      - Valuaciones
+    responses:
+      200:
+        description: Contadores de las cachés; null si una caché está desactivada
+    """
+    model = model_holder.get()[1]
+    return jsonify({
+        'prediction': prediction_cache.stats() if prediction_cache is not None else None,
+        'distance': distance_cache.stats() if distance_cache is not None else None,
+        'region_models': model.stats() if hasattr(model, 'stats') else None
+    }), 200
+
+
+@app.route('/metrics/prometheus', methods=['GET'])
+def metrics_prometheus_endpoint():
+    """
+    Métricas de operación en formato de texto de Prometheus.
+    ---
+    tags:
+      - Valuaciones
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Histogramas de latencia por etapa y endpoint, requests, cachés y versión del modelo
+    """
+    return Response(instrumentation.registro.exponer(), mimetype='text/plain; version=0.0.4')
 
-    # Devolver token nuevo opcionalmente
-    new_token = jwt.encode({'retrained_at': datetime.now().isoformat()}, SECRET_KEY, algorithm='HS256')
-    return jsonify(status='success', message='Model retrained', token=new_token), 200
 
 @app.route('/metrics', methods=['GET'])
 def metrics_endpoint():
@@ -247,8 +526,10 @@ def metrics_endpoint():
               type: object
     """
     try:
-        # Cargar métricas desde archivo JSON
-        with open('metrics.json', 'r') as f:
+        # Cargar métricas desde archivo JSON (de la versión activa si el modelo está versionado)
+        version = model_holder.version
+        metrics_path = os.path.join(model_store.directorio_version(version), 'metrics.json') if version else 'metrics.json'
+        with open(metrics_path, 'r') as f:
             data = json.load(f)
         return jsonify(data), 200
     except FileNotFoundError:
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import app as core
+import instrumentation
+from features import preparar_lote
+
+
+# Modo de serving asíncrono (ASGI) para /predict con micro-batching. Reutiliza el
+# estado cargado por app.py (modelo, índices, cachés, BD); el resto de los
+# endpoints sigue en la app Flask.
+#   uvicorn async_app:app --workers 4
+ASYNC_BATCH_MAX_ITEMS = int(os.getenv('ASYNC_BATCH_MAX_ITEMS', 64))
+ASYNC_BATCH_MAX_WAIT_MS = float(os.getenv('ASYNC_BATCH_MAX_WAIT_MS', 5))
+ASYNC_QUEUE_MAX = int(os.getenv('ASYNC_QUEUE_MAX', 2000))
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 2))
+
+logger = logging.getLogger(__name__)
+
+
+class ColaLlena(Exception):
+    pass
+
+
+def procesar_lote(items: list) -> tuple:
+    """
+    Features, predicción y registro de un lote de payloads de /predict (corre
+    en el executor). Devuelve una lista alineada con `items` de (registro,
+    error) y los registros a persistir.
+    """
+    lote, errores = preparar_lote(items, core.comuna_resolver, core.COMUNA_REGION_MAP, core.spatial_index,
+                                  core.distance_cache, core.FIRMA_INDICE)
+    validos = [i for i, err in enumerate(errores) if err is None]
+    version, model = core.model_holder.get()
+    requested_at = datetime.now()
+    resultados = [(None, err) for err in errores]
+    persistir = []
+    for i, (prediction, error, acierto) in zip(validos, core.predecir_con_cache([lote[i] for i in validos], version, model)):
+        if error is not None:
+            resultados[i] = (None, error)
+            continue
+        record = core.armar_registro(lote[i], prediction, requested_at)
+        resultados[i] = (record, None)
+        if not acierto or core.PREDICTION_CACHE_PERSIST_HITS:
+            persistir.append(record)
+    return resultados, persistir
+
+
+class MicroBatcher:
+    """
+    Junta los requests concurrentes en lotes de hasta `max_items` o hasta que
+    pasen `max_wait_ms` desde el primero, y procesa cada lote con una sola
+    llamada a `procesar` en `executor` (un hilo: el modelo ya paraleliza por
+    dentro y así los lotes no compiten por CPU). La escritura en BD de un lote
+    corre en `db_executor` mientras se arma y procesa el siguiente; las
+    respuestas salen cuando su lote quedó guardado.
+    """
+
+    def __init__(self, procesar, guardar, max_items: int = 64, max_wait_ms: float = 5,
+                 max_queue: int = 2000, db_threads: int = 2):
+        self.procesar = procesar
+        self.guardar = guardar
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='microbatch')
+        self.db_executor = ThreadPoolExecutor(db_threads, thread_name_prefix='microbatch-db')
+        self._queue = None
+        self._tarea = None
+        self._pendientes = set()
+        self.stats_counters = {'requests': 0, 'lotes': 0, 'rechazados': 0, 'max_lote': 0,
+                               'segundos_modelo': 0.0, 'segundos_bd': 0.0}
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tarea = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+        # Los lotes ya procesados terminan de guardarse antes de cerrar
+        if self._pendientes:
+            await asyncio.gather(*self._pendientes, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+        self.db_executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, futuro))
+        except asyncio.QueueFull:
+            # Mejor rechazar que dejar crecer la cola y con ella la latencia de todos
+            self.stats_counters['rechazados'] += 1
+            raise ColaLlena(f"Más de {self.max_queue} requests en espera")
+        self.stats_counters['requests'] += 1
+        return await futuro
+
+    async def _lote(self) -> list:
+        lote = [await self._queue.get()]
+        limite = time.monotonic() + self.max_wait
+        while len(lote) < self.max_items:
+            # Lo que ya está en la cola se toma sin esperar
+            if not self._queue.empty():
+                lote.append(self._queue.get_nowait())
+                continue
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._queue.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = await self._lote()
+            # Requests cuyo cliente ya se fue no se procesan
+            lote = [(item, fut) for item, fut in lote if not fut.done()]
+            if not lote:
+                continue
+            self.stats_counters['lotes'] += 1
+            self.stats_counters['max_lote'] = max(self.stats_counters['max_lote'], len(lote))
+            t0 = time.perf_counter()
+            try:
+                resultados, persistir = await loop.run_in_executor(self.executor, self.procesar, [item for item, _ in lote])
+            except Exception as e:
+                logger.error(f"Error procesando lote de {len(lote)}: {e}")
+                # El lote mezcla clientes: un request que rompe el lote no puede arrastrar a los demás
+                lote, resultados, persistir = await self._procesar_por_separado(lote)
+                if not lote:
+                    continue
+            finally:
+                self.stats_counters['segundos_modelo'] += time.perf_counter() - t0
+            tarea = loop.create_task(self._guardar_y_responder(lote, resultados, persistir))
+            self._pendientes.add(tarea)
+            tarea.add_done_callback(self._pendientes.discard)
+
+    async def _procesar_por_separado(self, lote: list) -> tuple:
+        """
+        Procesa cada request del lote por su cuenta; los que fallan reciben su
+        propia excepción. Devuelve el lote, resultados y registros de los que
+        salieron bien.
+        """
+        loop = asyncio.get_running_loop()
+        ok, resultados, persistir = [], [], []
+        for item, fut in lote:
+            try:
+                resultado, guardar = await loop.run_in_executor(self.executor, self.procesar, [item])
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+                continue
+            ok.append((item, fut))
+            resultados.extend(resultado)
+            persistir.extend(guardar)
+        return ok, resultados, persistir
+
+    async def _guardar_y_responder(self, lote: list, resultados: list, persistir: list):
+        error_bd = None
+        if persistir:
+            t0 = time.perf_counter()
+            try:
+                # Un solo INSERT multi-fila por lote, fuera del event loop
+                await asyncio.get_running_loop().run_in_executor(self.db_executor, self.guardar, persistir)
+            except Exception as e:
+                logger.error(f"Error guardando lote de {len(persistir)}: {e}")
+                error_bd = e
+            finally:
+                self.stats_counters['segundos_bd'] += time.perf_counter() - t0
+        for (_, fut), resultado in zip(lote, resultados):
+            if fut.done():
+                continue
+            if error_bd is not None and resultado[0] is not None:
+                fut.set_exception(error_bd)
+            else:
+                fut.set_result(resultado)
+
+    def stats(self) -> dict:
+        lotes = self.stats_counters['lotes']
+        return {**self.stats_counters,
+                'en_cola': self._queue.qsize() if self._queue is not None else 0,
+                'lote_promedio': self.stats_counters['requests'] / lotes if lotes else None,
+                'max_items': self.max_items,
+                'max_wait_ms': self.max_wait * 1000}
+
+
+batcher = MicroBatcher(procesar_lote, core.guardar_predicciones,
+                       max_items=ASYNC_BATCH_MAX_ITEMS, max_wait_ms=ASYNC_BATCH_MAX_WAIT_MS,
+                       max_queue=ASYNC_QUEUE_MAX, db_threads=ASYNC_DB_THREADS)
+
+
+async def _leer_cuerpo(receive) -> bytes:
+    partes = []
+    while True:
+        mensaje = await receive()
+        partes.append(mensaje.get('body', b''))
+        if not mensaje.get('more_body', False):
+            return b''.join(partes)
+
+
+async def _responder(send, status: int, cuerpo: dict):
+    # Mismo formato que jsonify de Flask (claves ordenadas)
+    data = json.dumps(cuerpo, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+@instrumentation.registro.colector
+def metricas_batcher() -> list:
+    stats = batcher.stats()
+    return [('microbatch', 'gauge', 'Contadores del micro-batching del modo asíncrono.',
+             [({'campo': k}, v) for k, v in stats.items() if isinstance(v, (int, float))])]
+
+
+async def predict(scope, receive, send):
+    try:
+        data = json.loads(await _leer_cuerpo(receive))
+    except ValueError as e:
+        return await _responder(send, 400, {'error': f"JSON inválido: {e}"})
+    # ?comparables=k, como en el /predict de Flask
+    parametros = parse_qs(scope.get('query_string', b'').decode('utf-8'), keep_blank_values=True)
+    try:
+        k = core.k_comparables(parametros['comparables'][-1]) if 'comparables' in parametros else None
+    except ValueError as e:
+        return await _responder(send, 400, {'error': str(e)})
+    try:
+        record, error = await batcher.submit(data)
+    except ColaLlena as e:
+        return await _responder(send, 503, {'error': str(e)})
+    except Exception as e:
+        logger.error(f"Error in async predict: {e}")
+        return await _responder(send, 400, {'error': str(e)})
+    if error is not None:
+        return await _responder(send, 400, {'error': error})
+    respuesta = core.respuesta_prediccion(record)
+    if k is not None:
+        # La búsqueda en el KD-tree va fuera del event loop; el registro trae las features del request
+        respuesta['comparables'] = await asyncio.get_running_loop().run_in_executor(
+            None, core.buscar_comparables, record, k)
+    return await _responder(send, 200, respuesta)
+
+
+async def _lifespan(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            batcher.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            await batcher.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _exponer_prometheus(send):
+    data = instrumentation.registro.exponer().encode('utf-8')
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/plain; version=0.0.4'), (b'content-length', str(len(data)).encode())]})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    ruta, metodo = scope['path'], scope['method']
+    if ruta == '/predict' and metodo == 'POST':
+        t0 = time.perf_counter()
+        estado = {}
+
+        async def send_medido(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                estado['status'] = mensaje['status']
+            await send(mensaje)
+
+        await predict(scope, receive, send_medido)
+        instrumentation.registro.observar('request_seconds', time.perf_counter() - t0, endpoint=ruta, method=metodo)
+        instrumentation.registro.incrementar('requests_total', endpoint=ruta, method=metodo,
+                                             status=str(estado.get('status', 500)))
+        instrumentation.registro.volcar()
+        return
+    if ruta == '/metrics/batching' and metodo == 'GET':
+        return await _responder(send, 200, batcher.stats())
+    if ruta == '/metrics/prometheus' and metodo == 'GET':
+        return await _exponer_prometheus(send)
+    return await _responder(send, 404, {'error': f"Ruta no disponible en el modo asíncrono: {metodo} {ruta}"})
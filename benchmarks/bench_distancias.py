@@ -0,0 +1,97 @@
+"""
+Benchmark de las features de distancia: método histórico (árbol nuevo por
+llamada, grados * R*pi/180) contra los índices de SpatialIndexRegistry en modo
+'planar' y 'geodesic'.
+
+Uso:
+    python benchmarks/bench_distancias.py --n 2000 --repeticiones 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import geopandas as gpd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import calculate_nearest_distances, calculate_nearest_distances_metro
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS
+
+
+DEFAULT_PATHS = {name: f'data_preprocessed/{name}.parquet' for name in POINT_LAYERS + LINE_LAYERS}
+# Gran Santiago, donde se concentran las consultas
+BBOX = (-70.85, -33.65, -70.45, -33.30)
+
+
+def haversine_km(lon1, lat1, lon2, lat2) -> np.ndarray:
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
+
+
+def puntos_aleatorios(n: int, seed: int = 42) -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(BBOX[0], BBOX[2], n)
+    lat = rng.uniform(BBOX[1], BBOX[3], n)
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+
+
+def cronometrar(fn, repeticiones: int) -> float:
+    # Mediana en ms por llamada
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return float(np.median(tiempos))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=2000, help='Puntos por consulta por lotes')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--salida', help='Archivo JSON con los resultados')
+    args = parser.parse_args()
+
+    layers = {name: gpd.read_parquet(path) for name, path in DEFAULT_PATHS.items()}
+    planar = SpatialIndexRegistry.from_layers(layers, modes={name: 'planar' for name in layers})
+    geodesic = SpatialIndexRegistry.from_layers(layers, modes={name: 'geodesic' for name in layers})
+
+    src = puntos_aleatorios(args.n)
+    uno = src.iloc[[0]]
+    resultados = {}
+    for name, gdf in layers.items():
+        legacy = calculate_nearest_distances if name in POINT_LAYERS else calculate_nearest_distances_metro
+        d_planar = planar.nearest_km(name, src)
+        d_geo = geodesic.nearest_km(name, src)
+        r = {
+            'ms_historico_1_punto': cronometrar(lambda: legacy(uno, gdf), args.repeticiones),
+            'ms_planar_1_punto': cronometrar(lambda: planar.nearest_km(name, uno), args.repeticiones),
+            'ms_geodesic_1_punto': cronometrar(lambda: geodesic.nearest_km(name, uno), args.repeticiones),
+            'ms_historico_lote': cronometrar(lambda: legacy(src, gdf), args.repeticiones),
+            'ms_planar_lote': cronometrar(lambda: planar.nearest_km(name, src), args.repeticiones),
+            'ms_geodesic_lote': cronometrar(lambda: geodesic.nearest_km(name, src), args.repeticiones),
+            'dif_planar_vs_geodesic_km_media': float(np.nanmean(np.abs(d_planar - d_geo))),
+            'dif_planar_vs_geodesic_km_max': float(np.nanmax(np.abs(d_planar - d_geo))),
+        }
+        if name in POINT_LAYERS:
+            # Referencia exacta: haversine por fuerza bruta contra todos los POI
+            tgt = gdf.to_crs(epsg=4326)
+            sx, sy = src.geometry.x.to_numpy(), src.geometry.y.to_numpy()
+            tx, ty = tgt.geometry.x.to_numpy(), tgt.geometry.y.to_numpy()
+            exacta = np.array([haversine_km(x, y, tx, ty).min() for x, y in zip(sx, sy)])
+            r['error_planar_km_max'] = float(np.max(np.abs(d_planar - exacta)))
+            r['error_geodesic_km_max'] = float(np.max(np.abs(d_geo - exacta)))
+        resultados[name] = r
+
+    print(json.dumps(resultados, indent=4))
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Microbenchmarks del camino de serving y de las funciones de utils.py:
+limpieza y preparación de datos, distancias, resolución de comuna desde
+coordenadas (ComunaResolver, que reemplazó a get_comuna_from_coords),
+métricas por comuna, comparables y predicción del modelo activo, con 1 fila y con un
+lote de payloads sintéticos (ver payloads.py).
+
+Carga el mismo estado que la app (bundle de serving o fuentes), así que usa
+las mismas variables de entorno; no escribe en la base de datos.
+
+Uso:
+    python benchmarks/bench_serving.py --n 1000 --repeticiones 30 \
+        --salida bench_serving.json --baseline benchmarks/baseline_serving.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Sin base de datos real: la app se importa contra una SQLite descartable
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'valuaciones_bench.sqlite')}")
+
+import utils
+import data_metrics
+from spatial_index import POINT_LAYERS
+from payloads import payloads_desde_fuentes
+from resultados import medir, documento, cerrar, agregar_argumentos
+
+
+DESCRIPCIONES = ['Depto 2 dormitorios, 1 estacionamiento', 'Casa 4 dorms 2 estac.', 'N/A', '',
+                 'Amplio, 3 habitaciones y parking', None]
+
+
+def listado_sintetico(payloads: list, seed: int = 42) -> pd.DataFrame:
+    """Filas con la forma de la extracción de la BD (texto sucio incluido) para las funciones de limpieza."""
+    rng = np.random.default_rng(seed)
+    n = len(payloads)
+    df = pd.DataFrame(payloads)
+    df['divisa'] = rng.choice(['UF', '$', 'US$'], n, p=[0.8, 0.15, 0.05])
+    df['precio'] = np.where(df['divisa'] == 'UF', rng.uniform(1500, 15000, n), rng.uniform(5e7, 5e8, n))
+    df['desc'] = rng.choice(np.array(DESCRIPCIONES, dtype=object), n)
+    df['dormitorios'] = np.where(rng.random(n) < 0.2, '', df['dormitorios'].astype(str))
+    df['estacionamientos'] = rng.choice(np.array(['1', '', 'nan', None, '2 estac.'], dtype=object), n)
+    df['superficie_texto'] = [f"{s:.2f} m²".replace('.', ',') if i % 3 else f"{s:.1f}"
+                              for i, s in enumerate(df['superficie_util'])]
+    df['antiguedad'] = rng.choice([0, 5, 12, 1998, 2015], n).astype(float)
+    return df
+
+
+def bench_utils(payloads: list, repeticiones: int, capas: dict) -> dict:
+    n = len(payloads)
+    df = listado_sintetico(payloads)
+    comunas = [p.get('comuna') or 'Ñuñoa' for p in payloads]
+    src = utils.geometry_points(pd.DataFrame(payloads))
+    uno = src.iloc[[0]]
+    puntos = capas[POINT_LAYERS[0]]
+    metro = capas['metro']
+    crs_metro = utils.local_aeqd_crs(metro)
+    metro_proyectado = metro.to_crs(crs_metro)
+
+    r = {
+        'normalize_str': medir(lambda: [utils.normalize_str(c) for c in comunas], repeticiones, filas=n),
+        'convertir_precio': medir(lambda: utils.convertir_precio(df, 38000.0), repeticiones, filas=n),
+        'limpieza': medir(lambda: df['superficie_texto'].map(utils.limpieza), repeticiones, filas=n),
+        'limpieza_serie': medir(lambda: utils.limpieza_serie(df['superficie_texto']), repeticiones, filas=n),
+        'recalcula_antiguedad': medir(lambda: df['antiguedad'].map(utils.recalcula_antiguedad), repeticiones, filas=n),
+        'rellenar_dormitorios': medir(lambda: utils.rellenar_dormitorios(df.copy()), repeticiones, filas=n),
+        'rellenar_estacionamientos': medir(lambda: utils.rellenar_estacionamientos(df.copy()), repeticiones, filas=n),
+        'preprocesar_nulos': medir(lambda: utils.preprocesar_nulos(df.copy()), repeticiones, filas=n),
+        'geometry_points': medir(lambda: utils.geometry_points(df), repeticiones, filas=n),
+        'create_point_gdf': medir(lambda: utils.create_point_gdf(payloads[0]['latitud'], payloads[0]['longitud']),
+                                  repeticiones),
+        'lonlat_to_unit_xyz': medir(lambda: utils.lonlat_to_unit_xyz(src.geometry.x, src.geometry.y),
+                                    repeticiones, filas=n),
+        'eliminar_outliers_iqr': medir(lambda: utils.eliminar_outliers_iqr(df, ['precio', 'superficie_util']),
+                                       repeticiones, filas=n),
+        'local_aeqd_crs': medir(lambda: utils.local_aeqd_crs(metro), repeticiones),
+        'build_segment_tree': medir(lambda: utils.build_segment_tree(metro), repeticiones),
+    }
+    # Distancias sin árbol previo (lo construyen en cada llamada), a 1 punto y al lote
+    for nombre, fn, tgt in [
+            ('calculate_nearest_distances', utils.calculate_nearest_distances, puntos),
+            ('calculate_nearest_distances_geodesic', utils.calculate_nearest_distances_geodesic, puntos),
+            ('calculate_nearest_distances_metro', utils.calculate_nearest_distances_metro, metro)]:
+        r[f'{nombre}_1'] = medir(lambda: fn(uno, tgt), repeticiones)
+        r[f'{nombre}_lote'] = medir(lambda: fn(src, tgt), repeticiones, filas=n)
+    r['calculate_nearest_distances_metro_geodesic_lote'] = medir(
+        lambda: utils.calculate_nearest_distances_metro_geodesic(src, metro_proyectado, crs=crs_metro,
+                                                                  tree=utils.build_segment_tree(metro_proyectado)),
+        repeticiones, filas=n)
+    return {f'utils.{k}': v for k, v in r.items()}
+
+
+def bench_serving(payloads: list, repeticiones: int) -> dict:
+    import app as core
+    import serving_core
+    from features import preparar_lote
+
+    n = len(payloads)
+    lats = [p['latitud'] for p in payloads]
+    lons = [p['longitud'] for p in payloads]
+    lote, errores = preparar_lote(payloads, core.comuna_resolver, core.COMUNA_REGION_MAP, core.spatial_index)
+    filas = [f for f in lote if f is not None]
+    comunas = [f['Comuna'] for f in filas]
+    version, model = core.model_holder.get()
+
+    r = {
+        'comuna.resolver_1': medir(lambda: core.comuna_resolver.comunas(lats[:1], lons[:1]), repeticiones),
+        'comuna.resolver_lote': medir(lambda: core.comuna_resolver.comunas(lats, lons), repeticiones, filas=n),
+        'metricas_comuna.calcular': medir(lambda: data_metrics.metricas_comuna(), repeticiones)
+        if os.getenv('DATA_METRICS_FILE') else None,
+        'metricas_comuna.consulta': medir(
+            lambda: [serving_core.metricas_de_comuna(core.metricas_cache, c) for c in comunas], repeticiones,
+            filas=len(comunas)),
+        'features.preparar_lote_1': medir(
+            lambda: preparar_lote(payloads[:1], core.comuna_resolver, core.COMUNA_REGION_MAP, core.spatial_index),
+            repeticiones),
+        'features.preparar_lote': medir(
+            lambda: preparar_lote(payloads, core.comuna_resolver, core.COMUNA_REGION_MAP, core.spatial_index),
+            repeticiones, filas=n),
+        'comparables.buscar_1': medir(lambda: core.buscar_comparables(filas[0], 5), repeticiones),
+        'modelo.predecir_1': medir(lambda: serving_core.predecir(filas[:1], model), repeticiones),
+        'modelo.predecir_lote': medir(lambda: serving_core.predecir(filas, model), repeticiones, filas=len(filas)),
+    }
+    if hasattr(model, 'predict_records') and os.path.exists(serving_core.MODEL_PATH):
+        # Referencia: el pipeline de sklearn sin compilar
+        import joblib
+        pipeline = joblib.load(serving_core.MODEL_PATH)
+        r['modelo.pipeline_predecir_1'] = medir(lambda: serving_core.predecir(filas[:1], pipeline), repeticiones)
+        r['modelo.pipeline_predecir_lote'] = medir(lambda: serving_core.predecir(filas, pipeline), repeticiones,
+                                                   filas=len(filas))
+    if core.prediction_cache is not None:
+        core.predecir_con_cache(filas, version, model)
+        r['modelo.predecir_con_cache_aciertos'] = medir(lambda: core.predecir_con_cache(filas, version, model),
+                                                        repeticiones, filas=len(filas))
+    if any(e is not None for e in errores):
+        print(f"{sum(e is not None for e in errores)} payloads rechazados por preparar_lote", file=sys.stderr)
+    return {k: v for k, v in r.items() if v is not None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=1000, help='Payloads por lote')
+    parser.add_argument('--repeticiones', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--solo', choices=['utils', 'serving'], help='Correr solo un grupo')
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    payloads = payloads_desde_fuentes(args.n, seed=args.seed)
+    resultados = {}
+    if args.solo in (None, 'utils'):
+        capas = {name: gpd.read_parquet(f'data_preprocessed/{name}.parquet') for name in (POINT_LAYERS[0], 'metro')}
+        resultados.update(bench_utils(payloads, args.repeticiones, capas))
+    if args.solo in (None, 'serving'):
+        resultados.update(bench_serving(payloads, args.repeticiones))
+
+    doc = documento('serving', resultados, {'n': args.n, 'repeticiones': args.repeticiones, 'seed': args.seed})
+    sys.exit(cerrar(doc, args.salida, args.baseline, args.tolerancia, args.guardar_baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Prueba de carga de punta a punta de /predict y /predict/batch con payloads
+sintéticos (ver payloads.py) y varios clientes concurrentes.
+
+Sin --url corre la app Flask en el mismo proceso (test client de Flask: todo
+el camino del request salvo la capa HTTP) contra una SQLite descartable para
+model_predictions, o contra la base que indique DATABASE_URL (p.ej. una
+MariaDB local). Con --url apunta a un servidor ya levantado (gunicorn,
+uvicorn async_app:app, Docker).
+
+Reporta latencia p50/p90/p99, requests y propiedades por segundo y, cuando
+puede leer la base, filas insertadas por segundo en model_predictions.
+
+Uso:
+    python benchmarks/load_test.py --requests 2000 --concurrencia 8 \
+        --salida load_test.json --baseline benchmarks/baseline_load.json
+    python benchmarks/load_test.py --url http://localhost:8080 --escenarios predict
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payloads import payloads_desde_fuentes
+from resultados import percentiles_ms, documento, cerrar, agregar_argumentos
+
+
+ESCENARIOS = ('predict', 'batch')
+SQLITE_DEFAULT = os.path.join(tempfile.gettempdir(), 'valuaciones_load_test.sqlite')
+
+
+class ClienteLocal:
+    """App Flask en el mismo proceso; un test client por hilo."""
+
+    def __init__(self):
+        import app as core
+        from persistence import crear_tabla_sqlite
+        self.core = core
+        if core.engine.url.get_backend_name() == 'sqlite':
+            crear_tabla_sqlite(core.engine)
+        self._local = threading.local()
+
+    def post(self, ruta: str, cuerpo) -> int:
+        if not hasattr(self._local, 'cliente'):
+            self._local.cliente = self.core.app.test_client()
+        return self._local.cliente.post(ruta, json=cuerpo).status_code
+
+    def filas_bd(self) -> int:
+        from sqlalchemy import text
+        writer = self.core.prediction_writer
+        if writer is not None:
+            # Con escritura diferida se espera a que la cola se vacíe
+            limite = time.monotonic() + 30
+            while writer.stats()['profundidad_cola'] and time.monotonic() < limite:
+                time.sleep(0.05)
+            time.sleep(writer.flush_interval)
+        with self.core.engine.connect() as conn:
+            return conn.execute(text("SELECT COUNT(*) FROM model_predictions")).scalar()
+
+
+class ClienteRemoto:
+    """Servidor ya levantado; una sesión HTTP por hilo."""
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, ruta: str, cuerpo) -> int:
+        import requests
+        if not hasattr(self._local, 'sesion'):
+            self._local.sesion = requests.Session()
+        try:
+            return self._local.sesion.post(f"{self.url}{ruta}", json=cuerpo, timeout=self.timeout).status_code
+        except requests.RequestException:
+            return 0
+
+    def filas_bd(self):
+        return None
+
+
+def cuerpos(escenario: str, payloads: list, siguiente, n_requests: int, lote: int, fraccion_repetidos: float,
+            rng: np.random.Generator) -> list:
+    """
+    Cuerpos de los requests. Las propiedades salen en orden de `siguiente`
+    (un ciclo sobre los payloads compartido entre escenarios, así ninguno
+    repite lo que ya mandó otro hasta agotarlos). Una `fraccion_repetidos` se
+    toma de un grupo chico de payloads frecuentes (aciertos de caché).
+    """
+    por_request = 1 if escenario == 'predict' else lote
+    total = n_requests * por_request
+    idx = np.fromiter(itertools.islice(siguiente, total), dtype=np.int64, count=total)
+    repetidos = rng.random(total) < fraccion_repetidos
+    idx[repetidos] = rng.integers(0, max(1, len(payloads) // 100), repetidos.sum())
+    if escenario == 'predict':
+        return [payloads[i] for i in idx]
+    return [{'propiedades': [payloads[i] for i in idx[k:k + lote]]} for k in range(0, total, lote)]
+
+
+def correr(cliente, ruta: str, cuerpos_req: list, concurrencia: int) -> tuple:
+    latencias = np.zeros(len(cuerpos_req))
+    estados = np.zeros(len(cuerpos_req), dtype=int)
+
+    def uno(i):
+        t0 = time.perf_counter()
+        estados[i] = cliente.post(ruta, cuerpos_req[i])
+        latencias[i] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as pool:
+        list(pool.map(uno, range(len(cuerpos_req))))
+    return latencias, estados, time.perf_counter() - t0
+
+
+def escenario(cliente, nombre: str, payloads: list, siguiente, args, rng) -> dict:
+    ruta = '/predict' if nombre == 'predict' else '/predict/batch'
+    por_request = 1 if nombre == 'predict' else args.lote
+    calentamiento = cuerpos(nombre, payloads, siguiente, args.calentamiento, args.lote, 0, rng)
+    correr(cliente, ruta, calentamiento, args.concurrencia)
+
+    req = cuerpos(nombre, payloads, siguiente, args.requests, args.lote, args.fraccion_repetidos, rng)
+    filas_antes = cliente.filas_bd()
+    latencias, estados, segundos = correr(cliente, ruta, req, args.concurrencia)
+    filas_despues = cliente.filas_bd()
+
+    ok = estados == 200
+    r = {
+        'requests': len(req),
+        'errores': int((~ok).sum()),
+        'estados': {str(k): int(v) for k, v in zip(*np.unique(estados, return_counts=True))},
+        **percentiles_ms(latencias),
+        'req_por_s': len(req) / segundos,
+        'propiedades_por_s': int(ok.sum()) * por_request / segundos,
+    }
+    if filas_antes is not None:
+        r['filas_bd'] = filas_despues - filas_antes
+        r['filas_bd_por_s'] = r['filas_bd'] / segundos
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Servidor a probar (por defecto, la app en el mismo proceso)')
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS), help='predict, batch o ambos')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests por escenario')
+    parser.add_argument('--concurrencia', type=int, default=8)
+    parser.add_argument('--lote', type=int, default=100, help='Propiedades por request en /predict/batch')
+    parser.add_argument('--calentamiento', type=int, default=20, help='Requests previos que no se miden')
+    parser.add_argument('--fraccion-repetidos', type=float, default=0.0,
+                        help='Fracción de propiedades repetidas (aciertos de caché)')
+    parser.add_argument('--payloads', type=int, default=20000,
+                        help='Payloads sintéticos distintos (al reciclarse empiezan los aciertos de caché)')
+    parser.add_argument('--seed', type=int, default=42)
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    escenarios = [e.strip() for e in args.escenarios.split(',') if e.strip()]
+    invalidos = set(escenarios) - set(ESCENARIOS)
+    if invalidos:
+        parser.error(f"Escenarios no soportados: {sorted(invalidos)}")
+
+    if args.url:
+        cliente = ClienteRemoto(args.url)
+    else:
+        if 'DATABASE_URL' not in os.environ:
+            if os.path.exists(SQLITE_DEFAULT):
+                os.remove(SQLITE_DEFAULT)
+            os.environ['DATABASE_URL'] = f"sqlite:///{SQLITE_DEFAULT}"
+        cliente = ClienteLocal()
+
+    payloads = payloads_desde_fuentes(args.payloads, seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+    siguiente = itertools.cycle(range(len(payloads)))
+    resultados = {f'load.{nombre}': escenario(cliente, nombre, payloads, siguiente, args, rng)
+                  for nombre in escenarios}
+
+    parametros = {k: v for k, v in vars(args).items()
+                  if k not in ('salida', 'baseline', 'tolerancia', 'guardar_baseline')}
+    parametros['destino'] = args.url or 'en_proceso'
+    doc = documento('load_test', resultados, parametros)
+    sys.exit(cerrar(doc, args.salida, args.baseline, args.tolerancia, args.guardar_baseline))
+
+
+if __name__ == '__main__':
+    main()
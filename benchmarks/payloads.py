@@ -0,0 +1,121 @@
+"""
+Payloads sintéticos de /predict repartidos sobre los polígonos reales de las
+comunas. Las características (tipo, superficies, dormitorios, baños) se
+muestrean de resultados_qa.xlsx con un poco de ruido; la ubicación es un
+punto uniforme dentro de una comuna permitida, elegida con la frecuencia
+que esa comuna tiene en el mismo archivo (uniforme si no aparece).
+
+Uso:
+    python benchmarks/payloads.py --n 1000 --salida payloads.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import normalize_str
+from serving_bundle import mapa_comuna_region
+
+
+COMUNAS_SHP = os.getenv('COMUNAS_SHP', 'data_preprocessed/comunas.parquet').strip("'\"")
+MAPPING_FILE = os.getenv('COMUNA_REGION_FILE', 'comunas.xlsx')
+QA_FILE = 'resultados_qa.xlsx'
+CARACTERISTICAS = ['tipo', 'superficie_util', 'superficie_total', 'antiguedad', 'dormitorios', 'banos']
+
+
+def puntos_en_poligonos(geoms: np.ndarray, n: int, rng: np.random.Generator) -> tuple:
+    """Un punto uniforme dentro de cada uno de los `n` polígonos (muestreo por rechazo en su bbox)."""
+    bounds = shapely.bounds(geoms)
+    lons = np.full(n, np.nan)
+    lats = np.full(n, np.nan)
+    pendientes = np.arange(n)
+    for _ in range(1000):
+        if not len(pendientes):
+            break
+        b = bounds[pendientes]
+        x = rng.uniform(b[:, 0], b[:, 2])
+        y = rng.uniform(b[:, 1], b[:, 3])
+        dentro = shapely.contains_xy(geoms[pendientes], x, y)
+        lons[pendientes[dentro]] = x[dentro]
+        lats[pendientes[dentro]] = y[dentro]
+        pendientes = pendientes[~dentro]
+    if len(pendientes):
+        raise RuntimeError(f"No se pudo ubicar {len(pendientes)} puntos dentro de sus comunas")
+    return lats, lons
+
+
+def generar_payloads(n: int, comunas_gdf: gpd.GeoDataFrame, region_map: dict,
+                     qa_path: str = QA_FILE, seed: int = 42, con_comuna: bool = False) -> list:
+    """
+    `n` payloads de /predict. Con `con_comuna` se informa la comuna y /predict
+    no la resuelve desde las coordenadas.
+    """
+    rng = np.random.default_rng(seed)
+    if comunas_gdf.crs is not None and comunas_gdf.crs.to_epsg() != 4326:
+        comunas_gdf = comunas_gdf.to_crs(epsg=4326)
+    normalizadas = comunas_gdf['Comuna'].map(normalize_str)
+    permitidas = comunas_gdf[normalizadas.isin(region_map).to_numpy()].reset_index(drop=True)
+    if permitidas.empty:
+        raise ValueError("Ninguna comuna de los polígonos está en el mapa comuna-región")
+
+    qa = pd.read_excel(qa_path)
+    qa = qa.dropna(subset=CARACTERISTICAS).reset_index(drop=True)
+
+    frecuencia = qa['comuna'].dropna().map(normalize_str).value_counts()
+    pesos = permitidas['Comuna'].map(normalize_str).map(frecuencia).fillna(0).to_numpy(dtype=float)
+    pesos = pesos / pesos.sum() if pesos.sum() > 0 else None
+    elegidas = rng.choice(len(permitidas), size=n, p=pesos)
+    lats, lons = puntos_en_poligonos(np.asarray(permitidas.geometry.values)[elegidas], n, rng)
+
+    filas = qa.iloc[rng.integers(0, len(qa), n)][CARACTERISTICAS].reset_index(drop=True)
+    ruido = rng.uniform(0.9, 1.1, n)
+    payloads = []
+    for i, fila in enumerate(filas.itertuples(index=False)):
+        payload = {
+            'tipo': fila.tipo,
+            'superficie_util': round(float(fila.superficie_util) * ruido[i], 2),
+            'superficie_total': round(float(fila.superficie_total) * ruido[i], 2),
+            'antiguedad': float(fila.antiguedad),
+            'dormitorios': int(fila.dormitorios),
+            'banos': int(fila.banos),
+            'latitud': round(float(lats[i]), 6),
+            'longitud': round(float(lons[i]), 6),
+        }
+        if con_comuna:
+            payload['comuna'] = permitidas['Comuna'].iloc[elegidas[i]]
+        payloads.append(payload)
+    return payloads
+
+
+def payloads_desde_fuentes(n: int, seed: int = 42, con_comuna: bool = False) -> list:
+    """generar_payloads con los polígonos y el mapa comuna-región que usa la app."""
+    return generar_payloads(n, gpd.read_parquet(COMUNAS_SHP), mapa_comuna_region(MAPPING_FILE),
+                            seed=seed, con_comuna=con_comuna)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--con-comuna', action='store_true', help='Incluir la comuna en el payload')
+    parser.add_argument('--salida', help='Archivo JSONL (por defecto, salida estándar)')
+    args = parser.parse_args()
+
+    payloads = payloads_desde_fuentes(args.n, args.seed, args.con_comuna)
+    lineas = '\n'.join(json.dumps(p, ensure_ascii=False) for p in payloads) + '\n'
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(lineas)
+    else:
+        sys.stdout.write(lineas)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Resultados de benchmarks en JSON y comparación contra una línea base.
+
+Cada resultado es {nombre: {métrica: valor}}. Las métricas terminadas en
+`_ms` son latencias (menos es mejor) y las terminadas en `_por_s` son
+rendimiento (más es mejor); el resto (y `max_ms`, demasiado ruidoso) se
+guarda pero no se compara.
+
+Uso (comparar dos archivos ya generados):
+    python benchmarks/resultados.py actual.json --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+TOLERANCIA_DEFAULT = 0.20
+NO_COMPARAR = ('max_ms',)
+
+
+def percentiles_ms(tiempos_s) -> dict:
+    ms = np.asarray(tiempos_s, dtype=float) * 1000
+    if not len(ms):
+        return {}
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99), 'max_ms': float(ms.max())}
+
+
+def medir(fn, repeticiones: int, calentamiento: int = 2, filas: int = 1) -> dict:
+    """Latencia por llamada de `fn()` y, con `filas` procesadas por llamada, filas por segundo."""
+    for _ in range(calentamiento):
+        fn()
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    r = percentiles_ms(tiempos)
+    r['filas'] = filas
+    r['filas_por_s'] = filas / float(np.median(tiempos)) if np.median(tiempos) > 0 else None
+    return r
+
+
+def _commit() -> str:
+    try:
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=raiz, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def documento(suite: str, resultados: dict, parametros: dict = None) -> dict:
+    return {
+        'suite': suite,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'maquina': {'plataforma': platform.platform(), 'cpus': os.cpu_count()},
+        'parametros': parametros or {},
+        'resultados': resultados,
+    }
+
+
+def comparar(actual: dict, baseline: dict, tolerancia: float = TOLERANCIA_DEFAULT) -> list:
+    """
+    Regresiones de `actual` respecto de `baseline` (documentos de `documento`):
+    latencias que subieron o rendimientos que bajaron más que `tolerancia`.
+    """
+    regresiones = []
+    for nombre, metricas in actual['resultados'].items():
+        base = baseline.get('resultados', {}).get(nombre)
+        if not base:
+            continue
+        for metrica, valor in metricas.items():
+            previo = base.get(metrica)
+            if metrica in NO_COMPARAR or not isinstance(valor, (int, float)) or not isinstance(previo, (int, float)):
+                continue
+            if previo <= 0:
+                continue
+            cambio = valor / previo - 1
+            if (metrica.endswith('_ms') and cambio > tolerancia) or (metrica.endswith('_por_s') and cambio < -tolerancia):
+                regresiones.append({'resultado': nombre, 'metrica': metrica, 'baseline': previo,
+                                    'actual': valor, 'cambio': cambio})
+    return regresiones
+
+
+def cerrar(doc: dict, salida: str = None, baseline: str = None, tolerancia: float = TOLERANCIA_DEFAULT,
+           guardar_baseline: bool = False) -> int:
+    """
+    Imprime y guarda `doc`, lo compara con `baseline` si existe y devuelve el
+    código de salida del script (1 si hubo regresiones). Con `guardar_baseline`
+    el documento pasa a ser la nueva línea base.
+    """
+    print(json.dumps(doc, indent=4, ensure_ascii=False))
+    if salida:
+        with open(salida, 'w', encoding='utf-8') as f:
+            json.dump(doc, f, indent=4, ensure_ascii=False)
+    if not baseline:
+        return 0
+    if guardar_baseline:
+        with open(baseline, 'w', encoding='utf-8') as f:
+            json.dump(doc, f, indent=4, ensure_ascii=False)
+        print(f"Línea base guardada en {baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(baseline):
+        print(f"No existe la línea base {baseline}; usar --guardar-baseline para crearla", file=sys.stderr)
+        return 0
+    with open(baseline, encoding='utf-8') as f:
+        base = json.load(f)
+    return reportar(comparar(doc, base, tolerancia), base, tolerancia)
+
+
+def reportar(regresiones: list, base: dict, tolerancia: float) -> int:
+    if not regresiones:
+        print(f"Sin regresiones mayores a {tolerancia:.0%} contra la línea base ({base.get('commit')})", file=sys.stderr)
+        return 0
+    print(f"{len(regresiones)} regresiones mayores a {tolerancia:.0%} contra la línea base ({base.get('commit')}):",
+          file=sys.stderr)
+    for r in regresiones:
+        print(f"  {r['resultado']}.{r['metrica']}: {r['baseline']:.4g} -> {r['actual']:.4g} ({r['cambio']:+.0%})",
+              file=sys.stderr)
+    return 1
+
+
+def agregar_argumentos(parser: argparse.ArgumentParser):
+    parser.add_argument('--salida', help='Archivo JSON con los resultados')
+    parser.add_argument('--baseline', help='Línea base JSON contra la que comparar')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_DEFAULT,
+                        help='Cambio relativo tolerado antes de marcar una regresión (0.2 = 20%%)')
+    parser.add_argument('--guardar-baseline', action='store_true', help='Guardar los resultados como línea base')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('actual')
+    parser.add_argument('--baseline', required=True)
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_DEFAULT)
+    args = parser.parse_args()
+    with open(args.actual, encoding='utf-8') as f:
+        actual = json.load(f)
+    with open(args.baseline, encoding='utf-8') as f:
+        base = json.load(f)
+    sys.exit(reportar(comparar(actual, base, args.tolerancia), base, args.tolerancia))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Puntuación masiva offline: re-valoriza un archivo de propiedades (CSV o
+Parquet, p.ej. la cartera de un banco) o el historial de model_predictions
+sin pasar por la API HTTP.
+
+Usa la misma lógica que /predict/batch (features.preparar_lote: comuna,
+región permitida y distancias; después el modelo y las métricas por comuna
+de serving_core.py). La entrada se lee por bloques de `--bloque` filas y
+cada bloque se procesa en un pool de procesos; cada proceso carga una vez
+el modelo y los recursos de serving_core.cargar_recursos (comunas, regiones,
+índices y métricas, sin Flask, BD ni índice de comparables) y escribe su
+bloque como un Parquet aparte en el directorio de salida. La memoria no depende del tamaño de la entrada:
+hay como máximo unos pocos bloques por proceso en vuelo.
+
+Cada fila de salida trae `fila` (posición en la entrada), las columnas de
+entrada, el resultado con los mismos campos que la API y `error` (None si
+se pudo valorizar). Una columna de la entrada con el mismo nombre que una de
+resultado (p.ej. prediction_uf al re-puntuar model_predictions) se conserva
+como `<columna>_entrada`.
+
+Si se interrumpe, volver a correr el mismo comando retoma desde los bloques
+que faltan (los ya escritos se saltan). La entrada, el tamaño de bloque y
+la versión del modelo quedan en `_puntuacion.json` y tienen que coincidir.
+
+Uso:
+    python bulk_score.py cartera.csv salida/ --workers 4
+    python bulk_score.py --desde-bd salida_historial/ --version 20250101-120000-abc123
+    pd.read_parquet('salida/')   # resultado completo
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+import model_store
+import serving_core
+from features import preparar_lote
+from persistence import crear_engine
+
+load_dotenv()
+
+
+BULK_SCORE_WORKERS = int(os.getenv('BULK_SCORE_WORKERS', 0)) or os.cpu_count() or 1
+BULK_SCORE_CHUNKSIZE = int(os.getenv('BULK_SCORE_CHUNKSIZE', 20000))
+# Bloques en vuelo por proceso: suficiente para que ninguno espere, sin acumular la entrada en memoria
+BLOQUES_POR_WORKER = 2
+
+COLUMNAS_RESULTADO = ('prediction_uf', 'comuna', 'valor_promedio_propiedades_comuna',
+                      'superficie_util_promedio_comuna', 'cantidad_propiedades_comuna', 'model_version', 'error')
+MANIFEST = '_puntuacion.json'
+
+_worker = {}
+
+
+def db_uri() -> str:
+    # Misma conexión que app.py
+    return os.getenv('DATABASE_URL') or (
+        f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('HOST')}:{os.getenv('DB_PORT', '3306')}/{os.getenv('DB_NAME', 'ml_valoranet')}"
+    )
+
+
+# --- Entrada por bloques ---
+
+def leer_bloques(entrada: str, bloque: int, desde_bd: bool = False):
+    """Bloques de hasta `bloque` filas, siempre en el mismo orden (necesario para retomar)."""
+    if desde_bd:
+        from sqlalchemy import text
+        engine = crear_engine(db_uri())
+        with engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True)
+            yield from pd.read_sql(text("SELECT * FROM model_predictions ORDER BY id"), conn, chunksize=bloque)
+        return
+    if entrada.lower().endswith('.parquet'):
+        for lote in pq.ParquetFile(entrada).iter_batches(batch_size=bloque):
+            yield lote.to_pandas()
+        return
+    yield from pd.read_csv(entrada, chunksize=bloque)
+
+
+def firma_entrada(entrada: str, desde_bd: bool) -> dict:
+    if desde_bd:
+        return {'entrada': 'model_predictions'}
+    st = os.stat(entrada)
+    return {'entrada': os.path.abspath(entrada), 'tamano': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def ruta_parte(salida: str, n: int) -> str:
+    return os.path.join(salida, f"parte-{n:06d}.parquet")
+
+
+# --- Worker ---
+
+def _iniciar_worker(version):
+    # Modelo, índices, resolvedor de comunas, mapa de regiones y métricas una vez por proceso
+    _worker.update(recursos=serving_core.cargar_recursos(version), model=serving_core.cargar_modelo(version),
+                   version=version or '')
+
+
+def _nulo(v) -> bool:
+    # NaN (float) y pd.NA (columnas Int64/string) cuentan como vacíos; listas o dicts no
+    return v is None or v is pd.NA or (isinstance(v, float) and np.isnan(v))
+
+
+def _a_items(df: pd.DataFrame) -> list:
+    # NaN/NA de CSV/Parquet -> None, como un campo ausente en el JSON de la API
+    return [{k: (None if _nulo(v) else v) for k, v in fila.items()} for fila in df.to_dict('records')]
+
+
+def puntuar(df: pd.DataFrame, recursos: serving_core.Recursos, model, version: str) -> pd.DataFrame:
+    """Resultado de cada fila de `df`, alineado con `df` (mismas columnas que la respuesta de la API)."""
+    lote, errores = preparar_lote(_a_items(df), recursos.comuna_resolver, recursos.comuna_region,
+                                  recursos.spatial_index)
+    validos = [i for i, err in enumerate(errores) if err is None]
+    respuestas = [None] * len(df)
+    ahora = datetime.now()
+    for i, (prediction, error) in zip(validos, serving_core.predecir_filas([lote[i] for i in validos], model)):
+        if error is None:
+            registro = serving_core.armar_registro(lote[i], prediction, ahora, recursos.metricas_cache)
+            respuestas[i] = serving_core.respuesta_prediccion(registro)
+        else:
+            errores[i] = error
+
+    def columna(campo):
+        return [r[campo] if r is not None else None for r in respuestas]
+
+    # Tipos fijos, así todas las partes tienen el mismo esquema aunque un bloque no tenga errores
+    return pd.DataFrame({
+        'prediction_uf': pd.array(columna('prediction_uf'), dtype='Float64'),
+        'comuna': pd.array(columna('comuna'), dtype='string'),
+        'valor_promedio_propiedades_comuna': pd.array(columna('valor_promedio_propiedades_comuna'), dtype='Float64'),
+        'superficie_util_promedio_comuna': pd.array(columna('superficie_util_promedio_comuna'), dtype='Float64'),
+        'cantidad_propiedades_comuna': pd.array(columna('cantidad_propiedades_comuna'), dtype='Int64'),
+        'model_version': pd.array([version] * len(df), dtype='string'),
+        'error': pd.array(errores, dtype='string'),
+    }, index=df.index)
+
+
+def _puntuar_bloque(n: int, inicio: int, df: pd.DataFrame, salida: str) -> dict:
+    t0 = time.perf_counter()
+    df = df.reset_index(drop=True)
+    resultado = puntuar(df, _worker['recursos'], _worker['model'], _worker['version'])
+    entrada = df.rename(columns={c: f"{c}_entrada" for c in df.columns if c in COLUMNAS_RESULTADO or c == 'fila'})
+    out = pd.concat([pd.DataFrame({'fila': np.arange(inicio, inicio + len(df), dtype=np.int64)}), entrada, resultado],
+                    axis=1)
+    # Escritura atómica: una parte a medio escribir no cuenta como hecha al retomar
+    destino = ruta_parte(salida, n)
+    tmp = f"{destino}.{os.getpid()}.tmp"
+    out.to_parquet(tmp, index=False)
+    os.replace(tmp, destino)
+    n_error = int(resultado['error'].notna().sum())
+    return {'parte': n, 'filas': len(df), 'n_ok': len(df) - n_error, 'n_error': n_error,
+            'segundos': time.perf_counter() - t0}
+
+
+# --- Orquestación ---
+
+def _escribir_manifest(salida: str, manifest: dict):
+    path = os.path.join(salida, MANIFEST)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def preparar_salida(salida: str, manifest: dict, reiniciar: bool = False):
+    """Crea el directorio o verifica que la corrida anterior sea la misma que se retoma."""
+    os.makedirs(salida, exist_ok=True)
+    path = os.path.join(salida, MANIFEST)
+    if reiniciar:
+        for nombre in os.listdir(salida):
+            if nombre.startswith('parte-') or nombre == MANIFEST:
+                os.remove(os.path.join(salida, nombre))
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            previo = json.load(f)
+        distintos = [k for k in manifest if k != 'completo' and previo.get(k) != manifest[k]]
+        if distintos:
+            raise ValueError(f"{salida} tiene una puntuación con otros parámetros ({', '.join(distintos)}); "
+                             f"usar otro directorio o --reiniciar")
+    _escribir_manifest(salida, manifest)
+
+
+def puntuar_archivo(entrada: str, salida: str, version: str = None, workers: int = BULK_SCORE_WORKERS,
+                    bloque: int = BULK_SCORE_CHUNKSIZE, desde_bd: bool = False, reiniciar: bool = False) -> dict:
+    version = version or model_store.version_actual()
+    manifest = {**firma_entrada(entrada, desde_bd), 'bloque': bloque, 'version': version, 'completo': False}
+    preparar_salida(salida, manifest, reiniciar)
+
+    totales = {'partes': 0, 'saltadas': 0, 'filas': 0, 'n_ok': 0, 'n_error': 0, 'fallidas': []}
+    t0 = time.perf_counter()
+
+    def registrar(futuro, n):
+        try:
+            r = futuro.result()
+        except Exception as e:
+            # La parte no se escribió: se reintenta en la próxima corrida
+            print(f"[parte {n}] falló: {e}", file=sys.stderr)
+            totales['fallidas'].append(n)
+            return
+        totales['partes'] += 1
+        for campo in ('filas', 'n_ok', 'n_error'):
+            totales[campo] += r[campo]
+        print(f"[parte {n}] {r['filas']} filas, {r['n_error']} con error, {r['segundos']:.1f}s "
+              f"({totales['filas'] / (time.perf_counter() - t0):.0f} filas/s)")
+
+    with ProcessPoolExecutor(workers, initializer=_iniciar_worker, initargs=(version,)) as pool:
+        en_vuelo = {}
+        inicio = 0
+        for n, df in enumerate(leer_bloques(entrada, bloque, desde_bd)):
+            if os.path.exists(ruta_parte(salida, n)):
+                totales['saltadas'] += 1
+            else:
+                if len(en_vuelo) >= workers * BLOQUES_POR_WORKER:
+                    hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for futuro in hechos:
+                        registrar(futuro, en_vuelo.pop(futuro))
+                en_vuelo[pool.submit(_puntuar_bloque, n, inicio, df, salida)] = n
+            inicio += len(df)
+        for futuro in wait(en_vuelo).done:
+            registrar(futuro, en_vuelo[futuro])
+
+    totales['segundos'] = time.perf_counter() - t0
+    if not totales['fallidas']:
+        manifest['completo'] = True
+        _escribir_manifest(salida, manifest)
+    return totales
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('entrada', nargs='?', help='Archivo .csv o .parquet')
+    parser.add_argument('salida', help='Directorio de salida (una parte Parquet por bloque)')
+    parser.add_argument('--desde-bd', action='store_true', help='Re-puntuar la tabla model_predictions')
+    parser.add_argument('--version', help='Versión del modelo (por defecto la de CURRENT, o MODEL_PATH)')
+    parser.add_argument('--workers', type=int, default=BULK_SCORE_WORKERS)
+    parser.add_argument('--bloque', type=int, default=BULK_SCORE_CHUNKSIZE, help='Filas por bloque')
+    parser.add_argument('--reiniciar', action='store_true', help='Descartar las partes de una corrida anterior')
+    args = parser.parse_args()
+    if bool(args.entrada) == args.desde_bd:
+        parser.error("Indicar un archivo de entrada o --desde-bd")
+
+    try:
+        totales = puntuar_archivo(args.entrada, args.salida, args.version, args.workers, args.bloque,
+                                  args.desde_bd, args.reiniciar)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(totales, indent=4))
+    sys.exit(1 if totales['fallidas'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import os
+import math
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy.spatial import cKDTree
+
+from utils import normalize_str
+
+
+# Propiedades comparables: las k publicaciones del entrenamiento más parecidas a una
+# consulta, por ubicación y atributos, con un KD-tree por tipo.
+#   COMPARABLES_K              comparables por defecto
+#   COMPARABLES_K_MAX          máximo que se puede pedir
+#   COMPARABLES_KM_POR_DESVIO  cuánto pesan los atributos: un desvío estándar de diferencia
+#                              (en log-superficie, dormitorios o baños) equivale a estos km
+COMPARABLES_K = int(os.getenv('COMPARABLES_K', 5))
+COMPARABLES_K_MAX = int(os.getenv('COMPARABLES_K_MAX', 50))
+COMPARABLES_KM_POR_DESVIO = float(os.getenv('COMPARABLES_KM_POR_DESVIO', 1.0))
+
+KM_POR_GRADO = 111.19
+ATRIBUTOS = ('superficie_util', 'superficie_total', 'dormitorios', 'banos')
+# Superficies en log: 10 m² de diferencia pesan más en 40 m² que en 400 m²
+ATRIBUTOS_LOG = ('superficie_util', 'superficie_total')
+LOG_MASK = np.array([col in ATRIBUTOS_LOG for col in ATRIBUTOS])
+# Columnas de df_metrics que se conservan para responder
+COLUMNAS = ('id', 'URL', 'tipo', 'Comuna', 'latitud', 'longitud', 'precio') + ATRIBUTOS
+
+
+def _redondear(valor, decimales: int = 2):
+    return None if valor is None or (isinstance(valor, float) and math.isnan(valor)) else round(float(valor), decimales)
+
+
+def _a_float(valor) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def columnas_comparables(df: pd.DataFrame) -> pd.DataFrame:
+    """Solo las columnas que usa el índice, con tipo normalizado y sin filas incompletas."""
+    df = pd.DataFrame(df[[c for c in COLUMNAS if c in df.columns]])
+    df = df.dropna(subset=['tipo', 'latitud', 'longitud', 'precio'])
+    df['tipo'] = df['tipo'].astype(str).map(normalize_str)
+    # float64 sin importar el dtype de origen (float32, Int16 nullable de la carga compacta)
+    for col in ('latitud', 'longitud', 'precio') + ATRIBUTOS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+    return df.reset_index(drop=True)
+
+
+def leer_publicaciones(path: str) -> pd.DataFrame:
+    # Solo las columnas del índice; id y URL pueden no estar (df_metrics compacto)
+    presentes = set(pq.read_schema(path).names)
+    return pd.read_parquet(path, columns=[c for c in COLUMNAS if c in presentes])
+
+
+def exportar_comparables(metrics_path: str, destino: str):
+    """Copia compacta de df_metrics para el bundle de serving."""
+    columnas_comparables(leer_publicaciones(metrics_path)).to_parquet(destino, index=False)
+
+
+class IndiceComparables:
+    """
+    Un cKDTree por tipo sobre (norte_km, este_km, atributos escalados). La
+    ubicación va en km planos (coseno de la latitud media de todo el índice)
+    y cada atributo se estandariza dentro de su tipo y se multiplica por
+    `km_por_desvio`, así la distancia del árbol se lee en km equivalentes.
+    Un atributo que falta en la consulta (o en la publicación) queda en la
+    media del tipo.
+    """
+
+    def __init__(self, df: pd.DataFrame, km_por_desvio: float = COMPARABLES_KM_POR_DESVIO):
+        df = columnas_comparables(df)
+        self.km_por_desvio = km_por_desvio
+        self.cos_lat = math.cos(math.radians(float(df['latitud'].mean()))) if len(df) else 1.0
+        self.n = len(df)
+        self._tipos = {}
+        for tipo, grupo in df.groupby('tipo', sort=True):
+            crudos = self._atributos(grupo)
+            media = np.nanmean(crudos, axis=0)
+            desvio = np.nanstd(crudos, axis=0)
+            desvio[~(desvio > 0)] = 1.0
+            media[np.isnan(media)] = 0.0
+            X = self._matriz(grupo['latitud'].to_numpy(float), grupo['longitud'].to_numpy(float), crudos, media, desvio)
+            self._tipos[tipo] = {
+                'tree': cKDTree(X),
+                'media': media,
+                'desvio': desvio,
+                # Columnar para armar las respuestas sin tocar el DataFrame en cada consulta
+                'datos': {col: grupo[col].to_numpy() for col in grupo.columns},
+            }
+
+    @staticmethod
+    def _atributos(df) -> np.ndarray:
+        cols = []
+        for col in ATRIBUTOS:
+            v = pd.to_numeric(df[col], errors='coerce').to_numpy(float) if col in df else np.full(len(df), np.nan)
+            cols.append(np.log1p(np.clip(v, 0, None)) if col in ATRIBUTOS_LOG else v)
+        return np.column_stack(cols)
+
+    def _matriz(self, lats, lons, crudos, media, desvio) -> np.ndarray:
+        z = (crudos - media) / desvio
+        z[np.isnan(z)] = 0.0
+        return np.column_stack((lats * KM_POR_GRADO, lons * KM_POR_GRADO * self.cos_lat, z * self.km_por_desvio))
+
+    @property
+    def tipos(self) -> list:
+        return list(self._tipos)
+
+    def buscar_lote(self, consultas: list, k: int = COMPARABLES_K) -> list:
+        """
+        Comparables de cada consulta (dicts con tipo, latitud, longitud y los
+        atributos). Devuelve una lista alineada de listas de dicts; None si el
+        tipo no tiene publicaciones.
+        """
+        k = max(1, min(int(k), COMPARABLES_K_MAX))
+        resultado = [None] * len(consultas)
+        por_tipo = {}
+        for i, c in enumerate(consultas):
+            por_tipo.setdefault(normalize_str(str(c.get('tipo', ''))), []).append(i)
+        for tipo, idx in por_tipo.items():
+            t = self._tipos.get(tipo)
+            if t is None:
+                continue
+            # Sin DataFrame: con una sola consulta armarlo costaría más que la búsqueda
+            lats = np.array([_a_float(consultas[i].get('latitud')) for i in idx])
+            lons = np.array([_a_float(consultas[i].get('longitud')) for i in idx])
+            crudos = np.array([[_a_float(consultas[i].get(col)) for col in ATRIBUTOS] for i in idx])
+            crudos[:, LOG_MASK] = np.log1p(np.clip(crudos[:, LOG_MASK], 0, None))
+            X = self._matriz(lats, lons, crudos, t['media'], t['desvio'])
+            kk = min(k, t['tree'].n)
+            dist, vecinos = t['tree'].query(X, k=kk)
+            dist, vecinos = dist.reshape(len(idx), kk), vecinos.reshape(len(idx), kk)
+            for fila, i in enumerate(idx):
+                resultado[i] = [self._comparable(t['datos'], j, d, lats[fila], lons[fila])
+                                for j, d in zip(vecinos[fila], dist[fila])]
+        return resultado
+
+    def buscar(self, consulta: dict, k: int = COMPARABLES_K):
+        return self.buscar_lote([consulta], k)[0]
+
+    def _comparable(self, datos: dict, j: int, puntaje: float, lat: float, lon: float) -> dict:
+        lat_j, lon_j = float(datos['latitud'][j]), float(datos['longitud'][j])
+        distancia = math.hypot((lat_j - lat) * KM_POR_GRADO, (lon_j - lon) * KM_POR_GRADO * self.cos_lat)
+        sup = datos['superficie_util'][j] if 'superficie_util' in datos else None
+        precio = float(datos['precio'][j])
+        out = {
+            'tipo': datos['tipo'][j],
+            'comuna': datos['Comuna'][j] if 'Comuna' in datos and not pd.isna(datos['Comuna'][j]) else None,
+            'latitud': lat_j,
+            'longitud': lon_j,
+            'precio_uf': _redondear(precio),
+            'uf_m2': _redondear(precio / sup) if sup and sup > 0 else None,
+            'distancia_km': _redondear(distancia, 3),
+            'puntaje': _redondear(puntaje, 3),
+        }
+        for col in ATRIBUTOS:
+            if col in datos:
+                out[col] = _redondear(datos[col][j])
+        for col, nombre in (('id', 'id'), ('URL', 'url')):
+            if col in datos and not pd.isna(datos[col][j]):
+                out[nombre] = datos[col][j].item() if hasattr(datos[col][j], 'item') else datos[col][j]
+        return out
+
+    def stats(self) -> dict:
+        return {'publicaciones': self.n, 'por_tipo': {tipo: t['tree'].n for tipo, t in self._tipos.items()},
+                'km_por_desvio': self.km_por_desvio}
+
+
+class ComparablesCache:
+    """
+    Índice de comparables en memoria, construido desde DATA_METRICS_FILE (o
+    desde el archivo de `set_path`, p.ej. el del bundle de serving). Se
+    reconstruye si cambia el mtime del archivo, así un reentrenamiento que
+    reescribe df_metrics.parquet se ve en la siguiente consulta.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._indice = None
+        self._mtime = None
+
+    def _ruta(self) -> str:
+        return self.path or os.environ['DATA_METRICS_FILE']
+
+    def get(self) -> IndiceComparables:
+        ruta = self._ruta()
+        mtime = os.stat(ruta).st_mtime_ns
+        indice = self._indice
+        if indice is not None and mtime == self._mtime:
+            return indice
+        with self._lock:
+            if self._indice is None or mtime != self._mtime:
+                self._indice = IndiceComparables(leer_publicaciones(ruta))
+                self._mtime = mtime
+            return self._indice
+
+    def set_path(self, path: str):
+        with self._lock:
+            self.path = path
+            self._indice = None
+            self._mtime = None
+
+    def invalidate(self):
+        self.set_path(None)
@@ -0,0 +1,114 @@
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+class ComunaResolver:
+    """
+    Asigna comuna (y sus atributos, p.ej. Region) a puntos lon/lat.
+
+    Los polígonos se preparan una vez y se indexan en un STRtree; la prueba
+    exacta punto-en-polígono solo se hace sobre los candidatos del árbol.
+    Opcionalmente se precalcula una grilla lat/lon: las celdas que caen
+    completamente dentro de una comuna se resuelven con una lectura del
+    arreglo y solo las celdas de borde pasan a la prueba exacta. Con
+    `teselas` (ver distance_tiles.aplicar_teselas) se consulta primero la
+    comuna por celda de las teselas.
+    """
+
+    teselas = None
+
+    def __init__(self, comunas_gdf: gpd.GeoDataFrame, grid_res: float = None, grid_bounds: tuple = None,
+                 max_celdas_por_comuna: int = 2_000_000):
+        if comunas_gdf.crs is not None and comunas_gdf.crs.to_epsg() != 4326:
+            comunas_gdf = comunas_gdf.to_crs(epsg=4326)
+        self.geoms = np.asarray(comunas_gdf.geometry.values)
+        self.atributos = pd.DataFrame(comunas_gdf.drop(columns=comunas_gdf.geometry.name)).reset_index(drop=True)
+        self.tree = shapely.STRtree(self.geoms)
+        shapely.prepare(self.geoms)
+
+        self.grid = None
+        self.grid_res = grid_res
+        self.grid_bounds = None
+        if grid_res:
+            self._construir_grilla(grid_res, grid_bounds, max_celdas_por_comuna)
+
+    def __setstate__(self, state):
+        # La preparación de las geometrías no se serializa
+        self.__dict__.update(state)
+        shapely.prepare(self.geoms)
+
+    def _construir_grilla(self, res: float, bounds: tuple, max_celdas: int):
+        minx, miny, maxx, maxy = bounds if bounds is not None else shapely.total_bounds(self.geoms)
+        nx = int(math.ceil((maxx - minx) / res))
+        ny = int(math.ceil((maxy - miny) / res))
+        dtype = np.int16 if len(self.geoms) < np.iinfo(np.int16).max else np.int32
+        grid = np.full((ny, nx), -1, dtype=dtype)
+
+        for k, geom in enumerate(self.geoms):
+            gx0, gy0, gx1, gy1 = shapely.bounds(geom)
+            i0 = max(int((gx0 - minx) // res), 0)
+            i1 = min(int((gx1 - minx) // res) + 1, nx)
+            j0 = max(int((gy0 - miny) // res), 0)
+            j1 = min(int((gy1 - miny) // res) + 1, ny)
+            if i1 <= i0 or j1 <= j0 or (i1 - i0) * (j1 - j0) > max_celdas:
+                # Comunas enormes (o fuera de la grilla) quedan para la prueba exacta
+                continue
+            ii, jj = np.meshgrid(np.arange(i0, i1), np.arange(j0, j1))
+            x0 = minx + ii.ravel() * res
+            y0 = miny + jj.ravel() * res
+            celdas = shapely.box(x0, y0, x0 + res, y0 + res)
+            dentro = shapely.contains_properly(geom, celdas)
+            grid[jj.ravel()[dentro], ii.ravel()[dentro]] = k
+
+        self.grid = grid
+        self.grid_bounds = (minx, miny, maxx, maxy)
+
+    def indices(self, lats, lons) -> np.ndarray:
+        """Índice de la comuna que contiene cada punto, -1 si ninguna."""
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        out = np.full(len(lats), -1, dtype=np.int64)
+
+        if self.teselas is not None:
+            out = self.teselas.comuna_indices(lats, lons)
+
+        if self.grid is not None:
+            minx, miny, _, _ = self.grid_bounds
+            ii = np.floor((lons - minx) / self.grid_res).astype(np.int64)
+            jj = np.floor((lats - miny) / self.grid_res).astype(np.int64)
+            en_grilla = (ii >= 0) & (ii < self.grid.shape[1]) & (jj >= 0) & (jj < self.grid.shape[0])
+            en_grilla &= out < 0
+            out[en_grilla] = self.grid[jj[en_grilla], ii[en_grilla]]
+
+        pendientes = np.flatnonzero(out < 0)
+        if len(pendientes):
+            puntos = shapely.points(lons[pendientes], lats[pendientes])
+            idx_pt, idx_com = self.tree.query(puntos)
+            dentro = shapely.contains(self.geoms[idx_com], puntos[idx_pt])
+            idx_pt, idx_com = idx_pt[dentro], idx_com[dentro]
+            # Si un punto cae en más de un polígono gana el primero
+            orden = np.lexsort((idx_com, idx_pt))
+            idx_pt, idx_com = idx_pt[orden], idx_com[orden]
+            primeros = np.unique(idx_pt, return_index=True)[1]
+            out[pendientes[idx_pt[primeros]]] = idx_com[primeros]
+        return out
+
+    def resolver(self, lats, lons, columnas=('Comuna', 'Region')) -> pd.DataFrame:
+        """Atributos de la comuna de cada punto (NaN si el punto no cae en ninguna) e 'index_right'."""
+        idx = self.indices(lats, lons)
+        encontrados = idx >= 0
+        out = pd.DataFrame(index=range(len(idx)))
+        out['index_right'] = np.where(encontrados, idx, np.nan)
+        for col in columnas:
+            valores = self.atributos[col].to_numpy(dtype=object)[np.where(encontrados, idx, 0)]
+            out[col] = np.where(encontrados, valores, None)
+        return out
+
+    def comunas(self, lats, lons) -> list:
+        """Nombre de la comuna de cada punto, None si está fuera de los límites conocidos."""
+        idx = self.indices(lats, lons)
+        nombres = self.atributos['Comuna'].to_numpy(dtype=object)
+        return [nombres[k] if k >= 0 else None for k in idx]
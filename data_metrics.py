@@ -1,17 +1,82 @@
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import threading
+
+from utils import normalize_str
 
 # Cargar variables de entorno
 load_dotenv()
 
 
-def metricas_comuna():
-    df=pd.read_parquet(os.environ['DATA_METRICS_FILE'])
+# Columnas de df_metrics que se usan para las métricas por comuna
+COLUMNAS_METRICAS = ('Comuna', 'precio', 'superficie_util')
+
 
-    df_metrics=df.groupby('Comuna').agg(
+def metricas_comuna(path: str = None):
+    df=pd.read_parquet(path or os.environ['DATA_METRICS_FILE'], columns=list(COLUMNAS_METRICAS))
+
+    # observed: con Comuna category (carga compacta) no agregar comunas sin filas
+    df_metrics=df.groupby('Comuna', observed=True).agg(
         avg_price_uf=('precio', 'median'),
         superficie=('superficie_util', 'mean'),
         n_properties=('precio', 'count')).reset_index()
 
-    return df_metrics
\ No newline at end of file
+    return df_metrics
+
+
+def tabla_metricas(path: str = None) -> dict:
+    """Métricas por comuna normalizada: {comuna: (avg_price_uf, superficie, n_properties)}."""
+    tabla = {}
+    for comuna, avg_price_uf, superficie, n_properties in metricas_comuna(path).itertuples(index=False):
+        # Igual que el filtro original: gana la primera comuna que normaliza al mismo nombre
+        tabla.setdefault(normalize_str(comuna), (float(avg_price_uf), float(superficie), int(n_properties)))
+    return tabla
+
+
+class MetricasComunaCache:
+    """
+    Tabla de métricas por comuna en memoria, indexada por nombre normalizado.
+    Se recalcula solo si cambia el mtime de DATA_METRICS_FILE o tras invalidate().
+    Con `tabla` (p.ej. la del bundle de serving) se usa esa tabla fija y no se
+    lee el archivo hasta un invalidate().
+    """
+
+    def __init__(self, path: str = None, tabla: dict = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tabla = tabla
+        self._mtime = None
+        self._fija = tabla is not None
+
+    def _ruta(self) -> str:
+        return self.path or os.environ['DATA_METRICS_FILE']
+
+    def _vigente(self) -> dict:
+        if self._fija:
+            return self._tabla
+        mtime = os.stat(self._ruta()).st_mtime_ns
+        tabla = self._tabla
+        if tabla is not None and mtime == self._mtime:
+            return tabla
+        with self._lock:
+            if self._tabla is None or mtime != self._mtime:
+                self._tabla = tabla_metricas(self._ruta())
+                self._mtime = mtime
+            return self._tabla
+
+    def get(self, comuna: str):
+        """Devuelve (avg_price_uf, superficie, n_properties) o None si la comuna no tiene datos."""
+        return self._vigente().get(comuna)
+
+    def set_tabla(self, tabla: dict):
+        with self._lock:
+            self._tabla = tabla
+            self._mtime = None
+            self._fija = True
+
+    def invalidate(self):
+        with self._lock:
+            self._fija = False
+            self._tabla = None
+            self._mtime = None
@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import math
+import hashlib
+import numpy as np
+import geopandas as gpd
+import shapely
+
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS, distance_modes_from_env
+
+
+# Teselas precalculadas de las features de distancia (ver DistanceTiles).
+TILES_FORMAT = 1
+KM_POR_GRADO = 6371 * np.pi / 180
+
+
+def _firma_comunas(comuna_resolver) -> str:
+    # Los índices de comuna de las teselas son posiciones en comuna_resolver.geoms
+    nombres = '|'.join(str(c) for c in comuna_resolver.atributos['Comuna'])
+    return hashlib.sha256(nombres.encode('utf-8')).hexdigest()
+
+
+def cota_error_km(res: float) -> float:
+    """
+    Error máximo de la interpolación bilineal para una grilla de `res` grados.
+
+    La distancia al elemento más cercano de una capa es 1-Lipschitz: en dos
+    puntos a distancia d sus valores difieren a lo más en d. La bilineal es un
+    promedio ponderado de las cuatro esquinas de la celda, así que su error es
+    a lo más sum(w_i * |p - c_i|), cuyo máximo (en el centro de la celda) es la
+    media diagonal: res * sqrt(2) / 2 grados. En modo 'planar' eso son
+    res * sqrt(2) / 2 * R*pi/180 km; en 'geodesic' el lado este-oeste mide
+    cos(lat) veces menos, así que la misma cota vale (las capas de líneas
+    geodésicas usan una proyección equidistante local, con error de escala
+    despreciable a escala urbana).
+    """
+    return res * math.sqrt(2) / 2 * KM_POR_GRADO
+
+
+class DistanceTiles:
+    """
+    Grilla de dos niveles con las distancias a cada capa y la comuna, para
+    resolver todas las features geográficas con lecturas de arreglos.
+
+    Nivel 1: la extensión de las comunas se divide en bloques de `tile` x `tile`
+    celdas de `res` grados; `indice` (nty, ntx) da la posición del bloque en los
+    arreglos o -1 si el bloque no toca ninguna comuna (no se guarda).
+    Nivel 2: por bloque, el valor de cada capa en los (tile+1)^2 nodos (los
+    bordes se repiten para interpolar sin mirar al bloque vecino) y la comuna de
+    cada celda (-1 si la celda no cae completa dentro de una comuna).
+
+    Implementa nearest_km como SpatialIndexRegistry: los puntos fuera de los
+    bloques se calculan con el índice exacto `respaldo`.
+    """
+
+    def __init__(self, manifest: dict, indice: np.ndarray, capas: dict, comunas: np.ndarray, respaldo=None):
+        self.manifest = manifest
+        self.res = manifest['res']
+        self.tile = manifest['tile']
+        self.origen = tuple(manifest['origen'])
+        self.indice = indice
+        self.capas = capas
+        self.comunas_celda = comunas
+        self.respaldo = respaldo
+
+    @property
+    def modes(self) -> dict:
+        return self.manifest['modes']
+
+    @property
+    def firma(self) -> dict:
+        # Las distancias interpoladas difieren de las exactas: otra firma para cachés y feature store
+        return {**{name: tuple(v) for name, v in self.manifest['firma'].items()},
+                'teselas': (self.manifest['res'], self.manifest['tile'])}
+
+    @property
+    def cota_km(self) -> float:
+        return self.manifest['cota_km']
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.capas
+
+    @classmethod
+    def construir(cls, spatial_index: SpatialIndexRegistry, comuna_resolver, res: float = 0.005,
+                  tile: int = 64, bloques_por_lote: int = 16) -> 'DistanceTiles':
+        minx, miny, maxx, maxy = shapely.total_bounds(comuna_resolver.geoms)
+        ntx = max(int(math.ceil((maxx - minx) / (res * tile))), 1)
+        nty = max(int(math.ceil((maxy - miny) / (res * tile))), 1)
+
+        # Nivel 1: solo los bloques que tocan alguna comuna
+        tx, ty = np.meshgrid(np.arange(ntx), np.arange(nty))
+        tx, ty = tx.ravel(), ty.ravel()
+        x0, y0 = minx + tx * tile * res, miny + ty * tile * res
+        cajas = shapely.box(x0, y0, x0 + tile * res, y0 + tile * res)
+        tocan = np.unique(comuna_resolver.tree.query(cajas, predicate='intersects')[0])
+        indice = np.full((nty, ntx), -1, dtype=np.int32)
+        indice[ty[tocan], tx[tocan]] = np.arange(len(tocan), dtype=np.int32)
+
+        n = len(tocan)
+        valores = {name: np.empty((n, tile + 1, tile + 1)) for name in spatial_index.trees}
+        dtype = np.int16 if len(comuna_resolver.geoms) < np.iinfo(np.int16).max else np.int32
+        comunas = np.full((n, tile, tile), -1, dtype=dtype)
+
+        nodo = np.arange(tile + 1)
+        ii, jj = np.meshgrid(nodo, nodo)
+        for inicio in range(0, n, bloques_por_lote):
+            lote = tocan[inicio:inicio + bloques_por_lote]
+            # Nivel 2: nodos de todos los bloques del lote en una sola consulta por capa
+            lons = (minx + (tx[lote, None, None] * tile + ii) * res).ravel()
+            lats = (miny + (ty[lote, None, None] * tile + jj) * res).ravel()
+            puntos = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lons, lats), crs="EPSG:4326")
+            for name in valores:
+                valores[name][inicio:inicio + len(lote)] = spatial_index.nearest_km(name, puntos).reshape(len(lote), tile + 1, tile + 1)
+
+            # Comuna por celda: solo las celdas completamente dentro de una comuna (como la grilla de ComunaResolver)
+            cx0 = (minx + (tx[lote, None, None] * tile + ii[:-1, :-1]) * res).ravel()
+            cy0 = (miny + (ty[lote, None, None] * tile + jj[:-1, :-1]) * res).ravel()
+            celdas = shapely.box(cx0, cy0, cx0 + res, cy0 + res)
+            idx_celda, idx_com = comuna_resolver.tree.query(celdas, predicate='intersects')
+            dentro = shapely.contains_properly(comuna_resolver.geoms[idx_com], celdas[idx_celda])
+            plano = comunas[inicio:inicio + len(lote)].reshape(-1)
+            plano[idx_celda[dentro]] = idx_com[dentro]
+
+        cota = cota_error_km(res)
+        capas = {}
+        for name, arr in valores.items():
+            # float32 salvo que su redondeo supere 1% de la cota (p.ej. valores enormes en modo planar)
+            maximo = float(np.nanmax(np.abs(arr))) if arr.size else 0.0
+            capas[name] = arr.astype(np.float32) if maximo * 2.0 ** -24 < cota / 100 else arr
+
+        manifest = {
+            'formato': TILES_FORMAT,
+            'res': res,
+            'tile': tile,
+            'origen': [float(minx), float(miny)],
+            'cota_km': cota,
+            'capas': {name: str(arr.dtype) for name, arr in capas.items()},
+            'modes': spatial_index.modes,
+            'firma': spatial_index.firma,
+            'comunas': _firma_comunas(comuna_resolver),
+            'bloques': int(n),
+        }
+        return cls(manifest, indice, capas, comunas, respaldo=spatial_index)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        arreglos = {'indice': self.indice, 'comunas': self.comunas_celda,
+                    **{f"capa_{name}": arr for name, arr in self.capas.items()}}
+        for nombre, arr in arreglos.items():
+            destino = os.path.join(path, f"{nombre}.npy")
+            tmp = f"{destino}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, destino)
+        # El manifest al final: un directorio sin manifest se ignora
+        tmp = os.path.join(path, f"manifest.json.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+    @classmethod
+    def load(cls, path: str, respaldo=None, mmap: bool = True) -> 'DistanceTiles':
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('formato') != TILES_FORMAT:
+            raise ValueError(f"Formato de teselas no soportado: {manifest.get('formato')}")
+        modo = 'r' if mmap else None
+        capas = {name: np.load(os.path.join(path, f"capa_{name}.npy"), mmap_mode=modo) for name in manifest['capas']}
+        return cls(manifest,
+                   np.load(os.path.join(path, 'indice.npy')),
+                   capas,
+                   np.load(os.path.join(path, 'comunas.npy'), mmap_mode=modo),
+                   respaldo=respaldo)
+
+    def compatible(self, spatial_index, comuna_resolver) -> bool:
+        """True si las teselas se construyeron con las mismas capas, modos y comunas."""
+        firma = {name: tuple(v) for name, v in self.manifest['firma'].items()}
+        return (firma == spatial_index.firma and self.manifest['modes'] == spatial_index.modes
+                and self.manifest['comunas'] == _firma_comunas(comuna_resolver))
+
+    def _ubicar(self, lats, lons) -> tuple:
+        # (bloque, fila, columna) de la celda de cada punto y posición dentro de la celda; bloque -1 = fuera
+        fx = (np.asarray(lons, dtype=float) - self.origen[0]) / self.res
+        fy = (np.asarray(lats, dtype=float) - self.origen[1]) / self.res
+        cx, cy = np.floor(fx), np.floor(fy)
+        validos = np.isfinite(cx) & np.isfinite(cy)
+        cx = np.where(validos, cx, -1).astype(np.int64)
+        cy = np.where(validos, cy, -1).astype(np.int64)
+        tx, ty = cx // self.tile, cy // self.tile
+        nty, ntx = self.indice.shape
+        dentro = (cx >= 0) & (cy >= 0) & (tx < ntx) & (ty < nty)
+        bloque = np.full(len(cx), -1, dtype=np.int64)
+        bloque[dentro] = self.indice[ty[dentro], tx[dentro]]
+        return bloque, cy - ty * self.tile, cx - tx * self.tile, fx - cx, fy - cy
+
+    def interpolar(self, name: str, lats, lons, _ubicacion: tuple = None) -> np.ndarray:
+        """Distancia interpolada a la capa `name` (NaN para puntos fuera de los bloques)."""
+        bloque, j, i, u, v = _ubicacion or self._ubicar(lats, lons)
+        out = np.full(len(bloque), np.nan)
+        ok = bloque >= 0
+        if ok.any():
+            arr = self.capas[name]
+            b, j, i, u, v = bloque[ok], j[ok], i[ok], u[ok], v[ok]
+            out[ok] = ((1 - u) * (1 - v) * arr[b, j, i] + u * (1 - v) * arr[b, j, i + 1]
+                       + (1 - u) * v * arr[b, j + 1, i] + u * v * arr[b, j + 1, i + 1])
+        return out
+
+    def comuna_indices(self, lats, lons) -> np.ndarray:
+        """Índice de comuna (posición en ComunaResolver.geoms) de cada punto, -1 si no se resuelve aquí."""
+        bloque, j, i, _, _ = self._ubicar(lats, lons)
+        out = np.full(len(bloque), -1, dtype=np.int64)
+        ok = bloque >= 0
+        out[ok] = self.comunas_celda[bloque[ok], j[ok], i[ok]]
+        return out
+
+    def distancias(self, lats, lons, capas) -> dict:
+        """
+        {capa: km} para cada punto, ubicando la celda una sola vez para todas
+        las capas. Los puntos fuera de los bloques se calculan con `respaldo`.
+        """
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        ubicacion = self._ubicar(lats, lons)
+        fuera = np.flatnonzero(ubicacion[0] < 0)
+        puntos = None
+        if len(fuera) and self.respaldo is not None:
+            puntos = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lons[fuera], lats[fuera]), crs="EPSG:4326")
+        out = {}
+        for name in capas:
+            out[name] = self.interpolar(name, lats, lons, ubicacion)
+            if puntos is not None:
+                out[name][fuera] = self.respaldo.nearest_km(name, puntos)
+        return out
+
+    def nearest_km(self, name: str, src: gpd.GeoDataFrame) -> np.ndarray:
+        coords = shapely.get_coordinates(src.geometry.values)
+        return self.distancias(coords[:, 1], coords[:, 0], [name])[name]
+
+
+def leer_manifest(path: str):
+    """Manifest de las teselas en `path`, None si no hay."""
+    try:
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+def aplicar_teselas(path: str, spatial_index, comuna_resolver, mmap: bool = True):
+    """
+    Carga las teselas de `path` sobre `spatial_index` y las conecta al
+    `comuna_resolver`. Devuelve el índice a usar: las teselas, o el índice
+    exacto si no existen o se construyeron desde otras capas, modos o comunas.
+    """
+    if not path or not os.path.exists(os.path.join(path, 'manifest.json')):
+        return spatial_index
+    tiles = DistanceTiles.load(path, respaldo=spatial_index, mmap=mmap)
+    if not tiles.compatible(spatial_index, comuna_resolver):
+        print(f"Teselas de distancia en {path} desactualizadas; se usan los índices exactos")
+        return spatial_index
+    comuna_resolver.teselas = tiles
+    return tiles
+
+
+if __name__ == '__main__':
+    # Paso de build: python distance_tiles.py [directorio]
+    from dotenv import load_dotenv
+    from comuna_resolver import ComunaResolver
+    load_dotenv()
+    destino = sys.argv[1] if len(sys.argv) > 1 else os.getenv('DISTANCE_TILES_PATH') or 'data_preprocessed/distance_tiles'
+    paths = {
+        'ed_superior': os.getenv('ED_SUPERIOR_SHP', 'data_preprocessed/ed_superior.parquet').strip("'\""),
+        'ed_escolar':  os.getenv('ED_ESCOLAR_SHP',  'data_preprocessed/ed_escolar.parquet').strip("'\""),
+        'comisarias':  os.getenv('COMISARIAS_SHP',  'data_preprocessed/comisarias.parquet').strip("'\""),
+        'salud':       os.getenv('SALUD_SHP',       'data_preprocessed/salud.parquet').strip("'\""),
+        'metro':       os.getenv('METRO_SHP',       'data_preprocessed/metro.parquet').strip("'\""),
+    }
+    comunas_gdf = gpd.read_parquet(os.getenv('COMUNAS_SHP', 'data_preprocessed/comunas.parquet').strip("'\""))
+    tiles = DistanceTiles.construir(
+        SpatialIndexRegistry.from_paths({name: paths[name] for name in POINT_LAYERS + LINE_LAYERS}, distance_modes_from_env()),
+        ComunaResolver(comunas_gdf[['geometry', 'Comuna', 'Region']]),
+        res=float(os.getenv('DISTANCE_TILES_RES', 0.005)),
+        tile=int(os.getenv('DISTANCE_TILES_TILE', 64)))
+    tiles.save(destino)
+    print(f"Teselas guardadas en: {destino} ({tiles.manifest['bloques']} bloques, error máximo {tiles.cota_km:.3f} km)")
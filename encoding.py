@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+
+# Codificación de las variables categóricas para entrenar:
+#   onehot: one-hot denso para todos los modelos (histórico)
+#   sparse: one-hot en matriz dispersa
+#   native: LightGBM y CatBoost reciben las categorías tal cual (dtype category / cat_features);
+#           el resto de los modelos usa one-hot disperso
+ENCODING_MODES = ('onehot', 'sparse', 'native')
+ENCODING_MODE = os.getenv('ENCODING_MODE', 'onehot').strip().lower()
+
+# Estimadores que manejan categorías de forma nativa
+NATIVE_CATEGORICAL = ('LGBMRegressor', 'CatBoostRegressor')
+
+
+# Valor de CatBoost para categorías no vistas en el fit (y faltantes)
+CATEGORIA_DESCONOCIDA = '__desconocido__'
+
+
+class ACategoria(BaseEstimator, TransformerMixin):
+    """
+    Convierte columnas a dtype category con las categorías vistas en el fit.
+    Una categoría desconocida queda como NaN (LightGBM la trata como faltante).
+
+    Con `como_texto` (CatBoost, que no acepta NaN en cat_features) las columnas
+    salen como texto y las categorías desconocidas o faltantes como
+    CATEGORIA_DESCONOCIDA.
+    """
+
+    def __init__(self, como_texto: bool = False):
+        self.como_texto = como_texto
+
+    def fit(self, X, y=None):
+        X = pd.DataFrame(X)
+        self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        self.categories_ = [sorted(X[col].dropna().unique().tolist()) for col in X.columns]
+        return self
+
+    def transform(self, X):
+        X = pd.DataFrame(X, columns=self.feature_names_in_)
+        salida = {}
+        for col, cats in zip(self.feature_names_in_, self.categories_):
+            # Las no vistas se marcan faltantes antes (pandas deja de aceptarlas en pd.Categorical)
+            cat = pd.Categorical(X[col].where(X[col].isin(cats)), categories=cats)
+            # getattr: pipelines guardados antes de que existiera el parámetro
+            if getattr(self, 'como_texto', False):
+                cat = np.where(pd.isna(cat), CATEGORIA_DESCONOCIDA, np.asarray(cat, dtype=object).astype(str)).astype(object)
+            salida[col] = cat
+        return pd.DataFrame(salida, index=X.index)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(self.feature_names_in_, dtype=object)
+
+
+def codificacion_para(model, mode: str = None) -> str:
+    """Codificación efectiva ('onehot', 'sparse' o 'native') de un estimador según el modo."""
+    mode = mode or ENCODING_MODE
+    if mode not in ENCODING_MODES:
+        raise ValueError(f"ENCODING_MODE no soportado: {mode}")
+    if mode == 'onehot':
+        return 'onehot'
+    if mode == 'native' and type(model).__name__ in NATIVE_CATEGORICAL:
+        return 'native'
+    return 'sparse'
+
+
+def construir_preprocesador(num_cols: list, cat_cols: list, codificacion: str = 'onehot',
+                            como_texto: bool = False) -> ColumnTransformer:
+    numeric_transformer = Pipeline([('imputer', SimpleImputer(strategy='median')), ('scaler', StandardScaler())])
+    if codificacion == 'native':
+        categorical_transformer = Pipeline([('imputer', SimpleImputer(strategy='most_frequent')),
+                                            ('categoria', ACategoria(como_texto))])
+        # Salida DataFrame con los nombres originales: las columnas category llegan al estimador
+        return ColumnTransformer(
+            [('num', numeric_transformer, num_cols), ('cat', categorical_transformer, cat_cols)],
+            verbose_feature_names_out=False).set_output(transform='pandas')
+
+    sparse = codificacion == 'sparse'
+    categorical_transformer = Pipeline([('imputer', SimpleImputer(strategy='most_frequent')), ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=sparse))])
+    # sparse_threshold=1: con one-hot disperso la salida es siempre una matriz dispersa
+    return ColumnTransformer([('num', numeric_transformer, num_cols), ('cat', categorical_transformer, cat_cols)],
+                             sparse_threshold=1.0 if sparse else 0.3)
+
+
+def columnas_de(preprocessor: ColumnTransformer) -> tuple:
+    """(num_cols, cat_cols) de un preprocesador armado con construir_preprocesador."""
+    cols = {name: list(c) for name, _, c in preprocessor.transformers}
+    return cols.get('num', []), cols.get('cat', [])
+
+
+def categorias_como_texto(model) -> bool:
+    # CatBoost recibe las categorías como texto (ver ACategoria); LightGBM como category
+    return type(model).__name__ == 'CatBoostRegressor'
+
+
+def parametros_nativos(model, cat_cols: list) -> dict:
+    # LightGBM detecta las columnas category solo; CatBoost necesita cat_features
+    # (tupla: con una lista sklearn.clone rechaza el CatBoostRegressor)
+    if type(model).__name__ == 'CatBoostRegressor':
+        return {'cat_features': tuple(cat_cols)}
+    return {}
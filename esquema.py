@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pandas as pd
+
+from data_metrics import COLUMNAS_METRICAS
+from comparables import COLUMNAS as COLUMNAS_COMPARABLES
+
+
+# Carga compacta del entrenamiento (TRAIN_COMPACT_DTYPES=true), para que el pico de memoria
+# no limite el tamaño del scrape:
+#   - de witness_scrapper y resultados_qa.xlsx se leen solo las columnas que se usan
+#   - el texto libre (desc) se descarta apenas se extraen dormitorios y estacionamientos
+#   - categorías, float32 y enteros chicos nullable en vez de object/float64
+#   - sin columna geometry de shapely: comuna y distancias salen de latitud/longitud
+#   - df_metrics.parquet solo con las columnas que leen metricas_comuna y /comparables
+# Con float32 el modelo entrenado puede diferir en los últimos decimales del histórico.
+TRAIN_COMPACT_DTYPES = os.getenv('TRAIN_COMPACT_DTYPES', 'false').lower() == 'true'
+
+COLUMNAS_EXTRACCION = (
+    'id', 'divisa', 'precio', 'desc', 'tipo', 'superficie_total', 'superficie_util',
+    'dormitorios', 'banos', 'estacionamientos', 'antiguedad', 'latitud', 'longitud')
+# Texto que solo sirve para las extracciones con regex de limpiar()
+COLUMNAS_TEXTO = ('desc',)
+
+DISTANCIAS = ('distancia_ed_superior_km', 'distancia_ed_escolar_km', 'distancia_comisaria_km',
+              'distancia_est_salud_km', 'distancia_metro_km')
+ESQUEMA = {
+    'id': 'Int64',
+    'divisa': 'category',
+    'tipo': 'category',
+    'Comuna': 'category',
+    'Region': 'category',
+    'precio': 'float32',
+    'superficie_total': 'float32',
+    'superficie_util': 'float32',
+    'antiguedad': 'float32',
+    'banos': 'float32',
+    'dormitorios': 'Int16',
+    'estacionamientos': 'Int16',
+    # latitud/longitud siguen en float64: en float32 el error llega al metro y cambia comuna y distancias
+    **{col: 'float32' for col in DISTANCIAS},
+}
+
+COLUMNAS_DF_METRICS = tuple(dict.fromkeys(COLUMNAS_METRICAS + COLUMNAS_COMPARABLES + ('Region',)))
+
+
+def compactar(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aplica ESQUEMA a las columnas presentes. Se vuelve a llamar después de
+    cada concat: dos columnas category con distintas categorías se concatenan
+    como texto.
+    """
+    df = df.copy() if not df.empty else df
+    for col, dtype in ESQUEMA.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype.startswith('Int'):
+            valores = pd.to_numeric(df[col], errors='coerce').round()
+            info = np.iinfo(dtype.lower())
+            # Fuera de rango (basura de la extracción) queda como faltante, igual que un valor no numérico
+            df[col] = valores.where((valores >= info.min) & (valores <= info.max)).astype(dtype)
+        elif dtype == 'category':
+            df[col] = df[col].astype('category')
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    return df
+
+
+def columnas_df_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """Solo las columnas de df_metrics que se leen al servir."""
+    return pd.DataFrame(df[[c for c in COLUMNAS_DF_METRICS if c in df.columns]])
+
+
+def memoria_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1e6
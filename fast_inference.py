@@ -0,0 +1,208 @@
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+
+def _es_nulo(valor) -> bool:
+    return valor is None or valor is pd.NA or (isinstance(valor, float) and valor != valor)
+
+
+def _a_float(valor) -> float:
+    return np.nan if _es_nulo(valor) else float(valor)
+
+
+class CompiledModel:
+    """
+    Versión compilada del Pipeline de model.py para servir predicciones.
+
+    El ColumnTransformer se reduce a tablas planas (medianas, media/escala del
+    StandardScaler y lookups valor -> columna del OneHotEncoder) con el mismo
+    orden de columnas, y el estimador queda en su formato nativo de predicción
+    (Booster de LightGBM). Evita el costo fijo de pandas/sklearn por request.
+    """
+
+    def __init__(self, bloques: list, n_features: int, estimador, booster_str: str = None):
+        self.bloques = bloques
+        self.n_features = n_features
+        self.estimador = estimador
+        self.booster_str = booster_str
+        self._booster = None
+        self._cargar_booster()
+
+    def _cargar_booster(self):
+        if self.booster_str is not None:
+            import lightgbm as lgb
+            self._booster = lgb.Booster(model_str=self.booster_str)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_booster'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cargar_booster()
+
+    @property
+    def columnas(self) -> list:
+        return [col for bloque in self.bloques for col in bloque['cols']]
+
+    def _matriz(self, columna, n: int, falta) -> np.ndarray:
+        # columna(nombre) -> secuencia con los valores crudos de esa columna;
+        # falta(nombre) -> True si alguna fila no trae esa columna
+        # Igual que el ColumnTransformer: una columna ausente es un error, solo se imputan None/NaN
+        faltantes = [col for col in self.columnas if falta(col)]
+        if faltantes:
+            raise ValueError(f"columns are missing: {set(faltantes)}")
+        X = np.zeros((n, self.n_features))
+        pos = 0
+        for bloque in self.bloques:
+            if bloque['tipo'] == 'num':
+                for j, col in enumerate(bloque['cols']):
+                    v = np.fromiter((_a_float(x) for x in columna(col)), dtype=float, count=n)
+                    v = np.where(np.isnan(v), bloque['fill'][j], v)
+                    X[:, pos] = (v - bloque['mean'][j]) / bloque['scale'][j]
+                    pos += 1
+            elif bloque['tipo'] == 'categoria':
+                for j, col in enumerate(bloque['cols']):
+                    lookup = bloque['lookup'][j]
+                    for i, v in enumerate(columna(col)):
+                        if _es_nulo(v):
+                            v = bloque['fill'][j]
+                        # Código de la categoría; desconocida = NaN (faltante para LightGBM)
+                        X[i, pos] = lookup.get(v, np.nan)
+                    pos += 1
+            else:
+                for j, col in enumerate(bloque['cols']):
+                    lookup = bloque['lookup'][j]
+                    for i, v in enumerate(columna(col)):
+                        if _es_nulo(v):
+                            v = bloque['fill'][j]
+                        k = lookup.get(v)
+                        # Categoría desconocida: fila en ceros (handle_unknown='ignore')
+                        if k is not None:
+                            X[i, pos + k] = 1.0
+                    pos += bloque['widths'][j]
+        return X
+
+    def transform(self, X) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            return self._matriz(lambda col: X[col].to_numpy(dtype=object), len(X), lambda col: col not in X)
+        return self.transform_records(X)
+
+    def transform_records(self, records: list) -> np.ndarray:
+        return self._matriz(lambda col: [r[col] for r in records], len(records),
+                            lambda col: any(col not in r for r in records))
+
+    def _predecir_matriz(self, M: np.ndarray) -> np.ndarray:
+        if self._booster is not None:
+            return self._booster.predict(M, num_threads=1)
+        return np.asarray(self.estimador.predict(M))
+
+    def predict(self, X) -> np.ndarray:
+        return self._predecir_matriz(self.transform(X))
+
+    def predict_records(self, records: list) -> np.ndarray:
+        return self._predecir_matriz(self.transform_records(records))
+
+
+def _compilar_num(pipe: Pipeline, cols: list) -> dict:
+    imputer, scaler = pipe.named_steps['imputer'], pipe.named_steps['scaler']
+    if not isinstance(imputer, SimpleImputer) or not isinstance(scaler, StandardScaler) or imputer.add_indicator:
+        raise ValueError("Transformador numérico no soportado para compilar")
+    stats = np.asarray(imputer.statistics_, dtype=float)
+    # SimpleImputer descarta las columnas sin ningún valor en el fit
+    validas = ~np.isnan(stats) if not imputer.keep_empty_features else np.ones(len(stats), dtype=bool)
+    n = int(validas.sum())
+    mean = scaler.mean_ if scaler.mean_ is not None and scaler.with_mean else np.zeros(n)
+    scale = scaler.scale_ if scaler.scale_ is not None and scaler.with_std else np.ones(n)
+    return {
+        'tipo': 'num',
+        'cols': [c for c, ok in zip(cols, validas) if ok],
+        'fill': stats[validas].tolist(),
+        'mean': np.asarray(mean, dtype=float).tolist(),
+        'scale': np.asarray(scale, dtype=float).tolist(),
+    }
+
+
+def _compilar_categoria(pipe: Pipeline, cols: list) -> dict:
+    # Categorías nativas (encoding.ACategoria): una columna con el código de cada categoría
+    imputer, categoria = pipe.named_steps['imputer'], pipe.named_steps['categoria']
+    if not isinstance(imputer, SimpleImputer) or imputer.add_indicator:
+        raise ValueError("Transformador categórico no soportado para compilar")
+    stats = imputer.statistics_
+    validas = [not _es_nulo(s) for s in stats] if not imputer.keep_empty_features else [True] * len(stats)
+    return {
+        'tipo': 'categoria',
+        'cols': [c for c, ok in zip(cols, validas) if ok],
+        'fill': [s for s, ok in zip(stats, validas) if ok],
+        'lookup': [{v: k for k, v in enumerate(cats)} for cats in categoria.categories_],
+    }
+
+
+def _compilar_cat(pipe: Pipeline, cols: list) -> dict:
+    if 'categoria' in pipe.named_steps:
+        return _compilar_categoria(pipe, cols)
+    imputer, onehot = pipe.named_steps['imputer'], pipe.named_steps['onehot']
+    if (not isinstance(imputer, SimpleImputer) or not isinstance(onehot, OneHotEncoder)
+            or imputer.add_indicator or onehot.drop is not None
+            or getattr(onehot, '_infrequent_enabled', False)):
+        raise ValueError("Transformador categórico no soportado para compilar")
+    stats = imputer.statistics_
+    validas = [not _es_nulo(s) for s in stats] if not imputer.keep_empty_features else [True] * len(stats)
+    return {
+        'tipo': 'onehot',
+        'cols': [c for c, ok in zip(cols, validas) if ok],
+        'fill': [s for s, ok in zip(stats, validas) if ok],
+        'lookup': [{v: k for k, v in enumerate(cats)} for cats in onehot.categories_],
+        'widths': [len(cats) for cats in onehot.categories_],
+    }
+
+
+def compilar_pipeline(pipe: Pipeline) -> CompiledModel:
+    """Compila el Pipeline (preprocessor + model) entrenado en model.entrenar_y_guardar_modelo."""
+    preproc = pipe.named_steps['preprocessor']
+    estimador = pipe.named_steps['model']
+
+    bloques = []
+    for name, trans, cols in preproc.transformers_:
+        if trans == 'drop' or len(cols) == 0:
+            continue
+        if name == 'num':
+            bloques.append(_compilar_num(trans, list(cols)))
+        elif name == 'cat':
+            bloques.append(_compilar_cat(trans, list(cols)))
+        else:
+            raise ValueError(f"Transformador '{name}' no soportado para compilar")
+    n_features = sum(sum(b['widths']) if b['tipo'] == 'onehot' else len(b['cols']) for b in bloques)
+
+    booster_str = None
+    if type(estimador).__name__ == 'LGBMRegressor':
+        booster_str = estimador.booster_.model_to_string()
+        estimador = None
+    elif any(b['tipo'] == 'categoria' for b in bloques):
+        # CatBoost con cat_features espera los valores originales, no códigos
+        raise ValueError("Las categorías nativas solo se compilan para LightGBM")
+    return CompiledModel(bloques, n_features, estimador, booster_str)
+
+
+def exportar_modelo_compilado(pipe: Pipeline, X_muestra: pd.DataFrame, path: str, rtol: float = 1e-6) -> CompiledModel:
+    """
+    Compila el pipeline, verifica que reproduce sus predicciones sobre `X_muestra`
+    y lo serializa en `path`.
+    """
+    compilado = compilar_pipeline(pipe)
+    esperado = pipe.predict(X_muestra)
+    obtenido = compilado.predict_records(X_muestra.to_dict('records'))
+    np.testing.assert_allclose(obtenido, esperado, rtol=rtol, atol=1e-6)
+    joblib.dump(compilado, path)
+    return compilado
+
+
+def compiled_path_for(model_path: str) -> str:
+    root, ext = os.path.splitext(model_path)
+    return f"{root}_compilado{ext}"
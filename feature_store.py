@@ -0,0 +1,114 @@
+import os
+import json
+import glob
+import time
+import shutil
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+
+# Columna interna con la fecha_modificacion de origen, tal como la entrega la BD
+COLUMNA_VERSION = '_fecha_origen'
+
+
+def _leer_parte(path: str) -> pd.DataFrame:
+    # Con la carga compacta (esquema.py) las partes no traen geometría
+    if b'geo' in (pq.read_schema(path).metadata or {}):
+        return gpd.read_parquet(path)
+    return pd.read_parquet(path)
+
+
+class FeatureStore:
+    """
+    Features ya procesadas (limpieza, comuna y distancias) por `id`, con la
+    `fecha_modificacion` de origen de cada fila.
+
+    Cada corrida agrega un archivo parte con las filas nuevas o modificadas; al
+    leer gana la última versión de cada id y se descartan los ids que ya no
+    están en la tabla. Con más de `max_partes` partes se compacta en una sola.
+    Si cambia `contexto` (capas POI, comunas, modos de distancia o versión del
+    pipeline) el store se vacía y se reconstruye completo.
+    """
+
+    def __init__(self, path: str, contexto: str, max_partes: int = 20, reiniciar: bool = False):
+        self.path = path
+        self.contexto = contexto
+        self.max_partes = max_partes
+        self._abrir(reiniciar)
+
+    def _ruta_manifest(self) -> str:
+        return os.path.join(self.path, 'manifest.json')
+
+    def _abrir(self, reiniciar: bool):
+        try:
+            with open(self._ruta_manifest(), encoding='utf-8') as f:
+                vigente = json.load(f).get('contexto') == self.contexto and not reiniciar
+        except (FileNotFoundError, json.JSONDecodeError):
+            vigente = False
+        if not vigente:
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path)
+            tmp = f"{self._ruta_manifest()}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'contexto': self.contexto}, f)
+            os.replace(tmp, self._ruta_manifest())
+
+    def partes(self) -> list:
+        return sorted(glob.glob(os.path.join(glob.escape(self.path), 'part-*.parquet')))
+
+    @property
+    def vacio(self) -> bool:
+        return not self.partes()
+
+    def _versiones(self) -> pd.DataFrame:
+        partes = [pd.read_parquet(p, columns=['id', COLUMNA_VERSION]) for p in self.partes()]
+        return pd.concat(partes, ignore_index=True).drop_duplicates('id', keep='last')
+
+    @staticmethod
+    def _versiones_de(actuales: pd.DataFrame) -> pd.DataFrame:
+        return pd.DataFrame({'id': actuales['id'].to_numpy(),
+                             COLUMNA_VERSION: actuales['fecha_modificacion'].astype(str).to_numpy()})
+
+    def pendientes(self, actuales: pd.DataFrame) -> np.ndarray:
+        """
+        Ids de `actuales` (columnas id y fecha_modificacion de la tabla) que no
+        están en el store o cuya fecha_modificacion cambió.
+        """
+        if self.vacio:
+            return actuales['id'].to_numpy()
+        cruce = self._versiones_de(actuales).merge(self._versiones(), on='id', how='left', suffixes=('', '_store'))
+        return cruce.loc[cruce[COLUMNA_VERSION] != cruce[f"{COLUMNA_VERSION}_store"], 'id'].to_numpy()
+
+    def agregar(self, gdf: gpd.GeoDataFrame, actuales: pd.DataFrame):
+        """Guarda las filas procesadas con la fecha_modificacion que tenían en `actuales`."""
+        if len(gdf) == 0:
+            return
+        versiones = self._versiones_de(actuales).set_index('id')[COLUMNA_VERSION]
+        gdf = gdf.copy()
+        gdf[COLUMNA_VERSION] = versiones.reindex(gdf['id'].to_numpy()).to_numpy()
+        self._escribir_parte(gdf)
+
+    def _escribir_parte(self, gdf: gpd.GeoDataFrame):
+        path = os.path.join(self.path, f"part-{time.time_ns()}.parquet")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        gdf.to_parquet(tmp)
+        os.replace(tmp, path)
+
+    def leer(self, ids_vigentes) -> gpd.GeoDataFrame:
+        """Última versión de cada fila cuyo id siga en la tabla, ordenadas por id."""
+        partes = self.partes()
+        if not partes:
+            return gpd.GeoDataFrame()
+        df = pd.concat([_leer_parte(p) for p in partes], ignore_index=True)
+        df = df.drop_duplicates('id', keep='last')
+        df = df[df['id'].isin(ids_vigentes)].sort_values('id', kind='stable').reset_index(drop=True)
+        if len(partes) > self.max_partes:
+            self._compactar(df, partes)
+        return df.drop(columns=[COLUMNA_VERSION])
+
+    def _compactar(self, df: gpd.GeoDataFrame, partes: list):
+        self._escribir_parte(df)
+        for parte in partes:
+            os.remove(parte)
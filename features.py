@@ -0,0 +1,143 @@
+import numpy as np
+import geopandas as gpd
+
+from utils import normalize_str
+from distance_tiles import DistanceTiles
+from instrumentation import etapa
+from prediction_cache import clave_coordenadas
+
+
+# Columna de feature -> capa del SpatialIndexRegistry
+DISTANCE_FEATURES = {
+    'distancia_ed_superior_km': 'ed_superior',
+    'distancia_ed_escolar_km':  'ed_escolar',
+    'distancia_comisaria_km':   'comisarias',
+    'distancia_est_salud_km':   'salud',
+    'distancia_metro_km':       'metro',
+}
+
+ERROR_COORDENADAS = "Debes enviar las coordenadas 'latitud' y 'longitud'"
+ERROR_FUERA_LIMITES = "Coordenadas fuera de los límites de las comunas conocidas."
+
+
+def calcular_distancias(lats, lons, spatial_index) -> dict:
+    # Con teselas (ver distance_tiles.py) la celda de cada punto se ubica una vez para todas las capas
+    if isinstance(spatial_index, DistanceTiles):
+        with etapa('distancias_teselas'):
+            por_capa = spatial_index.distancias(lats, lons, DISTANCE_FEATURES.values())
+        return {col: por_capa[layer] for col, layer in DISTANCE_FEATURES.items()}
+    # Una consulta por capa para todo el lote
+    puntos = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(lons, lats),
+        crs="EPSG:4326"
+    )
+    distancias = {}
+    for col, layer in DISTANCE_FEATURES.items():
+        with etapa(f"distancia_{layer}"):
+            distancias[col] = spatial_index.nearest_km(layer, puntos)
+    return distancias
+
+
+def distancias_con_cache(coords: list, spatial_index, cache, firma: str) -> list:
+    """
+    Distancias de cada (lat, lon) de `coords`, reutilizando las que ya estén en
+    `cache`; las que faltan se calculan en una sola consulta por capa.
+    """
+    claves = [clave_coordenadas(lat, lon, firma) for lat, lon in coords]
+    resultado = [cache.get(clave) for clave in claves]
+    faltantes = [j for j, d in enumerate(resultado) if d is None]
+    if faltantes:
+        calculadas = calcular_distancias(
+            np.array([coords[j][0] for j in faltantes]),
+            np.array([coords[j][1] for j in faltantes]),
+            spatial_index)
+        for k, j in enumerate(faltantes):
+            resultado[j] = {col: float(valores[k]) for col, valores in calculadas.items()}
+            cache.set(claves[j], resultado[j])
+    return resultado
+
+
+def preparar_lote(items: list, comuna_resolver, region_map: dict, spatial_index,
+                  cache_distancias=None, firma_indice: str = ''):
+    """
+    Valida y arma las features de un lote de propiedades.
+
+    Devuelve dos listas alineadas con `items`: las features de cada elemento
+    (None si falló) y el mensaje de error de cada elemento (None si es válido).
+    Con `cache_distancias` las distancias se buscan primero ahí, por
+    coordenada y `firma_indice` (ver prediction_cache.firma_indice).
+    """
+    n = len(items)
+    features = [None] * n
+    errores = [None] * n
+    comunas = [None] * n
+    coords = [None] * n
+
+    # 1) Coordenadas y comuna informada
+    sin_comuna = []
+    for i, data in enumerate(items):
+        if not isinstance(data, dict):
+            errores[i] = "Cada propiedad debe ser un objeto JSON"
+            continue
+        lat = data.get('latitud')
+        lon = data.get('longitud')
+        if lat is None or lon is None:
+            errores[i] = ERROR_COORDENADAS
+            continue
+        try:
+            coords[i] = (float(lat), float(lon))
+        except (TypeError, ValueError):
+            errores[i] = "'latitud' y 'longitud' deben ser numéricas"
+            continue
+        # NaN/Infinity pasan el parser JSON y float(), pero rompen la consulta a los índices de todo el lote
+        if not (np.isfinite(coords[i][0]) and np.isfinite(coords[i][1])):
+            errores[i] = "'latitud' y 'longitud' deben ser números finitos"
+            continue
+        raw = data.get('Comuna') or data.get('comuna')
+        if raw and not isinstance(raw, str):
+            errores[i] = "'Comuna' debe ser texto"
+            continue
+        if raw:
+            comunas[i] = normalize_str(raw)
+        else:
+            sin_comuna.append(i)
+
+    # 2) Comuna desde coordenadas, en una sola consulta para todo el lote
+    if sin_comuna:
+        with etapa('comuna'):
+            encontradas = comuna_resolver.comunas(
+                [coords[i][0] for i in sin_comuna],
+                [coords[i][1] for i in sin_comuna])
+        for i, comuna in zip(sin_comuna, encontradas):
+            if comuna is None:
+                errores[i] = ERROR_FUERA_LIMITES
+            else:
+                comunas[i] = normalize_str(comuna.strip().lower())
+
+    # 3) Validar región y armar payload unificado
+    validos = []
+    for i in range(n):
+        if errores[i] is not None:
+            continue
+        region = region_map.get(comunas[i])
+        if not region:
+            errores[i] = f"Comuna '{comunas[i]}' no está permitida"
+            continue
+        features[i] = {**items[i], 'Comuna': comunas[i], 'Region': region, 'divisa': 'UF'}
+        validos.append(i)
+
+    # 4) Distancias
+    if validos and cache_distancias is not None:
+        distancias = distancias_con_cache([coords[i] for i in validos], spatial_index, cache_distancias, firma_indice)
+        for i, d in zip(validos, distancias):
+            features[i].update(d)
+    elif validos:
+        distancias = calcular_distancias(
+            np.array([coords[i][0] for i in validos]),
+            np.array([coords[i][1] for i in validos]),
+            spatial_index)
+        for col, valores in distancias.items():
+            for j, i in enumerate(validos):
+                features[i][col] = valores[j]
+
+    return features, errores
@@ -0,0 +1,32 @@
+import gc
+import os
+import multiprocessing
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8080')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+
+# Con preload el master importa app.py una sola vez (modelo, índices espaciales,
+# polígonos de comunas, mapa comuna-región) y los workers lo heredan por fork,
+# compartiendo esas páginas copy-on-write en vez de cargar todo por worker.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def on_starting(server):
+    # Métricas por worker (METRICS_MULTIPROC_DIR): se descartan las de una corrida anterior
+    import instrumentation
+    instrumentation.limpiar_multiproceso()
+
+
+def pre_fork(server, worker):
+    # Los objetos ya cargados pasan a la generación permanente: el GC de los
+    # workers no los recorre y no ensucia sus páginas compartidas
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # El pool de conexiones del master no se comparte con los workers
+    if preload_app:
+        import app
+        app.engine.dispose(close=False)
@@ -0,0 +1,319 @@
+import os
+import sys
+import glob
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from datetime import datetime
+
+
+# Métricas en memoria con exposición en formato de texto de Prometheus.
+#   METRICS_MULTIPROC_DIR   con varios workers (gunicorn), cada uno vuelca sus métricas a
+#                           <dir>/metricas-<pid>.json y el scrape las suma todas
+#   PROFILE_SLOW_REQUEST_MS requests más lentos que esto dejan sus stacks muestreados
+#                           (formato folded, para flamegraph.pl o speedscope) en PROFILE_DIR
+PREFIJO = 'valuaciones'
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))
+
+logger = logging.getLogger(__name__)
+
+
+def _formato(valor) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def _etiquetas(labels: tuple, extra: tuple = ()) -> str:
+    pares = list(labels) + list(extra)
+    if not pares:
+        return ''
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in pares) + '}'
+
+
+class Registro:
+    """
+    Contadores e histogramas con etiquetas, seguros entre hilos. Los
+    colectores son funciones que al exponer devuelven gauges del momento
+    (estadísticas de caché, versión del modelo, etc.).
+    """
+
+    def __init__(self, multiproc_dir: str = '', flush_interval: float = 1.0):
+        self._lock = threading.Lock()
+        self._definiciones = {}
+        self._series = {}
+        self._colectores = []
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self._ultimo_volcado = 0.0
+
+    def definir(self, nombre: str, tipo: str, ayuda: str, buckets: tuple = None):
+        self._definiciones[nombre] = {'tipo': tipo, 'ayuda': ayuda, 'buckets': list(buckets or ())}
+        self._series.setdefault(nombre, {})
+
+    def incrementar(self, nombre: str, valor: float = 1, **labels):
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[nombre]
+            series[clave] = series.get(clave, 0) + valor
+
+    def observar(self, nombre: str, valor: float, **labels):
+        buckets = self._definiciones[nombre]['buckets']
+        clave = tuple(sorted(labels.items()))
+        with self._lock:
+            serie = self._series[nombre].get(clave)
+            if serie is None:
+                # [conteo por bucket..., conteo en +Inf, suma]
+                serie = self._series[nombre][clave] = [0] * (len(buckets) + 1) + [0.0]
+            serie[bisect.bisect_left(buckets, valor)] += 1
+            serie[-1] += valor
+
+    def colector(self, fn):
+        """fn() -> lista de (nombre, tipo, ayuda, [(labels dict, valor)])."""
+        self._colectores.append(fn)
+        return fn
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return {nombre: {**self._definiciones[nombre],
+                             'series': [[list(map(list, k)), v if isinstance(v, (int, float)) else list(v)]
+                                        for k, v in series.items()]}
+                    for nombre, series in self._series.items()}
+
+    def _colectar(self) -> list:
+        familias = []
+        for fn in self._colectores:
+            try:
+                familias.extend(fn())
+            except Exception as e:
+                logger.warning(f"Colector de métricas falló: {e}")
+        return familias
+
+    # --- Varios procesos ---
+
+    def volcar(self, forzar: bool = False):
+        """Con multiproc_dir, guarda las métricas del proceso (como mucho cada flush_interval segundos)."""
+        if not self.multiproc_dir:
+            return
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_volcado < self.flush_interval:
+            return
+        self._ultimo_volcado = ahora
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        contenido = {'pid': os.getpid(), 'metricas': self._snapshot(),
+                     'gauges': [[n, t, a, [[sorted(l.items()), v] for l, v in s]] for n, t, a, s in self._colectar()]}
+        path = os.path.join(self.multiproc_dir, f"metricas-{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(contenido, f)
+        os.replace(tmp, path)
+
+    def _leer_procesos(self) -> list:
+        volcados = []
+        for path in glob.glob(os.path.join(glob.escape(self.multiproc_dir), 'metricas-*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    volcados.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return volcados
+
+    # --- Exposición ---
+
+    def exponer(self) -> str:
+        """Texto en el formato de exposición de Prometheus (text/plain; version=0.0.4)."""
+        if self.multiproc_dir:
+            self.volcar(forzar=True)
+            volcados = self._leer_procesos()
+        else:
+            volcados = [{'pid': os.getpid(), 'metricas': self._snapshot(),
+                         'gauges': [[n, t, a, [[sorted(l.items()), v] for l, v in s]] for n, t, a, s in self._colectar()]}]
+
+        # Contadores e histogramas se suman entre procesos (también los de workers ya terminados)
+        sumadas = {}
+        for volcado in volcados:
+            for nombre, m in volcado['metricas'].items():
+                destino = sumadas.setdefault(nombre, {**m, 'series': {}})
+                for labels, valor in m['series']:
+                    clave = tuple(map(tuple, labels))
+                    previo = destino['series'].get(clave)
+                    if isinstance(valor, list):
+                        destino['series'][clave] = valor if previo is None else [a + b for a, b in zip(previo, valor)]
+                    else:
+                        destino['series'][clave] = valor + (previo or 0)
+
+        lineas = []
+        for nombre, m in sorted(sumadas.items()):
+            if not m['series']:
+                continue
+            completo = f"{PREFIJO}_{nombre}"
+            lineas.append(f"# HELP {completo} {m['ayuda']}")
+            lineas.append(f"# TYPE {completo} {m['tipo']}")
+            for labels, valor in sorted(m['series'].items()):
+                if m['tipo'] == 'histogram':
+                    acumulado = 0
+                    for limite, n in zip(m['buckets'] + [float('inf')], valor[:-1]):
+                        acumulado += n
+                        lineas.append(f"{completo}_bucket{_etiquetas(labels, (('le', _formato(limite)),))} {acumulado}")
+                    lineas.append(f"{completo}_sum{_etiquetas(labels)} {_formato(valor[-1])}")
+                    lineas.append(f"{completo}_count{_etiquetas(labels)} {acumulado}")
+                else:
+                    lineas.append(f"{completo}{_etiquetas(labels)} {_formato(valor)}")
+
+        # Los gauges son del momento: con varios procesos, uno por worker vivo (etiqueta pid)
+        gauges = {}
+        for volcado in volcados:
+            if self.multiproc_dir and not _pid_vivo(volcado['pid']):
+                continue
+            extra = (('pid', volcado['pid']),) if self.multiproc_dir else ()
+            for nombre, tipo, ayuda, series in volcado['gauges']:
+                g = gauges.setdefault(nombre, {'tipo': tipo, 'ayuda': ayuda, 'series': []})
+                g['series'].extend((tuple(map(tuple, labels)) + extra, valor) for labels, valor in series)
+        for nombre, g in sorted(gauges.items()):
+            completo = f"{PREFIJO}_{nombre}"
+            lineas.append(f"# HELP {completo} {g['ayuda']}")
+            lineas.append(f"# TYPE {completo} {g['tipo']}")
+            for labels, valor in g['series']:
+                if valor is not None:
+                    lineas.append(f"{completo}{_etiquetas(labels)} {_formato(valor)}")
+        return '\n'.join(lineas) + '\n'
+
+    def resumen(self, nombre: str) -> dict:
+        """{etiquetas: {'n': conteo, 'segundos': suma}} de un histograma del proceso."""
+        with self._lock:
+            return {','.join(f"{k}={v}" for k, v in labels): {'n': sum(serie[:-1]), 'segundos': serie[-1]}
+                    for labels, serie in self._series.get(nombre, {}).items()}
+
+
+def _pid_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def limpiar_multiproceso(directorio: str = None):
+    # Al arrancar el servidor: los volcados de una corrida anterior no se suman
+    directorio = directorio or METRICS_MULTIPROC_DIR
+    for path in glob.glob(os.path.join(glob.escape(directorio), 'metricas-*.json')) if directorio else []:
+        os.remove(path)
+
+
+registro = Registro(METRICS_MULTIPROC_DIR, METRICS_FLUSH_INTERVAL)
+registro.definir('stage_seconds', 'histogram', 'Duración de cada etapa del cálculo de una predicción.', BUCKETS_SEGUNDOS)
+registro.definir('request_seconds', 'histogram', 'Duración de cada request por endpoint.', BUCKETS_SEGUNDOS)
+registro.definir('requests_total', 'counter', 'Requests atendidos por endpoint y código de estado.')
+registro.definir('training_stage_seconds', 'histogram', 'Duración de cada etapa del entrenamiento.',
+                 BUCKETS_SEGUNDOS + (30.0, 60.0, 300.0, 900.0, 3600.0))
+
+_local = threading.local()
+
+
+@contextmanager
+def etapa(nombre: str, metrica: str = 'stage_seconds'):
+    """Mide el bloque y lo registra en el histograma `metrica` con la etiqueta stage=nombre."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - t0
+        registro.observar(metrica, duracion, stage=nombre)
+        etapas = getattr(_local, 'etapas', None)
+        if etapas is not None:
+            etapas.append((nombre, duracion))
+
+
+def iniciar_request():
+    # Las etapas del hilo se acumulan para el log de requests lentos
+    _local.etapas = []
+
+
+def etapas_request() -> list:
+    etapas = getattr(_local, 'etapas', None) or []
+    _local.etapas = None
+    return etapas
+
+
+class PerfiladorMuestreo:
+    """
+    Perfilador por muestreo para requests lentos. Un hilo toma cada
+    `intervalo_ms` el stack de los hilos que están atendiendo un request; al
+    terminar, si el request tardó más de `umbral_ms`, sus stacks se guardan en
+    formato folded ("a;b;c N") en `directorio`. Si no, se descartan.
+    """
+
+    def __init__(self, umbral_ms: float, intervalo_ms: float = 5, directorio: str = 'perfiles'):
+        self.umbral = umbral_ms / 1000
+        self.intervalo = intervalo_ms / 1000
+        self.directorio = directorio
+        self._lock = threading.Lock()
+        self._activos = {}
+        self._hilo = None
+        self._pid = None
+
+    def _asegurar_hilo(self):
+        # El hilo se crea en cada worker, después del fork
+        if self._hilo is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._muestrear, name='perfilador', daemon=True)
+                self._hilo.start()
+
+    def _muestrear(self):
+        propio = threading.get_ident()
+        while True:
+            time.sleep(self.intervalo)
+            with self._lock:
+                activos = dict(self._activos)
+            if not activos:
+                continue
+            frames = sys._current_frames()
+            for tid, muestras in activos.items():
+                frame = frames.get(tid)
+                if frame is None or tid == propio:
+                    continue
+                pila = []
+                while frame is not None:
+                    code = frame.f_code
+                    pila.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                muestras[';'.join(reversed(pila))] += 1
+
+    def iniciar(self):
+        self._asegurar_hilo()
+        with self._lock:
+            self._activos[threading.get_ident()] = Counter()
+
+    def terminar(self, etiqueta: str, duracion: float):
+        """Devuelve la ruta del perfil si el request fue lento, None si no."""
+        with self._lock:
+            muestras = self._activos.pop(threading.get_ident(), None)
+        if not muestras or duracion < self.umbral:
+            return None
+        os.makedirs(self.directorio, exist_ok=True)
+        nombre = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{etiqueta.strip('/').replace('/', '_')}-{int(duracion * 1000)}ms.folded"
+        path = os.path.join(self.directorio, nombre)
+        with open(path, 'w', encoding='utf-8') as f:
+            for pila, n in muestras.most_common():
+                f.write(f"{pila} {n}\n")
+        return path
+
+
+def perfilador_desde_env():
+    umbral = float(os.getenv('PROFILE_SLOW_REQUEST_MS', 0))
+    if umbral <= 0:
+        return None
+    return PerfiladorMuestreo(umbral, float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5)),
+                              os.getenv('PROFILE_DIR', 'perfiles'))
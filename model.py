@@ -1,18 +1,28 @@
 import joblib
 import json
 import os
+import math
+import time
+import tempfile
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from threadpoolctl import threadpool_limits
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.model_selection import train_test_split, KFold, cross_val_predict
+from sklearn.model_selection import train_test_split, KFold
 from sklearn.metrics import mean_squared_error, r2_score
 from lightgbm import LGBMRegressor
 from catboost import CatBoostRegressor
 from sklearn.ensemble import RandomForestRegressor
 
+from fast_inference import exportar_modelo_compilado, compiled_path_for
+from instrumentation import etapa
+from encoding import (ENCODING_MODE, construir_preprocesador, codificacion_para, columnas_de, parametros_nativos,
+                      categorias_como_texto)
+import region_models
+
 
 models = {
     'LightGBM': LGBMRegressor(random_state=42, n_jobs=-1),
@@ -21,34 +31,199 @@ models = {
 }
 
 
+def configurar_candidatos(preprocessor, candidatos: dict = None, mode: str = None) -> dict:
+    """
+    {nombre: (estimador, preprocesador)} según ENCODING_MODE. Los modelos que
+    comparten codificación comparten el mismo objeto preprocesador.
+    """
+    candidatos = candidatos or models
+    num_cols, cat_cols = columnas_de(preprocessor)
+    # Un preprocesador nativo por forma de entregar las categorías (category o texto)
+    nativos = {}
+    configurados = {}
+    for name, model in candidatos.items():
+        codificacion = codificacion_para(model, mode)
+        if codificacion != 'native':
+            configurados[name] = (model, preprocessor)
+            continue
+        como_texto = categorias_como_texto(model)
+        if como_texto not in nativos:
+            nativos[como_texto] = construir_preprocesador(num_cols, cat_cols, 'native', como_texto)
+        configurados[name] = (clone(model).set_params(**parametros_nativos(model, cat_cols)), nativos[como_texto])
+    return configurados
+
+
 def preparar_datos_para_modelo(df: pd.DataFrame, target: str='precio'):
     X = df.drop(target, axis=1)
     y = df[target]
-    num_cols = X.select_dtypes(include=['int64','float64']).columns.tolist()
+    # 'number' incluye float32 y los enteros nullable de la carga compacta (ver esquema.py)
+    num_cols = X.select_dtypes(include='number').columns.tolist()
     cat_cols = X.select_dtypes(include=['object','category']).columns.tolist()
 
-    numeric_transformer = Pipeline([('imputer', SimpleImputer(strategy='median')), ('scaler', StandardScaler())])
-    categorical_transformer = Pipeline([('imputer', SimpleImputer(strategy='most_frequent')), ('onehot', OneHotEncoder(handle_unknown='ignore', sparse_output=False))])
-
-    preprocessor = ColumnTransformer([('num', numeric_transformer, num_cols), ('cat', categorical_transformer, cat_cols)])
+    # Preprocesador base; con ENCODING_MODE=native los modelos que lo soportan usan otro (ver configurar_candidatos)
+    preprocessor = construir_preprocesador(num_cols, cat_cols, 'onehot' if ENCODING_MODE == 'onehot' else 'sparse')
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     return X_train, X_test, y_train, y_test, preprocessor
 
 
-def evaluar_modelo_cv(X: pd.DataFrame, y: pd.Series, preprocessor, cv: int=5):
+# Selección de modelo: procesos en paralelo, hilos por job y presupuesto
+# MODEL_SELECTION_STRATEGY: 'full' (todos los folds para todos) o 'halving' (successive halving)
+MODEL_SELECTION_STRATEGY = os.getenv('MODEL_SELECTION_STRATEGY', 'full')
+MODEL_SELECTION_WORKERS = int(os.getenv('MODEL_SELECTION_WORKERS', 0))
+MODEL_SELECTION_THREADS = int(os.getenv('MODEL_SELECTION_THREADS', 0))
+# Segundos de reloj para la selección (0 = sin límite); se revisa entre jobs
+MODEL_SELECTION_TIME_BUDGET = float(os.getenv('MODEL_SELECTION_TIME_BUDGET', 0))
+
+# Parámetro de hilos de cada estimador
+PARAMETRO_HILOS = {
+    'LGBMRegressor': 'n_jobs',
+    'CatBoostRegressor': 'thread_count',
+    'RandomForestRegressor': 'n_jobs',
+}
+
+
+def con_hilos(model, hilos: int):
+    model = clone(model)
+    param = PARAMETRO_HILOS.get(type(model).__name__)
+    if param:
+        model.set_params(**{param: hilos})
+    return model
+
+
+def presupuesto_cpu(n_jobs: int, workers: int = None, hilos: int = None) -> tuple:
+    """(procesos, hilos por job) sin pasarse de los núcleos disponibles."""
+    cpus = os.cpu_count() or 1
+    workers = workers or MODEL_SELECTION_WORKERS or min(cpus, n_jobs)
+    hilos = hilos or MODEL_SELECTION_THREADS or max(1, cpus // workers)
+    return workers, hilos
+
+
+def _preparar_folds(X: pd.DataFrame, y: pd.Series, preprocessor, kf: KFold, directorio: str, prefijo: str = 'fold') -> list:
+    # El ColumnTransformer se ajusta una vez por fold y las matrices quedan en disco para los workers
+    folds = []
+    for k, (train_idx, test_idx) in enumerate(kf.split(X)):
+        pre = clone(preprocessor)
+        X_train = pre.fit_transform(X.iloc[train_idx], y.iloc[train_idx])
+        X_test = pre.transform(X.iloc[test_idx])
+        path = os.path.join(directorio, f"{prefijo}_{k}.joblib")
+        joblib.dump((X_train, y.iloc[train_idx].to_numpy(), X_test), path)
+        folds.append({'test_idx': test_idx, 'path': path})
+    return folds
+
+
+def _ajustar_fold(model, hilos: int, path: str) -> np.ndarray:
+    X_train, y_train, X_test = joblib.load(path, mmap_mode='r')
+    if sparse.issparse(X_train):
+        # Los árboles de sklearn no aceptan índices dispersos de solo lectura
+        X_train, X_test = X_train.copy(), X_test.copy()
+    with threadpool_limits(hilos):
+        return con_hilos(model, hilos).fit(X_train, y_train).predict(X_test)
+
 
+def _metricas(y: np.ndarray, y_pred: np.ndarray) -> dict:
+    mse = mean_squared_error(y, y_pred)
+    mape = np.mean(np.abs((y - y_pred) / y)) * 100
+    r2 = r2_score(y, y_pred)
+    return {'rmse': np.sqrt(mse), 'r2': r2, 'mape': mape}
+
+
+def _rmse_parcial(y: np.ndarray, y_pred: np.ndarray) -> float:
+    hecho = ~np.isnan(y_pred)
+    return _metricas(y[hecho], y_pred[hecho])['rmse']
+
+
+def _rondas(cv: int, estrategia: str) -> list:
+    # full: una ronda con todos los folds; halving: 1, 1, 2, 4, ... folds por ronda
+    if estrategia == 'full':
+        return [list(range(cv))]
+    if estrategia != 'halving':
+        raise ValueError(f"Estrategia de selección no soportada: {estrategia}")
+    rondas, hechos, tam = [], 0, 1
+    while hechos < cv:
+        rondas.append(list(range(hechos, min(hechos + tam, cv))))
+        hechos += tam
+        tam = max(hechos, 1)
+    return rondas
+
+
+def seleccionar_modelo(X: pd.DataFrame, y: pd.Series, preprocessor, cv: int = 5, candidatos: dict = None,
+                       estrategia: str = None, presupuesto_s: float = None, eta: int = 2,
+                       workers: int = None, hilos: int = None) -> tuple:
+    """
+    Evalúa los candidatos con KFold y devuelve (métricas por modelo, mejor modelo).
+
+    Las matrices preprocesadas de cada fold se calculan una sola vez por
+    codificación (ver configurar_candidatos) y se comparten entre candidatos. Los pares (modelo, fold) corren en un pool de
+    procesos con un número fijo de hilos por job. Con estrategia 'halving',
+    tras cada ronda de folds siguen solo los mejores 1/eta candidatos. Con
+    `presupuesto_s`, al vencer el plazo no se lanzan más jobs, salvo los que
+    falten para que cada candidato complete al menos un fold.
+
+    Las métricas de un candidato descartado o cortado por el plazo se calculan
+    sobre los folds que alcanzó a completar; el mejor se elige entre los que
+    completaron más folds.
+    """
+    candidatos = configurar_candidatos(preprocessor, candidatos)
+    estrategia = estrategia or MODEL_SELECTION_STRATEGY
+    presupuesto_s = presupuesto_s if presupuesto_s is not None else MODEL_SELECTION_TIME_BUDGET
+    limite = time.monotonic() + presupuesto_s if presupuesto_s else None
     kf = KFold(n_splits=cv, shuffle=True, random_state=42)
-    results = {}
+    y_arr = y.to_numpy(dtype=float)
 
-    for name, model in models.items():
-        pipe = Pipeline([('preproc', preprocessor), ('model', model)])
-        y_pred = cross_val_predict(pipe, X, y, cv=kf)
-        mse = mean_squared_error(y, y_pred)
-        mape = np.mean(np.abs((y - y_pred) / y)) * 100
-        r2 = r2_score(y, y_pred)
-        results[name] = {'rmse': np.sqrt(mse), 'r2': r2,'mape': mape}
+    oof = {name: np.full(len(y_arr), np.nan) for name in candidatos}
+    completados = {name: 0 for name in candidatos}
+    vivos = list(candidatos)
+    rondas = _rondas(cv, estrategia)
 
-    return results
+    with tempfile.TemporaryDirectory(prefix='seleccion_') as directorio:
+        preprocesadores = {id(pre): pre for _, pre in candidatos.values()}
+        folds = {clave: _preparar_folds(X, y, pre, kf, directorio, f"pre{j}")
+                 for j, (clave, pre) in enumerate(preprocesadores.items())}
+        workers, hilos = presupuesto_cpu(len(candidatos) * cv, workers, hilos)
+
+        with ProcessPoolExecutor(workers) as pool:
+            vencido = False
+            for i, ronda in enumerate(rondas):
+                pendientes = {}
+                for k in ronda:
+                    for name in vivos:
+                        model, pre = candidatos[name]
+                        fut = pool.submit(_ajustar_fold, model, hilos, folds[id(pre)][k]['path'])
+                        pendientes[fut] = (name, k)
+                while pendientes:
+                    restante = None if limite is None else max(limite - time.monotonic(), 0)
+                    if not all(completados[name] for name in vivos):
+                        # El plazo no corta antes de que cada candidato complete un fold: sin eso no hay con qué elegir
+                        restante = None
+                    hechos, _ = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+                    if not hechos:
+                        # Plazo vencido: se cancelan los jobs que no empezaron y se esperan los que corren
+                        vencido = True
+                        for fut in pendientes:
+                            fut.cancel()
+                        hechos = [fut for fut in wait(pendientes)[0] if not fut.cancelled()]
+                    for fut in hechos:
+                        name, k = pendientes.pop(fut)
+                        oof[name][folds[id(candidatos[name][1])][k]['test_idx']] = fut.result()
+                        completados[name] += 1
+                    if vencido:
+                        break
+                if vencido:
+                    print(f"Presupuesto de {presupuesto_s}s agotado en la ronda {i + 1} de {len(rondas)}")
+                    break
+                if estrategia == 'halving' and i < len(rondas) - 1 and len(vivos) > 1:
+                    parciales = {name: _rmse_parcial(y_arr, oof[name]) for name in vivos}
+                    vivos = sorted(vivos, key=parciales.get)[:max(1, math.ceil(len(vivos) / eta))]
+
+    results = {name: _metricas(y_arr[~np.isnan(pred)], pred[~np.isnan(pred)])
+               for name, pred in oof.items() if completados[name]}
+    max_folds = max(completados.values())
+    best = min((name for name in results if completados[name] == max_folds), key=lambda m: results[m]['rmse'])
+    return results, best
+
+
+def evaluar_modelo_cv(X: pd.DataFrame, y: pd.Series, preprocessor, cv: int=5):
+    return seleccionar_modelo(X, y, preprocessor, cv)[0]
 
 
 def entrenar_y_guardar_modelo(df: pd.DataFrame,
@@ -59,15 +234,17 @@ def entrenar_y_guardar_modelo(df: pd.DataFrame,
     X_full = pd.concat([X_train, X_test])
     y_full = pd.concat([y_train, y_test])
 
-    results = evaluar_modelo_cv(X_full, y_full, preproc)
-    best = min(results, key=lambda m: results[m]['rmse'])
+    with etapa('seleccion_modelo', 'training_stage_seconds'):
+        results, best = seleccionar_modelo(X_full, y_full, preproc)
 
-    # 2) Entrenar pipeline final
+    # 2) Entrenar pipeline final, con la codificación que le corresponde al modelo elegido
+    best_model, best_preproc = configurar_candidatos(preproc)[best]
     final_pipe = Pipeline([
-        ('preprocessor', preproc),
-        ('model', models[best])
+        ('preprocessor', best_preproc),
+        ('model', best_model)
     ])
-    final_pipe.fit(X_full, y_full)
+    with etapa('ajuste_final', 'training_stage_seconds'):
+        final_pipe.fit(X_full, y_full)
 
     # 3) Determinar dónde guardar
     if model_path is None:
@@ -79,11 +256,34 @@ def entrenar_y_guardar_modelo(df: pd.DataFrame,
     joblib.dump(final_pipe, model_path)
     print(f"Modelo guardado en: {model_path}")
 
+    # 4.1) Versión compilada para servir (se verifica contra el pipeline antes de guardarla)
+    compiled_path = compiled_path_for(model_path)
+    try:
+        with etapa('compilacion', 'training_stage_seconds'):
+            exportar_modelo_compilado(final_pipe, X_full.sample(min(len(X_full), 1000), random_state=42), compiled_path)
+        print(f"Modelo compilado guardado en: {compiled_path}")
+    except Exception as e:
+        # Sin artefacto compilado la API usa el pipeline serializado
+        if os.path.exists(compiled_path):
+            os.remove(compiled_path)
+        print(f"No se pudo compilar el modelo ({e}); se servirá el pipeline")
+
+    # 4.2) Modelos por región (o grupo de comunas), con el global como respaldo (ver region_models.py)
+    regiones = None
+    if region_models.TRAIN_REGION_MODELS:
+        with etapa('modelos_region', 'training_stage_seconds'):
+            regiones = region_models.entrenar_modelos_grupo(X_full, y_full, clone(final_pipe), model_path)
+    else:
+        # Sin esto, un reentrenamiento sobre el mismo MODEL_PATH serviría modelos por región viejos
+        region_models.borrar_modelos_grupo(model_path)
+
     # Exportar resultados (métricas) a JSON
     metrics_output = {
         "model_name": best,
         "metrics": results
     }
+    if regiones is not None:
+        metrics_output["regiones"] = regiones["modelos"]
     # Guardar en el mismo directorio del modelo
     metrics_path = os.path.join(os.path.dirname(model_path), "metrics.json")
     with open(metrics_path, "w", encoding="utf-8") as mf:
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import logging
+import threading
+import subprocess
+from datetime import datetime
+
+
+# Artefactos versionados: <MODELS_DIR>/<version>/modelo_valoracion.pkl (+ compilado y metrics.json)
+# y un puntero <MODELS_DIR>/CURRENT con la versión activa.
+MODELS_DIR = os.getenv('MODELS_DIR', 'models')
+MODEL_FILENAME = 'modelo_valoracion.pkl'
+
+logger = logging.getLogger(__name__)
+
+
+def _escribir_atomico(path: str, contenido: str):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(contenido)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def nueva_version() -> str:
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def directorio_version(version: str, models_dir: str = MODELS_DIR) -> str:
+    return os.path.join(models_dir, version)
+
+
+def ruta_modelo(version: str, models_dir: str = MODELS_DIR) -> str:
+    return os.path.join(directorio_version(version, models_dir), MODEL_FILENAME)
+
+
+def _ruta_puntero(models_dir: str) -> str:
+    return os.path.join(models_dir, 'CURRENT')
+
+
+def version_actual(models_dir: str = MODELS_DIR):
+    try:
+        with open(_ruta_puntero(models_dir), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publicar_version(version: str, models_dir: str = MODELS_DIR):
+    """Apunta CURRENT a `version` de forma atómica; los workers la toman en su próximo chequeo."""
+    if not os.path.exists(ruta_modelo(version, models_dir)):
+        raise FileNotFoundError(f"No existe el modelo de la versión {version}")
+    _escribir_atomico(_ruta_puntero(models_dir), version)
+
+
+class ModelHolder:
+    """
+    Mantiene el modelo activo de un proceso y lo cambia en caliente cuando
+    cambia el puntero CURRENT.
+
+    El puntero se revisa como máximo cada `check_interval` segundos. La carga
+    de una versión nueva corre en un hilo aparte, uno a la vez, y `on_swap`
+    (lo que depende de la versión) se llama justo antes del cambio;
+    mientras tanto get() sigue devolviendo el modelo anterior sin esperar y el
+    cambio es una asignación atómica de la tupla (versión, modelo). Los
+    requests en curso conservan su referencia al modelo anterior, que se
+    libera cuando terminan. Si la carga falla se sigue con el anterior y se
+    reintenta en el próximo chequeo.
+    """
+
+    def __init__(self, loader, models_dir: str = MODELS_DIR, check_interval: float = 2.0, on_swap=None):
+        # loader(version) -> modelo; version None = modelo sin versionar (MODEL_PATH)
+        self.loader = loader
+        self.models_dir = models_dir
+        self.check_interval = check_interval
+        self.on_swap = on_swap
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._ultimo_chequeo = time.monotonic()
+        version = version_actual(models_dir)
+        self._actual = (version, loader(version))
+
+    @property
+    def version(self):
+        return self._actual[0]
+
+    def get(self):
+        """Devuelve (version, modelo), cambiando de versión si el puntero cambió."""
+        ahora = time.monotonic()
+        if ahora - self._ultimo_chequeo >= self.check_interval:
+            self._ultimo_chequeo = ahora
+            version = version_actual(self.models_dir)
+            if version is not None and version != self._actual[0]:
+                self._cambiar(version)
+        return self._actual
+
+    def _cambiar(self, version: str):
+        # Si ya hay una carga en curso, este request sigue con el modelo actual
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._hilo = threading.Thread(target=self._cargar, args=(version,), daemon=True,
+                                          name=f"carga-modelo-{version}")
+            self._hilo.start()
+        except Exception:
+            self._lock.release()
+            raise
+
+    def _cargar(self, version: str):
+        try:
+            if version != self._actual[0]:
+                modelo = self.loader(version)
+                # on_swap prepara y cambia lo que acompaña a la versión antes de que se sirva el modelo nuevo;
+                # si falla, se sigue con el anterior
+                if self.on_swap is not None:
+                    self.on_swap(version)
+                self._actual = (version, modelo)
+        except Exception as e:
+            logger.error(f"No se pudo cambiar al modelo {version}: {e}")
+        finally:
+            self._lock.release()
+
+    def refresh(self, esperar: bool = False):
+        """Revisa el puntero ya; con `esperar`, espera a que termine la carga que eso dispare."""
+        self._ultimo_chequeo = float('-inf')
+        actual = self.get()
+        hilo = self._hilo
+        if esperar and hilo is not None:
+            hilo.join()
+            actual = self._actual
+        return actual
+
+
+class JobEnCurso(Exception):
+    def __init__(self, job: dict):
+        super().__init__(f"Ya hay un reentrenamiento en curso: {job['job_id']}")
+        self.job = job
+
+
+def _pid_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RetrainJobs:
+    """
+    Reentrenamientos en segundo plano. Cada job lanza train_model.py en un
+    proceso aparte con MODEL_VERSION=<versión>; el script guarda los
+    artefactos en su directorio de versión y publica el puntero al terminar.
+    El estado de cada job vive en <MODELS_DIR>/jobs/<job_id>.json, visible
+    para todos los workers.
+    """
+
+    def __init__(self, models_dir: str = MODELS_DIR, comando: list = None):
+        self.models_dir = models_dir
+        self.jobs_dir = os.path.join(models_dir, 'jobs')
+        self.comando = comando or [sys.executable, 'train_model.py']
+
+    def _ruta_job(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _guardar(self, job: dict):
+        _escribir_atomico(self._ruta_job(job['job_id']), json.dumps(job, ensure_ascii=False))
+
+    def _en_curso(self):
+        for nombre in os.listdir(self.jobs_dir):
+            if nombre.endswith('.json'):
+                job = self.estado(nombre[:-5])
+                if job is not None and job['status'] == 'running':
+                    return job
+        return None
+
+    def lanzar(self) -> dict:
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        # Lock entre workers para que no se lancen dos entrenamientos a la vez
+        with open(os.path.join(self.jobs_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            en_curso = self._en_curso()
+            if en_curso is not None:
+                raise JobEnCurso(en_curso)
+
+            job_id = uuid.uuid4().hex
+            version = nueva_version()
+            log_path = os.path.join(self.jobs_dir, f"{job_id}.log")
+            env = {**os.environ, 'MODEL_VERSION': version, 'MODELS_DIR': self.models_dir}
+            with open(log_path, 'w') as log:
+                proc = subprocess.Popen(self.comando, stdout=log, stderr=subprocess.STDOUT,
+                                        env=env, start_new_session=True)
+            job = {
+                'job_id': job_id,
+                'status': 'running',
+                'version': version,
+                'pid': proc.pid,
+                'started_at': datetime.now().isoformat(),
+                'finished_at': None,
+                'returncode': None,
+            }
+            self._guardar(job)
+
+        threading.Thread(target=self._esperar, args=(job, proc), daemon=True).start()
+        return job
+
+    def _esperar(self, job: dict, proc: subprocess.Popen):
+        returncode = proc.wait()
+        job = {**job, 'returncode': returncode, 'finished_at': datetime.now().isoformat()}
+        job['status'] = 'succeeded' if returncode == 0 and version_actual(self.models_dir) == job['version'] else 'failed'
+        self._guardar(job)
+
+    def estado(self, job_id: str):
+        try:
+            with open(self._ruta_job(job_id), encoding='utf-8') as f:
+                job = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # El worker que lanzó el job pudo morir: se infiere el resultado desde el puntero
+        if job['status'] == 'running' and not _pid_vivo(job['pid']):
+            job['status'] = 'succeeded' if version_actual(self.models_dir) == job['version'] else 'failed'
+            job['finished_at'] = job['finished_at'] or datetime.now().isoformat()
+            self._guardar(job)
+        if job['status'] == 'failed':
+            job['log_tail'] = self._cola_log(job_id)
+        return job
+
+    def _cola_log(self, job_id: str, n: int = 4000) -> str:
+        try:
+            with open(os.path.join(self.jobs_dir, f"{job_id}.log"), 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(f.tell() - n, 0))
+                return f.read().decode('utf-8', errors='replace')
+        except FileNotFoundError:
+            return ''
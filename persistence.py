@@ -0,0 +1,261 @@
+import os
+import glob
+import json
+import fcntl
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+
+logger = logging.getLogger(__name__)
+
+INSERT_PREDICTION_SQL = text("""
+    INSERT INTO model_predictions (
+        divisa, tipo, superficie_util, superficie_total,
+        antiguedad, dormitorios, banos,
+        comuna, region, latitud, longitud,
+        distancia_ed_superior_km, distancia_ed_escolar_km,
+        distancia_comisaria_km, distancia_est_salud_km,
+        distancia_metro_km, prediction_uf,
+        avg_price_uf, avg_price_uf_m2, n_properties, requested_at
+    ) VALUES (
+        :divisa, :tipo, :superficie_util, :superficie_total,
+        :antiguedad, :dormitorios, :banos,
+        :Comuna, :Region, :latitud, :longitud,
+        :distancia_ed_superior_km, :distancia_ed_escolar_km,
+        :distancia_comisaria_km, :distancia_est_salud_km,
+        :distancia_metro_km, :prediction_uf,
+        :avg_price_uf, :avg_price_uf_m2, :n_properties, :requested_at
+    )
+""")
+
+# Columnas que usa el INSERT; el resto del payload no se persiste
+PREDICTION_COLUMNS = (
+    'divisa', 'tipo', 'superficie_util', 'superficie_total', 'antiguedad', 'dormitorios', 'banos',
+    'Comuna', 'Region', 'latitud', 'longitud',
+    'distancia_ed_superior_km', 'distancia_ed_escolar_km', 'distancia_comisaria_km',
+    'distancia_est_salud_km', 'distancia_metro_km', 'prediction_uf',
+    'avg_price_uf', 'avg_price_uf_m2', 'n_properties', 'requested_at'
+)
+
+
+def crear_engine(db_uri: str):
+    # Pool real con verificación de la conexión antes de usarla y reciclaje periódico
+    # (SQLite, usado en benchmarks, recibe el timeout con otro nombre)
+    return create_engine(
+        db_uri,
+        pool_size=int(os.getenv('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        pool_pre_ping=True,
+        connect_args={"timeout": 10} if db_uri.startswith('sqlite') else {"connect_timeout": 10})
+
+
+def crear_tabla_sqlite(engine):
+    """Tabla model_predictions mínima en SQLite, con las columnas del INSERT (benchmarks y pruebas locales)."""
+    columnas = ', '.join(f"{col.lower()} {'TEXT' if col in ('divisa', 'tipo', 'Comuna', 'Region') else 'NUMERIC'}"
+                         for col in PREDICTION_COLUMNS)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS model_predictions (id INTEGER PRIMARY KEY, {columnas})"))
+
+
+def _a_json(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if hasattr(valor, 'item'):
+        return valor.item()
+    return str(valor)
+
+
+def _desde_json(record: dict) -> dict:
+    if isinstance(record.get('requested_at'), str):
+        record['requested_at'] = datetime.fromisoformat(record['requested_at'])
+    return record
+
+
+class PredictionWriter:
+    """
+    Cola write-behind para model_predictions.
+
+    Los registros se encolan sin bloquear la respuesta y un hilo los inserta
+    en lotes multi-fila cuando se alcanza `batch_size` o pasan `flush_interval`
+    segundos. La cola es acotada: si se llena, o si la BD no responde, los
+    registros se escriben en `spill_path` (JSON lines) y se reinsertan cuando
+    la BD vuelve a estar disponible.
+    """
+
+    def __init__(self, engine, insert_sql=INSERT_PREDICTION_SQL, batch_size: int = 500,
+                 flush_interval: float = 1.0, max_queue: int = 10000,
+                 spill_path: str = 'predicciones_pendientes.jsonl', retry_interval: float = 30.0):
+        self.engine = engine
+        self.insert_sql = insert_sql
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.spill_path = spill_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._ultimo_reintento = 0.0
+        # Los contadores los actualizan los hilos de los requests, el hilo escritor y close()
+        self._stats_lock = threading.Lock()
+        self.stats_counters = {'encolados': 0, 'insertados': 0, 'derramados': 0, 'reinsertados': 0, 'errores_bd': 0}
+
+    @classmethod
+    def from_env(cls, engine) -> 'PredictionWriter':
+        return cls(
+            engine,
+            batch_size=int(os.getenv('DB_BATCH_SIZE', 500)),
+            flush_interval=float(os.getenv('DB_FLUSH_INTERVAL', 1.0)),
+            max_queue=int(os.getenv('DB_QUEUE_MAX', 10000)),
+            spill_path=os.getenv('DB_SPILL_PATH', 'predicciones_pendientes.jsonl'))
+
+    def _asegurar_hilo(self):
+        # El hilo se crea en el proceso que escribe (p.ej. cada worker de gunicorn tras el fork)
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='prediction-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, records: list):
+        self._asegurar_hilo()
+        desbordados = []
+        for record in records:
+            record = {col: record.get(col) for col in PREDICTION_COLUMNS}
+            try:
+                self._queue.put_nowait(record)
+                self._contar('encolados')
+            except queue.Full:
+                desbordados.append(record)
+        if desbordados:
+            self._derramar(desbordados)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._flush(self._tomar_lote())
+
+    def _tomar_lote(self) -> list:
+        lote = []
+        limite = time.monotonic() + self.flush_interval
+        while len(lote) < self.batch_size:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._queue.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _insertar(self, lote: list):
+        with self.engine.begin() as conn:
+            conn.execute(self.insert_sql, lote)
+
+    def _flush(self, lote: list):
+        if lote:
+            try:
+                self._insertar(lote)
+                self._contar('insertados', len(lote))
+            except Exception as e:
+                self._contar('errores_bd')
+                logger.error(f"No se pudo insertar lote de {len(lote)} predicciones: {str(e).splitlines()[0]}")
+                self._derramar(lote)
+                self._ultimo_reintento = time.monotonic()
+                return
+        if time.monotonic() - self._ultimo_reintento >= self.retry_interval:
+            self._ultimo_reintento = time.monotonic()
+            self._reinsertar_derrame()
+
+    def _abrir_derrame(self):
+        # Abre el archivo de derrame con lock exclusivo entre procesos; si otro proceso
+        # lo renombró mientras se esperaba el lock, se vuelve a abrir el archivo nuevo
+        while True:
+            f = open(self.spill_path, 'a', encoding='utf-8')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.spill_path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _derramar(self, records: list):
+        with self._spill_lock:
+            with self._abrir_derrame() as f:
+                for record in records:
+                    f.write(json.dumps(record, default=_a_json, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self._contar('derramados', len(records))
+
+    def _reinsertar_derrame(self):
+        # El derrame actual se renombra para que los nuevos registros no se mezclen con el reintento
+        with self._spill_lock:
+            if os.path.exists(self.spill_path):
+                with self._abrir_derrame():
+                    os.replace(self.spill_path, f"{self.spill_path}.{os.getpid()}.{time.time_ns()}.reintento")
+        for pendiente in sorted(glob.glob(f"{glob.escape(self.spill_path)}.*.reintento")):
+            if not self._reinsertar_archivo(pendiente):
+                return
+
+    def _reinsertar_archivo(self, pendiente: str) -> bool:
+        with open(pendiente, 'r+', encoding='utf-8') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Otro worker lo está reinsertando
+                return True
+            records = [_desde_json(json.loads(linea)) for linea in f if linea.strip()]
+            for i in range(0, len(records), self.batch_size):
+                try:
+                    self._insertar(records[i:i + self.batch_size])
+                except Exception as e:
+                    self._contar('errores_bd')
+                    logger.warning(f"BD no disponible, se mantienen predicciones en {pendiente}: {str(e).splitlines()[0]}")
+                    # Lo ya insertado sale del archivo
+                    f.seek(0)
+                    f.truncate()
+                    for record in records[i:]:
+                        f.write(json.dumps(record, default=_a_json, ensure_ascii=False) + '\n')
+                    return False
+                self._contar('reinsertados', len(records[i:i + self.batch_size]))
+            os.remove(pendiente)
+        return True
+
+    def _contar(self, campo: str, n: int = 1):
+        with self._stats_lock:
+            self.stats_counters[campo] += n
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            contadores = dict(self.stats_counters)
+        return {'profundidad_cola': self._queue.qsize(), 'capacidad_cola': self._queue.maxsize, **contadores}
+
+    def close(self, timeout: float = 10.0):
+        """Detiene el hilo y vacía lo pendiente (a la BD o al archivo de derrame)."""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        lote = []
+        while True:
+            try:
+                lote.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(lote), self.batch_size):
+            self._flush(lote[i:i + self.batch_size])
+
+    def register_atexit(self):
+        atexit.register(self.close)
+        return self
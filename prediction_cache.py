@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# Caché de resultados de /predict y de distancias por coordenada.
+#   PREDICTION_CACHE_BACKEND  memory (por proceso) o redis (compartido entre workers, REDIS_URL)
+#   *_CACHE_SIZE              entradas máximas en memoria (0 = caché desactivada)
+#   *_CACHE_TTL               segundos de vida de cada entrada (0 = sin vencimiento)
+CACHE_BACKENDS = ('memory', 'redis')
+
+
+def _canonico(valor):
+    # 80, 80.0 y np.float64(80) generan la misma clave; los bool no se tocan
+    if isinstance(valor, bool) or valor is None or isinstance(valor, str):
+        return valor
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return str(valor)
+
+
+def clave_canonica(features: dict, *contexto) -> str:
+    """Hash estable del dict de features normalizado más el contexto (p.ej. versión del modelo)."""
+    payload = json.dumps([{k: _canonico(v) for k, v in features.items()}, [str(c) for c in contexto]],
+                         sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def clave_coordenadas(lat: float, lon: float, firma: str) -> str:
+    return f"{firma}:{float(lat)!r}:{float(lon)!r}"
+
+
+def firma_indice(spatial_index) -> str:
+    """Identifica los archivos y modos del índice espacial: las distancias solo valen para ese índice."""
+    return clave_canonica({'firma': json.dumps(spatial_index.firma, sort_keys=True),
+                           'modos': json.dumps(spatial_index.modes, sort_keys=True)})
+
+
+class LRUCache:
+    """
+    LRU en memoria con vencimiento por TTL, segura entre hilos. Cuenta
+    aciertos, fallos, vencidas y desalojos.
+    """
+
+    def __init__(self, max_items: int = 10000, ttl: float = 0):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._datos = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get(self, clave: str):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                valor, vence = entrada
+                if vence is None or vence > time.monotonic():
+                    self._datos.move_to_end(clave)
+                    self._stats['hits'] += 1
+                    return valor
+                del self._datos[clave]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, clave: str, valor):
+        vence = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._datos[clave] = (valor, vence)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            consultas = self._stats['hits'] + self._stats['misses']
+            return {**self._stats, 'size': len(self._datos), 'max_items': self.max_items, 'ttl': self.ttl,
+                    'hit_rate': self._stats['hits'] / consultas if consultas else None}
+
+
+class RedisCache:
+    """
+    Misma interfaz que LRUCache sobre Redis, compartida entre workers y
+    réplicas. Los valores se guardan como JSON; el desalojo lo hace Redis
+    (maxmemory-policy) y el TTL se fija por entrada. Los contadores son del
+    proceso. Requiere el paquete `redis`.
+    """
+
+    def __init__(self, url: str, prefijo: str, ttl: float = 0):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.prefijo = prefijo
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+    def _contar(self, campo: str):
+        with self._lock:
+            self._stats[campo] += 1
+
+    def get(self, clave: str):
+        try:
+            valor = self._redis.get(f"{self.prefijo}:{clave}")
+        except Exception:
+            # Redis caído: se comporta como un fallo de caché, el request sigue
+            self._contar('errors')
+            valor = None
+        self._contar('misses' if valor is None else 'hits')
+        return None if valor is None else json.loads(valor)
+
+    def set(self, clave: str, valor):
+        try:
+            self._redis.set(f"{self.prefijo}:{clave}", json.dumps(valor),
+                            px=int(self.ttl * 1000) if self.ttl else None)
+        except Exception:
+            self._contar('errors')
+
+    def clear(self):
+        # Las entradas de otras versiones dejan de consultarse y vencen por TTL
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            consultas = self._stats['hits'] + self._stats['misses']
+            return {**self._stats, 'backend': 'redis', 'ttl': self.ttl,
+                    'hit_rate': self._stats['hits'] / consultas if consultas else None}
+
+
+def cache_desde_env(nombre: str, size_default: int, ttl_default: float):
+    """
+    Caché `nombre` ('prediction' o 'distance') según las variables de entorno;
+    None si está desactivada.
+    """
+    prefijo = nombre.upper()
+    max_items = int(os.getenv(f'{prefijo}_CACHE_SIZE', size_default))
+    ttl = float(os.getenv(f'{prefijo}_CACHE_TTL', ttl_default))
+    backend = os.getenv('PREDICTION_CACHE_BACKEND', 'memory').strip().lower()
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"PREDICTION_CACHE_BACKEND no soportado: {backend}")
+    if max_items <= 0:
+        return None
+    if backend == 'redis':
+        return RedisCache(os.getenv('REDIS_URL', 'redis://localhost:6379/0'), f"valuaciones:{nombre}", ttl)
+    return LRUCache(max_items, ttl)
@@ -0,0 +1,256 @@
+import os
+import re
+import json
+import math
+import shutil
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import mean_squared_error
+
+from utils import normalize_str
+from fast_inference import exportar_modelo_compilado, compiled_path_for
+
+
+# Modelos por región (o por grupo de comunas) además del modelo global, que queda como respaldo.
+#   TRAIN_REGION_MODELS      entrenar un modelo por grupo al final de entrenar_y_guardar_modelo
+#   MODEL_GROUPS_FILE        Excel/CSV opcional con columnas Comuna y grupo; sin él, un grupo por Region
+#   TRAIN_REGION_MIN_ROWS    filas mínimas de un grupo para tener modelo propio
+#   USE_REGION_MODELS        al servir, usar los modelos por grupo si la versión los trae
+#   REGION_MODELS_MEMORY_MB  presupuesto de los modelos por grupo residentes en cada worker (LRU)
+TRAIN_REGION_MODELS = os.getenv('TRAIN_REGION_MODELS', 'false').lower() == 'true'
+MODEL_GROUPS_FILE = os.getenv('MODEL_GROUPS_FILE', '')
+TRAIN_REGION_MIN_ROWS = int(os.getenv('TRAIN_REGION_MIN_ROWS', 500))
+USE_REGION_MODELS = os.getenv('USE_REGION_MODELS', 'true').lower() == 'true'
+REGION_MODELS_MEMORY_MB = float(os.getenv('REGION_MODELS_MEMORY_MB', 512))
+
+DIRECTORIO = 'regiones'
+MANIFEST = 'regiones.json'
+# Fracción de cada grupo que se reserva para compararlo contra el global
+FRACCION_PRUEBA = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+def directorio_grupos(model_path: str) -> str:
+    return os.path.join(os.path.dirname(model_path) or '.', DIRECTORIO)
+
+
+def leer_grupos(path: str = MODEL_GROUPS_FILE) -> dict:
+    """{comuna normalizada: grupo} desde el archivo de grupos, o {} (un grupo por Region)."""
+    if not path:
+        return {}
+    df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path)
+    return {normalize_str(str(c)): str(g) for c, g in zip(df['Comuna'], df['grupo']) if pd.notna(g)}
+
+
+def clave_grupo(fila: dict, grupos: dict):
+    # Las features de serving traen Comuna normalizada y Region de COMUNA_REGION_MAP
+    if grupos:
+        return grupos.get(normalize_str(str(fila.get('Comuna') or '')))
+    return fila.get('Region')
+
+
+def claves_grupo(X: pd.DataFrame, grupos: dict) -> pd.Series:
+    if grupos:
+        return X['Comuna'].astype(object).map(lambda c: grupos.get(normalize_str(str(c))) if pd.notna(c) else None)
+    return X['Region'].astype(object).where(X['Region'].notna())
+
+
+def _propio(directorio: str) -> bool:
+    # Solo se borra un directorio que armó entrenar_modelos_grupo (tiene su manifiesto)
+    return os.path.exists(os.path.join(directorio, MANIFEST))
+
+
+def borrar_modelos_grupo(model_path: str):
+    """Borra los modelos por grupo de `model_path`, si los hay; un directorio ajeno con el mismo nombre no se toca."""
+    directorio = directorio_grupos(model_path)
+    if _propio(directorio):
+        shutil.rmtree(directorio)
+    elif os.path.exists(directorio):
+        print(f"{directorio} no tiene {MANIFEST}; no se borra")
+
+
+def _archivo(grupo: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '_', normalize_str(grupo)).strip('_') + '.pkl'
+
+
+def _rmse(y, pred) -> float:
+    return math.sqrt(mean_squared_error(y, pred))
+
+
+# --- Entrenamiento ---
+
+def entrenar_modelos_grupo(X: pd.DataFrame, y: pd.Series, plantilla, model_path: str, grupos: dict = None,
+                           min_filas: int = TRAIN_REGION_MIN_ROWS) -> dict:
+    """
+    Entrena un modelo por grupo con el mismo pipeline (`plantilla`, sin
+    ajustar) que el modelo global y los guarda en regiones/ junto a
+    `model_path`, con su versión compilada y un manifiesto.
+
+    Antes de quedarse con un grupo lo compara contra el global sobre el mismo
+    20% reservado de cada grupo, con un global de referencia ajustado sin esas
+    filas; si el del grupo no es mejor, ese grupo se sirve con el global.
+    Devuelve el manifiesto.
+    """
+    destino = directorio_grupos(model_path)
+    if os.path.exists(destino) and not _propio(destino):
+        raise ValueError(f"{destino} existe y no es un directorio de modelos por grupo; moverlo o usar otro MODEL_PATH")
+    grupos = leer_grupos() if grupos is None else grupos
+    claves = claves_grupo(X, grupos).to_numpy()
+    rng = np.random.default_rng(42)
+    posiciones, prueba = {}, {}
+    descartados = {}
+    for grupo in pd.unique(claves[pd.notna(claves)]):
+        pos = np.flatnonzero(claves == grupo)
+        if len(pos) < min_filas:
+            descartados[str(grupo)] = f"{len(pos)} filas (mínimo {min_filas})"
+            continue
+        pos = rng.permutation(pos)
+        n_prueba = max(1, int(len(pos) * FRACCION_PRUEBA))
+        posiciones[grupo], prueba[grupo] = pos, pos[:n_prueba]
+
+    modelos = {}
+    if posiciones:
+        fuera = np.ones(len(X), dtype=bool)
+        fuera[np.concatenate(list(prueba.values()))] = False
+        referencia = clone(plantilla).fit(X[fuera], y[fuera])
+    # Se arma aparte y reemplaza al anterior al final: el directorio siempre tiene su manifiesto
+    tmp = f"{destino}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for grupo, pos in posiciones.items():
+        entrenamiento = pos[len(prueba[grupo]):]
+        modelo = clone(plantilla).fit(X.iloc[entrenamiento], y.iloc[entrenamiento])
+        X_prueba, y_prueba = X.iloc[prueba[grupo]], y.iloc[prueba[grupo]]
+        rmse, rmse_global = _rmse(y_prueba, modelo.predict(X_prueba)), _rmse(y_prueba, referencia.predict(X_prueba))
+        if rmse >= rmse_global:
+            descartados[str(grupo)] = f"rmse {rmse:.1f} no mejora al global ({rmse_global:.1f})"
+            continue
+        # El modelo que se sirve se ajusta con todas las filas del grupo
+        modelo = clone(plantilla).fit(X.iloc[pos], y.iloc[pos])
+        path = os.path.join(tmp, _archivo(str(grupo)))
+        joblib.dump(modelo, path)
+        try:
+            exportar_modelo_compilado(modelo, X.iloc[pos].sample(min(len(pos), 1000), random_state=42),
+                                      compiled_path_for(path))
+        except Exception as e:
+            print(f"No se pudo compilar el modelo de {grupo} ({e}); se servirá el pipeline")
+        modelos[str(grupo)] = {'archivo': os.path.basename(path), 'filas': int(len(pos)),
+                               'rmse': rmse, 'rmse_global': rmse_global}
+        print(f"Modelo de {grupo}: {len(pos)} filas, rmse {rmse:.1f} (global {rmse_global:.1f})")
+
+    manifest = {'agrupacion': 'grupos' if grupos else 'Region', 'grupos': grupos or None,
+                'modelos': modelos, 'descartados': descartados}
+    with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    borrar_modelos_grupo(model_path)
+    os.replace(tmp, destino)
+    return manifest
+
+
+# --- Serving ---
+
+def _predecir(modelo, filas: list) -> np.ndarray:
+    if hasattr(modelo, 'predict_records'):
+        return np.asarray(modelo.predict_records(filas), dtype=float)
+    return np.asarray(modelo.predict(pd.DataFrame(filas)), dtype=float)
+
+
+class ModelosPorGrupo:
+    """
+    Modelo global más los modelos por grupo de una versión, con la misma
+    interfaz que el modelo compilado (predict_records / predict).
+
+    Cada fila va al modelo de su grupo (Region o grupo de comunas, según el
+    manifiesto), que se carga la primera vez que se usa. Los modelos por grupo
+    residentes se mantienen dentro de `presupuesto_mb` desalojando el usado
+    hace más tiempo; el tamaño de cada uno se estima por su tamaño
+    serializado. Las filas sin grupo, de un grupo sin modelo o cuyo modelo no
+    se pudo cargar van al global, que siempre está en memoria.
+    """
+
+    def __init__(self, modelo_global, directorio: str, manifest: dict, cargar, presupuesto_mb: float = REGION_MODELS_MEMORY_MB):
+        # cargar(path del pipeline) -> modelo (el compilado si corresponde, ver app.cargar_artefacto)
+        self.modelo_global = modelo_global
+        self.directorio = directorio
+        self.grupos = manifest.get('grupos') or {}
+        self.archivos = {grupo: m['archivo'] for grupo, m in manifest.get('modelos', {}).items()}
+        self.cargar = cargar
+        self.presupuesto = presupuesto_mb * 1e6
+        self._lock = threading.Lock()
+        self._residentes = OrderedDict()
+        self._bytes = 0
+        self._contadores = {'aciertos': 0, 'cargas': 0, 'desalojos': 0, 'errores': 0, 'filas_global': 0}
+
+    def modelo(self, grupo):
+        """Modelo del grupo, cargándolo si hace falta; None si no tiene uno o no se pudo cargar (va el global)."""
+        if grupo not in self.archivos:
+            return None
+        with self._lock:
+            if grupo in self._residentes:
+                self._residentes.move_to_end(grupo)
+                self._contadores['aciertos'] += 1
+                return self._residentes[grupo][0]
+        # La carga va fuera del lock: los grupos ya residentes siguen respondiendo
+        try:
+            modelo = self.cargar(os.path.join(self.directorio, self.archivos[grupo]))
+            tamano = len(pickle.dumps(modelo, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            logger.error(f"No se pudo cargar el modelo de {grupo}: {e}")
+            with self._lock:
+                self._contadores['errores'] += 1
+            return None
+        with self._lock:
+            if grupo not in self._residentes:
+                self._residentes[grupo] = (modelo, tamano)
+                self._bytes += tamano
+                self._contadores['cargas'] += 1
+            self._residentes.move_to_end(grupo)
+            # Siempre queda al menos el recién cargado, aunque solo él supere el presupuesto
+            while self._bytes > self.presupuesto and len(self._residentes) > 1:
+                _, (_, liberado) = self._residentes.popitem(last=False)
+                self._bytes -= liberado
+                self._contadores['desalojos'] += 1
+            return self._residentes[grupo][0]
+
+    def predict_records(self, records: list) -> np.ndarray:
+        salida = np.empty(len(records))
+        por_grupo = {}
+        for i, fila in enumerate(records):
+            por_grupo.setdefault(clave_grupo(fila, self.grupos), []).append(i)
+        for grupo, idx in por_grupo.items():
+            modelo = self.modelo(grupo)
+            if modelo is None:
+                modelo = self.modelo_global
+                with self._lock:
+                    self._contadores['filas_global'] += len(idx)
+            salida[idx] = _predecir(modelo, [records[i] for i in idx])
+        return salida
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        return self.predict_records(X.to_dict('records'))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'grupos': len(self.archivos), 'residentes': list(self._residentes), 'bytes': self._bytes,
+                    'presupuesto_bytes': int(self.presupuesto), **self._contadores}
+
+
+def con_modelos_por_grupo(modelo_global, model_path: str, cargar, presupuesto_mb: float = REGION_MODELS_MEMORY_MB):
+    """`modelo_global` envuelto en ModelosPorGrupo si junto a `model_path` hay modelos por grupo."""
+    directorio = directorio_grupos(model_path)
+    try:
+        with open(os.path.join(directorio, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return modelo_global
+    if not manifest.get('modelos'):
+        return modelo_global
+    return ModelosPorGrupo(modelo_global, directorio, manifest, cargar, presupuesto_mb)
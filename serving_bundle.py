@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import joblib
+import pandas as pd
+import geopandas as gpd
+from datetime import datetime
+
+from utils import normalize_str
+from comuna_resolver import ComunaResolver
+from data_metrics import tabla_metricas
+from comparables import exportar_comparables
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS, distance_modes_from_env
+from distance_tiles import aplicar_teselas
+import model_store
+
+
+# Bundle de serving: todo lo que app.py necesita para arrancar, ya procesado.
+#   manifest.json          versión, fecha, modos de distancia y sha256 de cada archivo
+#   comuna_region.json     comuna normalizada -> región
+#   comuna_resolver.joblib polígonos en EPSG:4326 (+ grilla opcional) del ComunaResolver
+#   metricas.json          métricas por comuna normalizada
+#   comparables.parquet    publicaciones del entrenamiento para /comparables (ver comparables.py)
+#   spatial_index/         arreglos .npy de las capas de distancia (ver spatial_index.py)
+#   distance_tiles/        teselas de distancias y comuna, opcional (ver distance_tiles.py)
+BUNDLE_FORMAT = 1
+BUNDLE_DIRNAME = 'bundle'
+
+
+def mapa_comuna_region(mapping_file: str) -> dict:
+    map_df = pd.read_excel(mapping_file)
+    map_df.columns = map_df.columns.str.strip()
+    raw_map = dict(zip(map_df['Comuna'], map_df['Region']))
+    return {normalize_str(comuna_name): region for comuna_name, region in raw_map.items()}
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _archivos(path: str) -> list:
+    rutas = []
+    for raiz, _, nombres in os.walk(path):
+        for nombre in nombres:
+            rutas.append(os.path.relpath(os.path.join(raiz, nombre), path))
+    return sorted(r for r in rutas if r != 'manifest.json')
+
+
+def _escribir_json(path: str, contenido):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(contenido, f, ensure_ascii=False)
+
+
+def construir_bundle(destino: str, shp_paths: dict, mapping_file: str, metrics_path: str,
+                     modes: dict = None, version: str = None,
+                     grid_res: float = None, grid_bounds: tuple = None, tiles_path: str = None) -> dict:
+    """
+    Genera el bundle en `destino`, que es un enlace simbólico al directorio
+    real `<destino>.<marca>`. El bundle se arma completo en su directorio y el
+    enlace se reemplaza de forma atómica, así un arranque concurrente siempre
+    ve un bundle entero (el anterior o el nuevo), nunca uno a medias ni la
+    ausencia de bundle.
+    """
+    destino = destino.rstrip(os.sep)
+    tmp = f"{destino}.{time.time_ns()}.{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    _escribir_json(os.path.join(tmp, 'comuna_region.json'), mapa_comuna_region(mapping_file))
+    _escribir_json(os.path.join(tmp, 'metricas.json'), tabla_metricas(metrics_path))
+    exportar_comparables(metrics_path, os.path.join(tmp, 'comparables.parquet'))
+
+    resolver = ComunaResolver(gpd.read_parquet(shp_paths['comunas']), grid_res=grid_res, grid_bounds=grid_bounds)
+    joblib.dump(resolver, os.path.join(tmp, 'comuna_resolver.joblib'))
+
+    registry = SpatialIndexRegistry.from_paths(
+        {name: shp_paths[name] for name in POINT_LAYERS + LINE_LAYERS}, modes)
+    registry.save(os.path.join(tmp, 'spatial_index'))
+
+    # Teselas solo si se construyeron desde estas mismas capas, modos y comunas
+    if tiles_path and aplicar_teselas(tiles_path, registry, resolver) is not registry:
+        shutil.copytree(tiles_path, os.path.join(tmp, 'distance_tiles'),
+                        ignore=shutil.ignore_patterns('*.tmp'))
+
+    manifest = {
+        'formato': BUNDLE_FORMAT,
+        'version': version or model_store.nueva_version(),
+        'creado': datetime.now().isoformat(),
+        'modos': registry.modes,
+        'grid_res': grid_res,
+        'archivos': {rel: _sha256(os.path.join(tmp, rel)) for rel in _archivos(tmp)},
+    }
+    _escribir_json(os.path.join(tmp, 'manifest.json'), manifest)
+
+    _apuntar(destino, tmp)
+    return manifest
+
+
+def _apuntar(destino: str, directorio: str):
+    enlace = f"{destino}.{os.getpid()}.enlace"
+    if os.path.lexists(enlace):
+        os.remove(enlace)
+    os.symlink(os.path.basename(directorio), enlace)
+    if os.path.isdir(destino) and not os.path.islink(destino):
+        # Bundle de antes del enlace (un directorio): este único cambio no es atómico
+        shutil.rmtree(destino)
+    anterior = os.path.realpath(destino) if os.path.islink(destino) else None
+    os.replace(enlace, destino)
+    # Se conserva el bundle anterior (un worker cargado desde él todavía lee comparables.parquet);
+    # los más viejos se borran. Los archivos que algún worker tenga mapeados siguen válidos tras borrarlos.
+    # Un directorio sin manifest es un bundle que otro proceso todavía está armando.
+    vigentes = {os.path.realpath(directorio), anterior}
+    prefijo = os.path.basename(destino) + '.'
+    base = os.path.dirname(destino) or '.'
+    for nombre in os.listdir(base):
+        path = os.path.join(base, nombre)
+        if (nombre.startswith(prefijo) and nombre[len(prefijo):].split('.')[0].isdigit()
+                and not os.path.islink(path) and os.path.exists(os.path.join(path, 'manifest.json'))
+                and os.path.realpath(path) not in vigentes):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class ServingBundle:
+    def __init__(self, path: str, manifest: dict, comuna_region: dict, comuna_resolver: ComunaResolver,
+                 spatial_index: SpatialIndexRegistry, metricas: dict):
+        self.path = path
+        self.manifest = manifest
+        self.comuna_region = comuna_region
+        self.comuna_resolver = comuna_resolver
+        self.spatial_index = spatial_index
+        self.metricas = metricas
+
+    @property
+    def version(self) -> str:
+        return self.manifest['version']
+
+    @property
+    def comparables_path(self):
+        # Bundles anteriores a /comparables no lo traen
+        path = os.path.join(self.path, 'comparables.parquet')
+        return path if os.path.exists(path) else None
+
+
+def leer_manifest(path: str) -> dict:
+    with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verificar_bundle(path: str, manifest: dict = None):
+    manifest = manifest or leer_manifest(path)
+    if manifest.get('formato') != BUNDLE_FORMAT:
+        raise ValueError(f"Formato de bundle no soportado: {manifest.get('formato')}")
+    for rel, esperado in manifest['archivos'].items():
+        if _sha256(os.path.join(path, rel)) != esperado:
+            raise ValueError(f"Checksum inválido en el bundle: {rel}")
+
+
+def cargar_metricas(path: str) -> dict:
+    with open(os.path.join(path, 'metricas.json'), encoding='utf-8') as f:
+        return {comuna: tuple(valores) for comuna, valores in json.load(f).items()}
+
+
+def cargar_bundle(path: str, verificar: bool = True, mmap: bool = True) -> ServingBundle:
+    # Se resuelve el enlace una vez: todo se lee del mismo bundle aunque se publique otro mientras tanto
+    path = os.path.realpath(path)
+    manifest = leer_manifest(path)
+    if verificar:
+        verificar_bundle(path, manifest)
+    with open(os.path.join(path, 'comuna_region.json'), encoding='utf-8') as f:
+        comuna_region = json.load(f)
+    comuna_resolver = joblib.load(os.path.join(path, 'comuna_resolver.joblib'))
+    spatial_index = SpatialIndexRegistry.load(os.path.join(path, 'spatial_index'), mmap=mmap)
+    # Teselas solo si coinciden con las capas, modos y comunas del bundle (como sin bundle)
+    spatial_index = aplicar_teselas(os.path.join(path, 'distance_tiles'), spatial_index, comuna_resolver, mmap)
+    return ServingBundle(
+        path,
+        manifest,
+        comuna_region,
+        comuna_resolver,
+        spatial_index,
+        cargar_metricas(path))
+
+
+def ruta_bundle_version(version: str, models_dir: str = model_store.MODELS_DIR) -> str:
+    return os.path.join(model_store.directorio_version(version, models_dir), BUNDLE_DIRNAME)
+
+
+def bundle_activo(bundle_dir: str = None, models_dir: str = model_store.MODELS_DIR):
+    """Bundle de la versión publicada en CURRENT si lo tiene; si no, `bundle_dir` si existe."""
+    version = model_store.version_actual(models_dir)
+    if version:
+        path = ruta_bundle_version(version, models_dir)
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            return path
+    if bundle_dir and os.path.exists(os.path.join(bundle_dir, 'manifest.json')):
+        return bundle_dir
+    return None
+
+
+def _fuentes_desde_env(metrics_path: str = None) -> tuple:
+    shp_paths = {
+        'ed_superior': os.getenv('ED_SUPERIOR_SHP', 'data_preprocessed/ed_superior.parquet').strip("'\""),
+        'ed_escolar':  os.getenv('ED_ESCOLAR_SHP',  'data_preprocessed/ed_escolar.parquet').strip("'\""),
+        'comisarias':  os.getenv('COMISARIAS_SHP',  'data_preprocessed/comisarias.parquet').strip("'\""),
+        'salud':       os.getenv('SALUD_SHP',       'data_preprocessed/salud.parquet').strip("'\""),
+        'metro':       os.getenv('METRO_SHP',       'data_preprocessed/metro.parquet').strip("'\""),
+        'comunas':     os.getenv('COMUNAS_SHP',     'data_preprocessed/comunas.parquet').strip("'\"")
+    }
+    return (shp_paths, os.getenv('COMUNA_REGION_FILE', 'comunas.xlsx'),
+            metrics_path or os.getenv('DATA_METRICS_FILE', 'data_preprocessed/df_metrics.parquet'))
+
+
+def fuentes_faltantes(metrics_path: str = None) -> list:
+    """Archivos fuente del bundle que no existen (p.ej. df_metrics.parquet antes del primer entrenamiento)."""
+    shp_paths, comuna_region_file, metrics_path = _fuentes_desde_env(metrics_path)
+    return [path for path in [*shp_paths.values(), comuna_region_file, metrics_path] if not os.path.exists(path)]
+
+
+def construir_desde_env(destino: str = None, version: str = None, metrics_path: str = None) -> dict:
+    shp_paths, comuna_region_file, metrics_path = _fuentes_desde_env(metrics_path)
+    grid_res = float(os.getenv('COMUNA_GRID_RES', 0)) or None
+    grid_bounds = tuple(float(v) for v in os.getenv('COMUNA_GRID_BOUNDS', '').split(',')) if os.getenv('COMUNA_GRID_BOUNDS') else None
+    return construir_bundle(
+        destino or os.getenv('SERVING_BUNDLE_DIR', 'serving_bundle'),
+        shp_paths,
+        comuna_region_file,
+        metrics_path,
+        modes=distance_modes_from_env(),
+        version=version,
+        grid_res=grid_res,
+        grid_bounds=grid_bounds,
+        tiles_path=os.getenv('DISTANCE_TILES_PATH') or None)
+
+
+if __name__ == '__main__':
+    # Paso de build: python serving_bundle.py [directorio] [--si-hay-fuentes]
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = [a for a in sys.argv[1:] if a != '--si-hay-fuentes']
+    faltantes = fuentes_faltantes()
+    if faltantes and '--si-hay-fuentes' in sys.argv[1:]:
+        # Sin bundle la API arranca desde las fuentes (ver app.py)
+        print(f"No se construye el bundle de serving, faltan: {', '.join(faltantes)}")
+        sys.exit(0)
+    destino = args[0] if args else None
+    manifest = construir_desde_env(destino)
+    print(f"Bundle {manifest['version']} guardado en: {destino or os.getenv('SERVING_BUNDLE_DIR', 'serving_bundle')}")
@@ -0,0 +1,173 @@
+import os
+import joblib
+import pandas as pd
+import geopandas as gpd
+from datetime import datetime
+from dotenv import load_dotenv
+
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS, distance_modes_from_env
+from data_metrics import MetricasComunaCache
+from comuna_resolver import ComunaResolver
+from fast_inference import compiled_path_for
+from distance_tiles import aplicar_teselas
+from region_models import con_modelos_por_grupo, USE_REGION_MODELS
+from instrumentation import etapa
+import model_store
+import serving_bundle
+
+load_dotenv()
+
+
+# Núcleo de predicción compartido por app.py y bulk_score.py: modelo, comunas,
+# regiones, índices espaciales y métricas por comuna, sin Flask ni base de datos.
+
+MODEL_PATH = os.getenv('MODEL_PATH', 'modelo_valoracion.pkl')
+MODEL_COMPILED_PATH = os.getenv('MODEL_COMPILED_PATH', compiled_path_for(MODEL_PATH))
+USE_COMPILED_MODEL = os.getenv('USE_COMPILED_MODEL', 'true').lower() == 'true'
+SHP_PATHS = {
+    'ed_superior': os.getenv('ED_SUPERIOR_SHP', 'data_preprocessed/ed_superior.parquet').strip("'\""),
+    'ed_escolar':  os.getenv('ED_ESCOLAR_SHP',  'data_preprocessed/ed_escolar.parquet').strip("'\""),
+    'comisarias':  os.getenv('COMISARIAS_SHP',  'data_preprocessed/comisarias.parquet').strip("'\""),
+    'salud':       os.getenv('SALUD_SHP',       'data_preprocessed/salud.parquet').strip("'\""),
+    'metro':       os.getenv('METRO_SHP',       'data_preprocessed/metro.parquet').strip("'\""),
+    'comunas':     os.getenv('COMUNAS_SHP',     'data_preprocessed/comunas.parquet').strip("'\"")
+}
+SPATIAL_INDEX_PATH = os.getenv('SPATIAL_INDEX_PATH', 'data_preprocessed/spatial_index')
+# Teselas precalculadas de distancias y comuna (ver distance_tiles.py); vacío = consultas exactas
+DISTANCE_TILES_PATH = os.getenv('DISTANCE_TILES_PATH', '')
+# Grilla opcional del resolvedor de comunas: resolución en grados y extensión "minx,miny,maxx,maxy"
+COMUNA_GRID_RES = float(os.getenv('COMUNA_GRID_RES', 0)) or None
+COMUNA_GRID_BOUNDS = tuple(float(v) for v in os.getenv('COMUNA_GRID_BOUNDS', '').split(',')) if os.getenv('COMUNA_GRID_BOUNDS') else None
+
+MAPPING_FILE = os.getenv('COMUNA_REGION_FILE', 'comunas.xlsx')
+# Bundle de serving precompilado (ver serving_bundle.py); si no existe se arma todo desde las fuentes
+SERVING_BUNDLE_DIR = os.getenv('SERVING_BUNDLE_DIR', 'serving_bundle')
+SERVING_BUNDLE_VERIFY = os.getenv('SERVING_BUNDLE_VERIFY', 'true').lower() == 'true'
+
+
+def cargar_artefacto(model_path: str, compiled_path: str = None):
+    compiled_path = compiled_path or compiled_path_for(model_path)
+    # Usa la versión compilada si existe y no es anterior al pipeline serializado
+    if (USE_COMPILED_MODEL and os.path.exists(compiled_path)
+            and os.path.getmtime(compiled_path) >= os.path.getmtime(model_path)):
+        return joblib.load(compiled_path)
+    return joblib.load(model_path)
+
+
+def cargar_modelo(version: str = None):
+    # Versión publicada en MODELS_DIR o, si no hay ninguna, el modelo de MODEL_PATH
+    model_path = model_store.ruta_modelo(version) if version else MODEL_PATH
+    compiled_path = compiled_path_for(model_path) if version else MODEL_COMPILED_PATH
+    model = cargar_artefacto(model_path, compiled_path)
+    # Con modelos por región el global queda de respaldo y los de cada región se cargan al usarse
+    if USE_REGION_MODELS:
+        return con_modelos_por_grupo(model, model_path, cargar_artefacto)
+    return model
+
+
+class Recursos:
+    """Todo lo que una predicción usa además del modelo."""
+
+    def __init__(self, comuna_region: dict, comuna_resolver: ComunaResolver, spatial_index: SpatialIndexRegistry,
+                 metricas_cache: MetricasComunaCache, comparables_path: str = None):
+        self.comuna_region = comuna_region
+        self.comuna_resolver = comuna_resolver
+        self.spatial_index = spatial_index
+        self.metricas_cache = metricas_cache
+        self.comparables_path = comparables_path
+
+
+def cargar_recursos(version: str = None) -> Recursos:
+    """
+    Desde el bundle de `version` si lo tiene (si no, el bundle activo, ver
+    serving_bundle.bundle_activo) o, sin bundle, desde las fuentes.
+    """
+    bundle_path = serving_bundle.ruta_bundle_version(version) if version else None
+    if not (bundle_path and os.path.exists(os.path.join(bundle_path, 'manifest.json'))):
+        bundle_path = serving_bundle.bundle_activo(SERVING_BUNDLE_DIR)
+    if bundle_path:
+        # Arranque desde el bundle: sin Excel, sin GeoParquet y sin reproyectar
+        bundle = serving_bundle.cargar_bundle(bundle_path, verificar=SERVING_BUNDLE_VERIFY)
+        return Recursos(bundle.comuna_region, bundle.comuna_resolver, bundle.spatial_index,
+                        MetricasComunaCache(tabla=bundle.metricas), bundle.comparables_path)
+
+    # Índices espaciales de las capas de distancia (un árbol por capa, compartido entre requests)
+    spatial_index = SpatialIndexRegistry.load_or_build(
+        {name: SHP_PATHS[name] for name in POINT_LAYERS + LINE_LAYERS},
+        SPATIAL_INDEX_PATH,
+        modes=distance_modes_from_env())
+
+    # Polígonos de comunas preparados para resolver comuna desde coordenadas
+    comuna_resolver = ComunaResolver(
+        gpd.read_parquet(SHP_PATHS['comunas']),
+        grid_res=COMUNA_GRID_RES,
+        grid_bounds=COMUNA_GRID_BOUNDS)
+
+    # Con teselas, distancias y comuna se leen de la grilla; fuera de ella se usan los índices exactos
+    spatial_index = aplicar_teselas(DISTANCE_TILES_PATH, spatial_index, comuna_resolver)
+    # Métricas por comuna precalculadas (DATA_METRICS_FILE)
+    return Recursos(serving_bundle.mapa_comuna_region(MAPPING_FILE), comuna_resolver, spatial_index,
+                    MetricasComunaCache())
+
+
+def metricas_de_comuna(metricas_cache: MetricasComunaCache, comuna: str) -> tuple:
+    # (avg_price_uf, superficie_util_prom, nro_propiedades), ceros si no hay datos
+    cm = metricas_cache.get(comuna)
+    if cm is None:
+        return 0.0, 0.0, 0
+    return cm
+
+
+def armar_registro(features: dict, prediction: float, requested_at: datetime,
+                   metricas_cache: MetricasComunaCache) -> dict:
+    with etapa('metricas_comuna'):
+        avg_price_uf, superficie_util_prom, nro_propiedades = metricas_de_comuna(metricas_cache, features['Comuna'])
+    return {
+        **features,
+        'antiguedad': 0,
+        'prediction_uf':       float(prediction),
+        'avg_price_uf':        float(avg_price_uf),
+        'avg_price_uf_m2':     float(superficie_util_prom),
+        'n_properties':        int(nro_propiedades),
+        'requested_at':        requested_at
+    }
+
+
+def respuesta_prediccion(record: dict) -> dict:
+    return {
+        'prediction_uf':                    record['prediction_uf'],
+        'comuna':                           record['Comuna'],
+        'valor_promedio_propiedades_comuna': record['avg_price_uf'],
+        'superficie_util_promedio_comuna':   record['avg_price_uf_m2'],
+        'cantidad_propiedades_comuna':       record['n_properties']
+    }
+
+
+def predecir(filas: list, model):
+    # El modelo compilado recibe los dicts directamente, sin armar un DataFrame
+    if hasattr(model, 'predict_records'):
+        with etapa('modelo'):
+            return model.predict_records(filas)
+    with etapa('dataframe'):
+        df = pd.DataFrame(filas)
+    with etapa('modelo'):
+        return model.predict(df)
+
+
+def predecir_filas(filas: list, model) -> list:
+    """
+    Predice todas las filas en una sola llamada al modelo. Si la llamada falla,
+    reintenta fila por fila para aislar el error de cada elemento.
+    Devuelve una lista de (prediccion, error).
+    """
+    try:
+        preds = predecir(filas, model)
+        return [(float(p), None) for p in preds]
+    except Exception:
+        resultados = []
+        for fila in filas:
+            try:
+                resultados.append((float(predecir([fila], model)[0]), None))
+            except Exception as e:
+                resultados.append((None, str(e)))
+        return resultados
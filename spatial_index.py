@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy.spatial import cKDTree
+
+from utils import (
+    calculate_nearest_distances,
+    calculate_nearest_distances_geodesic,
+    calculate_nearest_distances_metro,
+    calculate_nearest_distances_metro_geodesic,
+    build_segment_tree,
+    local_aeqd_crs,
+    lonlat_to_unit_xyz
+)
+
+
+# Capas usadas como features de distancia en /predict y en el entrenamiento
+POINT_LAYERS = ('ed_superior', 'ed_escolar', 'comisarias', 'salud')
+LINE_LAYERS = ('metro',)
+
+# 'planar': distancia euclidiana en las coordenadas crudas * R*pi/180 (método histórico)
+# 'geodesic': km reales (ECEF para puntos, proyección equidistante local para líneas)
+DISTANCE_MODES = ('planar', 'geodesic')
+
+
+def distance_modes_from_env() -> dict:
+    """
+    Modo de distancia por capa. DISTANCE_MODE fija el modo por defecto y
+    DISTANCE_MODES lo sobreescribe por capa, p.ej. "metro=geodesic,salud=geodesic".
+    Entrenamiento y API leen las mismas variables, así las features coinciden.
+    """
+    default = os.getenv('DISTANCE_MODE', 'planar').strip().lower()
+    modes = {name: default for name in POINT_LAYERS + LINE_LAYERS}
+    for item in os.getenv('DISTANCE_MODES', '').split(','):
+        if '=' in item:
+            name, mode = item.split('=', 1)
+            modes[name.strip()] = mode.strip().lower()
+    invalid = {name: mode for name, mode in modes.items() if mode not in DISTANCE_MODES}
+    if invalid:
+        raise ValueError(f"Modo de distancia no soportado: {invalid}")
+    return modes
+
+
+def _guardar_npy(path: str, arr: np.ndarray):
+    # Archivo nuevo + rename: nunca se trunca un .npy que otro proceso tenga mapeado
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def firma_archivos(paths: dict) -> dict:
+    # (mtime, tamaño) de cada archivo fuente, para detectar índices serializados obsoletos
+    firma = {}
+    for name, path in paths.items():
+        st = os.stat(path)
+        firma[name] = (st.st_mtime_ns, st.st_size)
+    return firma
+
+
+class SpatialIndexRegistry:
+    """
+    Registro de índices espaciales, construido una vez por proceso y reutilizado
+    entre requests: un cKDTree por capa de puntos y un STRtree de segmentos por
+    capa de líneas, en el modo de distancia elegido para cada capa.
+    """
+
+    def __init__(self, trees: dict = None, firma: dict = None, modes: dict = None, crs: dict = None):
+        self.trees = dict(trees or {})
+        self.firma = dict(firma or {})
+        self.modes = dict(modes or {})
+        self.crs = dict(crs or {})
+
+    @classmethod
+    def from_layers(cls, layers: dict, firma: dict = None, modes: dict = None) -> 'SpatialIndexRegistry':
+        modes = {name: (modes or {}).get(name, 'planar') for name in layers}
+        trees, crs = {}, {}
+        for name, gdf in layers.items():
+            geodesic = modes[name] == 'geodesic'
+            if (gdf.geom_type == 'Point').all():
+                if geodesic:
+                    gdf = gdf.to_crs(epsg=4326)
+                    coords = lonlat_to_unit_xyz(gdf.geometry.x, gdf.geometry.y)
+                else:
+                    coords = np.column_stack((gdf.geometry.x, gdf.geometry.y))
+                trees[name] = cKDTree(coords)
+            elif geodesic:
+                crs[name] = local_aeqd_crs(gdf)
+                trees[name] = build_segment_tree(gdf.to_crs(crs[name]))
+            else:
+                trees[name] = build_segment_tree(gdf)
+        return cls(trees, firma, modes, crs)
+
+    @classmethod
+    def from_paths(cls, paths: dict, modes: dict = None) -> 'SpatialIndexRegistry':
+        layers = {name: gpd.read_parquet(path) for name, path in paths.items()}
+        return cls.from_layers(layers, firma_archivos(paths), modes)
+
+    @classmethod
+    def load_or_build(cls, paths: dict, index_path: str = None, modes: dict = None,
+                      mmap: bool = True) -> 'SpatialIndexRegistry':
+        modes = {name: (modes or {}).get(name, 'planar') for name in paths}
+        # Usa el índice serializado solo si fue construido desde los mismos archivos y modos
+        if index_path and os.path.exists(os.path.join(index_path, 'manifest.json')):
+            registry = cls.load(index_path, mmap=mmap)
+            if registry.firma == firma_archivos(paths) and registry.modes == modes:
+                return registry
+        registry = cls.from_paths(paths, modes)
+        if index_path:
+            try:
+                registry.save(index_path)
+                if mmap:
+                    return cls.load(index_path, mmap=True)
+            except OSError:
+                # Sin permisos de escritura: se sigue con el índice en memoria
+                pass
+        return registry
+
+    def save(self, path: str):
+        """
+        Guarda las coordenadas de cada capa como .npy (puntos: (n, 2|3); líneas:
+        segmentos (n, 2, 2)) más un manifest.json. Se escriben primero los
+        arreglos y al final el manifest, todos de forma atómica.
+        """
+        os.makedirs(path, exist_ok=True)
+        layers = {}
+        for name, tree in self.trees.items():
+            if isinstance(tree, cKDTree):
+                _guardar_npy(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(tree.data))
+                layers[name] = 'points'
+            else:
+                segmentos = shapely.get_coordinates(tree.geometries).reshape(-1, 2, 2)
+                _guardar_npy(os.path.join(path, f"{name}.npy"), segmentos)
+                layers[name] = 'lines'
+        manifest = {'layers': layers, 'modes': self.modes, 'crs': self.crs, 'firma': self.firma}
+        tmp = os.path.join(path, f"manifest.json.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'SpatialIndexRegistry':
+        """
+        Carga un índice guardado con save(). Con mmap=True las coordenadas quedan
+        mapeadas desde disco (copy_data=False en el cKDTree), así que los workers
+        comparten esas páginas a través del page cache en vez de copiarlas.
+        """
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        trees = {}
+        for name, kind in manifest['layers'].items():
+            arr = np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None)
+            if kind == 'points':
+                trees[name] = cKDTree(arr, copy_data=not mmap)
+            else:
+                trees[name] = shapely.STRtree(shapely.linestrings(np.asarray(arr)))
+        firma = {name: tuple(v) for name, v in manifest['firma'].items()}
+        return cls(trees, firma, manifest['modes'], manifest['crs'])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.trees
+
+    def nearest_km(self, name: str, src: gpd.GeoDataFrame) -> np.ndarray:
+        tree = self.trees[name]
+        geodesic = self.modes.get(name, 'planar') == 'geodesic'
+        if isinstance(tree, cKDTree):
+            if geodesic:
+                return calculate_nearest_distances_geodesic(src, None, tree=tree)
+            return calculate_nearest_distances(src, None, tree=tree)
+        if geodesic:
+            return calculate_nearest_distances_metro_geodesic(src, None, tree=tree, crs=self.crs[name])
+        return calculate_nearest_distances_metro(src, None, tree=tree)
+
+
+if __name__ == '__main__':
+    # Paso de build: python spatial_index.py [directorio] genera el índice mapeable en disco
+    from dotenv import load_dotenv
+    load_dotenv()
+    destino = sys.argv[1] if len(sys.argv) > 1 else os.getenv('SPATIAL_INDEX_PATH', 'data_preprocessed/spatial_index')
+    paths = {
+        'ed_superior': os.getenv('ED_SUPERIOR_SHP', 'data_preprocessed/ed_superior.parquet').strip("'\""),
+        'ed_escolar':  os.getenv('ED_ESCOLAR_SHP',  'data_preprocessed/ed_escolar.parquet').strip("'\""),
+        'comisarias':  os.getenv('COMISARIAS_SHP',  'data_preprocessed/comisarias.parquet').strip("'\""),
+        'salud':       os.getenv('SALUD_SHP',       'data_preprocessed/salud.parquet').strip("'\""),
+        'metro':       os.getenv('METRO_SHP',       'data_preprocessed/metro.parquet').strip("'\""),
+    }
+    SpatialIndexRegistry.from_paths(paths, distance_modes_from_env()).save(destino)
+    print(f"Índice espacial guardado en: {destino}")
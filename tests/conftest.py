@@ -0,0 +1,107 @@
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+# Los módulos de la API están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def df_propiedades():
+    """Propiedades sintéticas con las columnas que recibe el modelo, más el precio."""
+    rng = np.random.default_rng(0)
+    n = 400
+    df = pd.DataFrame({
+        'divisa': 'UF',
+        'tipo': rng.choice(['casa', 'departamento'], n),
+        'superficie_total': rng.uniform(40, 300, n),
+        'superficie_util': rng.uniform(30, 200, n),
+        'dormitorios': rng.integers(1, 5, n).astype(float),
+        'banos': rng.integers(1, 4, n).astype(float),
+        'latitud': rng.uniform(-33.6, -33.3, n),
+        'longitud': rng.uniform(-70.8, -70.5, n),
+        'Comuna': rng.choice(['nunoa', 'maipu', 'santiago'], n),
+        'Region': 'Región Metropolitana de Santiago',
+        'distancia_metro_km': rng.uniform(0, 5, n),
+    })
+    df['precio'] = df['superficie_util'] * 60 + df['dormitorios'] * 300 + rng.normal(0, 100, n)
+    return df
+
+
+class ResolverFijo:
+    """Comuna 'Ñuñoa' dentro de un recuadro alrededor de Santiago; None fuera."""
+
+    def comunas(self, lats, lons):
+        return ['Ñuñoa' if -34 < lat < -33 and -71 < lon < -70 else None for lat, lon in zip(lats, lons)]
+
+
+class IndiceFijo:
+    """Distancia fija a todas las capas; falla como cKDTree.query con coordenadas no finitas."""
+
+    def nearest_km(self, layer, puntos):
+        if not np.isfinite(np.column_stack([puntos.geometry.x, puntos.geometry.y])).all():
+            raise ValueError("x must be finite")
+        return np.full(len(puntos), 1.5)
+
+
+@pytest.fixture
+def resolver_fijo():
+    return ResolverFijo()
+
+
+@pytest.fixture
+def indice_fijo():
+    return IndiceFijo()
+
+
+# Dos comunas rectangulares, sin superponerse, en el sector oriente y poniente de Santiago
+COMUNAS = {'Ñuñoa': shapely.box(-70.62, -33.48, -70.56, -33.44), 'Maipú': shapely.box(-70.80, -33.55, -70.70, -33.48)}
+
+
+@pytest.fixture(scope='session')
+def fuentes_geo(tmp_path_factory):
+    """
+    Fuentes sintéticas de la API en un directorio temporal: capas POI (cuatro
+    de puntos y metro), polígonos de comunas, planilla comuna-región y
+    df_metrics. Devuelve {'shp_paths', 'mapping_file', 'metrics_path'}.
+    """
+    base = tmp_path_factory.mktemp('fuentes')
+    rng = np.random.default_rng(0)
+
+    def puntos(n):
+        return gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(-70.85, -70.5, n), rng.uniform(-33.6, -33.35, n)),
+                                crs="EPSG:4326")
+
+    capas = {'ed_superior': puntos(20), 'ed_escolar': puntos(60), 'comisarias': puntos(10), 'salud': puntos(30),
+             'metro': gpd.GeoDataFrame(geometry=[shapely.LineString([(-70.78, -33.51), (-70.66, -33.46), (-70.57, -33.45)]),
+                                                 shapely.LineString([(-70.60, -33.40), (-70.60, -33.50)])],
+                                       crs="EPSG:4326"),
+             'comunas': gpd.GeoDataFrame({'Comuna': list(COMUNAS), 'Region': 'Región Metropolitana de Santiago'},
+                                         geometry=list(COMUNAS.values()), crs="EPSG:4326")}
+    shp_paths = {}
+    for name, gdf in capas.items():
+        shp_paths[name] = str(base / f"{name}.parquet")
+        gdf.to_parquet(shp_paths[name])
+
+    mapping_file = str(base / 'comunas.xlsx')
+    pd.DataFrame({'Comuna': list(COMUNAS), 'Region': 'Región Metropolitana de Santiago'}).to_excel(mapping_file, index=False)
+
+    n = 200
+    comuna = rng.choice(list(COMUNAS), n)
+    cajas = np.array([COMUNAS[c].bounds for c in comuna])
+    df = pd.DataFrame({
+        'id': np.arange(n), 'URL': [f"https://example.com/{i}" for i in range(n)],
+        'tipo': rng.choice(['casa', 'departamento'], n), 'Comuna': comuna,
+        'latitud': rng.uniform(cajas[:, 1], cajas[:, 3]), 'longitud': rng.uniform(cajas[:, 0], cajas[:, 2]),
+        'superficie_util': rng.uniform(30, 200, n), 'superficie_total': rng.uniform(40, 300, n),
+        'dormitorios': rng.integers(1, 5, n).astype(float), 'banos': rng.integers(1, 4, n).astype(float),
+    })
+    df['precio'] = df['superficie_util'] * np.where(df['Comuna'] == 'Ñuñoa', 80, 40)
+    metrics_path = str(base / 'df_metrics.parquet')
+    df.to_parquet(metrics_path)
+    return {'shp_paths': shp_paths, 'mapping_file': mapping_file, 'metrics_path': metrics_path}
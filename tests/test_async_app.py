@@ -0,0 +1,104 @@
+import asyncio
+import importlib
+import json
+import sys
+import types
+
+import pytest
+
+
+def k_comparables(valor):
+    # Como app.k_comparables, con COMPARABLES_K=5 y COMPARABLES_K_MAX=50
+    if valor in ('', 'true'):
+        return 5
+    if not valor.isdigit() or not 1 <= int(valor) <= 50:
+        raise ValueError("La cantidad de comparables debe ser un entero entre 1 y 50")
+    return int(valor)
+
+
+@pytest.fixture
+def async_app(monkeypatch):
+    # MicroBatcher no usa el estado de app.py; un módulo mínimo evita cargar modelo, índices y BD
+    core = types.SimpleNamespace(
+        guardar_predicciones=lambda registros: None,
+        k_comparables=k_comparables,
+        buscar_comparables=lambda features, k: [{'id': i, 'tipo': features['tipo']} for i in range(k)],
+        respuesta_prediccion=lambda record: {'prediction_uf': record['prediction_uf']})
+    monkeypatch.setitem(sys.modules, 'app', core)
+    monkeypatch.delitem(sys.modules, 'async_app', raising=False)
+    modulo = importlib.import_module('async_app')
+    yield modulo
+    sys.modules.pop('async_app', None)
+
+
+def procesar(items):
+    # Como procesar_lote: un item que no es dict rompe todo el lote
+    if any(not isinstance(item, dict) for item in items):
+        raise TypeError("item inválido")
+    return [({'id': item['id']}, None) for item in items], [{'id': item['id']} for item in items]
+
+
+def test_request_invalido_no_arrastra_al_resto_del_lote(async_app):
+    guardados = []
+
+    async def correr():
+        batcher = async_app.MicroBatcher(procesar, guardados.extend, max_items=8, max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(item) for item in [{'id': 1}, 123, {'id': 2}]),
+                                        return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    r1, r_malo, r2 = asyncio.run(correr())
+    assert r1 == ({'id': 1}, None) and r2 == ({'id': 2}, None)
+    assert isinstance(r_malo, TypeError)
+    assert sorted(g['id'] for g in guardados) == [1, 2]
+
+
+def llamar(async_app, query_string: bytes, cuerpo: dict) -> tuple:
+    """POST /predict directo a la app ASGI; devuelve (status, cuerpo JSON)."""
+    enviados = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': json.dumps(cuerpo).encode(), 'more_body': False}
+
+    async def send(mensaje):
+        enviados.append(mensaje)
+
+    async def correr():
+        async_app.batcher.start()
+        try:
+            await async_app.app({'type': 'http', 'path': '/predict', 'method': 'POST', 'query_string': query_string},
+                                receive, send)
+        finally:
+            await async_app.batcher.stop()
+
+    asyncio.run(correr())
+    return enviados[0]['status'], json.loads(enviados[1]['body'])
+
+
+@pytest.fixture
+def predict_async(async_app, monkeypatch):
+    def procesar_fijo(items):
+        registros = [{**item, 'prediction_uf': 5000.0} for item in items]
+        return [(r, None) for r in registros], registros
+    def predict(query_string):
+        # Un batcher por request: después de stop() no se puede volver a iniciar
+        monkeypatch.setattr(async_app, 'batcher', async_app.MicroBatcher(procesar_fijo, lambda registros: None))
+        return llamar(async_app, query_string, {'tipo': 'casa'})
+    return predict
+
+
+def test_predict_con_comparables_como_flask(predict_async):
+    assert predict_async(b'') == (200, {'prediction_uf': 5000.0})
+    status, cuerpo = predict_async(b'comparables=3')
+    assert status == 200 and [c['id'] for c in cuerpo['comparables']] == [0, 1, 2]
+    assert cuerpo['comparables'][0]['tipo'] == 'casa'
+    # Sin valor: los COMPARABLES_K por defecto
+    assert len(predict_async(b'comparables')[1]['comparables']) == 5
+
+
+def test_predict_con_comparables_invalido(predict_async):
+    status, cuerpo = predict_async(b'comparables=0')
+    assert status == 400 and 'entre 1 y 50' in cuerpo['error']
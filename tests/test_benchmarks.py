@@ -0,0 +1,91 @@
+import itertools
+import json
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+# Los scripts de benchmarks se importan entre sí como módulos sueltos
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from load_test import cuerpos
+from payloads import generar_payloads
+from resultados import cerrar, comparar, documento, medir
+
+
+def doc(resultados: dict) -> dict:
+    return {'resultados': resultados}
+
+
+def test_comparar_marca_latencias_y_rendimiento_fuera_de_tolerancia():
+    baseline = doc({'predict': {'p50_ms': 10.0, 'p99_ms': 20.0, 'max_ms': 30.0, 'filas_por_s': 100.0, 'filas': 1}})
+    actual = doc({'predict': {'p50_ms': 11.0, 'p99_ms': 30.0, 'max_ms': 300.0, 'filas_por_s': 70.0, 'filas': 1},
+                  'nuevo': {'p50_ms': 1.0}})
+
+    regresiones = comparar(actual, baseline, tolerancia=0.2)
+
+    assert [(r['resultado'], r['metrica']) for r in regresiones] == [('predict', 'p99_ms'), ('predict', 'filas_por_s')]
+    assert regresiones[0]['cambio'] == pytest.approx(0.5)
+    assert comparar(actual, baseline, tolerancia=0.6) == []
+
+
+def test_cerrar_guarda_y_compara_contra_la_linea_base(tmp_path, capsys):
+    baseline = str(tmp_path / 'baseline.json')
+    salida = str(tmp_path / 'actual.json')
+    base = documento('prueba', {'f': {'p50_ms': 10.0}}, {'n': 1})
+
+    assert cerrar(base, baseline=baseline) == 0
+    assert cerrar(base, baseline=baseline, guardar_baseline=True) == 0
+    assert cerrar(documento('prueba', {'f': {'p50_ms': 10.5}}), baseline=baseline) == 0
+    assert cerrar(documento('prueba', {'f': {'p50_ms': 15.0}}), salida=salida, baseline=baseline) == 1
+    with open(salida, encoding='utf-8') as f:
+        assert json.load(f)['resultados'] == {'f': {'p50_ms': 15.0}}
+
+
+def test_medir_reporta_percentiles_y_filas_por_segundo():
+    llamadas = []
+    r = medir(lambda: llamadas.append(1), repeticiones=5, calentamiento=2, filas=10)
+
+    assert len(llamadas) == 7
+    assert r['p50_ms'] <= r['p90_ms'] <= r['p99_ms'] <= r['max_ms'] and r['filas'] == 10
+    assert r['filas_por_s'] > 0
+
+
+def test_payloads_dentro_de_comunas_permitidas(fuentes_geo, tmp_path):
+    qa_path = str(tmp_path / 'qa.xlsx')
+    pd.DataFrame({'tipo': ['casa', 'departamento'], 'superficie_util': [100.0, 60.0],
+                  'superficie_total': [150.0, 70.0], 'antiguedad': [10.0, 2.0], 'dormitorios': [3, 2],
+                  'banos': [2, 1], 'comuna': ['Ñuñoa', 'Ñuñoa']}).to_excel(qa_path, index=False)
+    comunas = gpd.read_parquet(fuentes_geo['shp_paths']['comunas'])
+    poligonos = dict(zip(comunas['Comuna'], comunas.geometry))
+
+    payloads = generar_payloads(50, comunas, {'nunoa': 'RM', 'maipu': 'RM'}, qa_path=qa_path, con_comuna=True)
+
+    assert len(payloads) == 50
+    for p in payloads:
+        assert poligonos[p['comuna']].contains(shapely.Point(p['longitud'], p['latitud']))
+    # La frecuencia de resultados_qa solo tiene Ñuñoa
+    assert {p['comuna'] for p in payloads} == {'Ñuñoa'}
+    assert generar_payloads(50, comunas, {'nunoa': 'RM', 'maipu': 'RM'}, qa_path=qa_path) == \
+        [{k: v for k, v in p.items() if k != 'comuna'} for p in payloads]
+
+    # Solo Maipú permitida: todas las ubicaciones caen en Maipú aunque no aparezca en la planilla
+    solo_maipu = generar_payloads(20, comunas, {'maipu': 'RM'}, qa_path=qa_path, con_comuna=True)
+    assert {p['comuna'] for p in solo_maipu} == {'Maipú'}
+
+
+def test_cuerpos_por_escenario():
+    payloads = [{'i': i} for i in range(10)]
+    siguiente = itertools.cycle(range(len(payloads)))
+    rng = np.random.default_rng(0)
+
+    individuales = cuerpos('predict', payloads, siguiente, 4, 3, 0.0, rng)
+    lotes = cuerpos('batch', payloads, siguiente, 2, 3, 0.0, rng)
+
+    assert individuales == [{'i': 0}, {'i': 1}, {'i': 2}, {'i': 3}]
+    # El ciclo es compartido: el lote sigue donde quedó el escenario anterior
+    assert lotes == [{'propiedades': [{'i': 4}, {'i': 5}, {'i': 6}]}, {'propiedades': [{'i': 7}, {'i': 8}, {'i': 9}]}]
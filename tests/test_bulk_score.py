@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bulk_score
+import serving_core
+from data_metrics import MetricasComunaCache
+
+
+class ModeloFijo:
+    def __init__(self):
+        self.filas = []
+
+    def predict_records(self, records):
+        self.filas.extend(records)
+        return np.full(len(records), 5000.0)
+
+
+@pytest.fixture
+def worker(monkeypatch, resolver_fijo, indice_fijo):
+    """Estado de un worker con recursos mínimos en lugar de los de cargar_recursos."""
+    recursos = serving_core.Recursos({'nunoa': 'Región Metropolitana de Santiago'}, resolver_fijo, indice_fijo,
+                                     MetricasComunaCache(tabla={'nunoa': (4000.0, 80.0, 10)}))
+    estado = {'recursos': recursos, 'model': ModeloFijo(), 'version': 'v1'}
+    monkeypatch.setattr(bulk_score, '_worker', estado)
+    return estado
+
+
+def test_fila_mal_formada_queda_en_su_columna_error(worker, tmp_path):
+    # La fila 1 tiene coordenadas vacías en el CSV (NaN) y la 2 una comuna numérica
+    df = pd.DataFrame({'tipo': ['departamento'] * 4,
+                       'latitud': [-33.45, np.nan, -33.46, -33.44],
+                       'longitud': [-70.6, np.nan, -70.61, -70.59],
+                       'Comuna': [None, None, 123, None]})
+
+    stats = bulk_score._puntuar_bloque(3, 300, df, str(tmp_path))
+
+    assert stats['filas'] == 4 and stats['n_ok'] == 2 and stats['n_error'] == 2
+    out = pd.read_parquet(bulk_score.ruta_parte(str(tmp_path), 3))
+    assert out['fila'].tolist() == [300, 301, 302, 303]
+    assert out['error'].isna().tolist() == [True, False, False, True]
+    assert 'latitud' in out.loc[1, 'error'] and 'Comuna' in out.loc[2, 'error']
+    assert out['prediction_uf'].isna().tolist() == [False, True, True, False]
+    assert out.loc[[0, 3], 'comuna'].tolist() == ['nunoa', 'nunoa']
+    assert out.loc[0, 'valor_promedio_propiedades_comuna'] == 4000.0
+    assert out.loc[0, 'cantidad_propiedades_comuna'] == 10
+
+
+def test_na_de_columnas_nullable_llega_como_none(worker, tmp_path):
+    # Int64 y string representan los vacíos con pd.NA, no con NaN
+    df = pd.DataFrame({'tipo': ['departamento'] * 2,
+                       'latitud': [-33.45, -33.46],
+                       'longitud': [-70.6, -70.61],
+                       'Comuna': pd.array([pd.NA, 'Ñuñoa'], dtype='string'),
+                       'dormitorios': pd.array([pd.NA, 2], dtype='Int64')})
+
+    stats = bulk_score._puntuar_bloque(0, 0, df, str(tmp_path))
+
+    assert stats['n_ok'] == 2
+    assert [f['Comuna'] for f in worker['model'].filas] == ['nunoa', 'nunoa']
+    assert worker['model'].filas[0]['dormitorios'] is None
+    # pandas < 3 deja pd.NA en to_dict('records'); se trata igual que NaN
+    assert bulk_score._nulo(pd.NA) and bulk_score._nulo(np.nan) and not bulk_score._nulo(0)
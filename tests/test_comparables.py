@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import comparables
+from comparables import ComparablesCache, IndiceComparables, KM_POR_GRADO, exportar_comparables, leer_publicaciones
+
+
+@pytest.fixture
+def publicaciones(fuentes_geo):
+    return pd.read_parquet(fuentes_geo['metrics_path'])
+
+
+def cercanos_fuerza_bruta(df: pd.DataFrame, consulta: dict, k: int) -> list:
+    # Solo ubicación, en km planos con el coseno de la latitud media de todas las publicaciones
+    cos_lat = np.cos(np.radians(df['latitud'].mean()))
+    grupo = df[df['tipo'] == consulta['tipo']]
+    d = np.hypot((grupo['latitud'] - consulta['latitud']) * KM_POR_GRADO,
+                 (grupo['longitud'] - consulta['longitud']) * KM_POR_GRADO * cos_lat)
+    return list(grupo['id'].to_numpy()[np.argsort(d.to_numpy(), kind='stable')[:k]])
+
+
+def test_sin_peso_de_atributos_es_el_vecino_mas_cercano(publicaciones):
+    indice = IndiceComparables(publicaciones, km_por_desvio=0.0)
+    rng = np.random.default_rng(3)
+    consultas = [{'tipo': tipo, 'latitud': lat, 'longitud': lon, 'superficie_util': 80}
+                 for tipo, lat, lon in zip(rng.choice(['casa', 'departamento'], 20),
+                                           rng.uniform(-33.55, -33.44, 20), rng.uniform(-70.8, -70.56, 20))]
+
+    resultado = indice.buscar_lote(consultas, k=5)
+
+    for consulta, encontrados in zip(consultas, resultado):
+        assert [c['id'] for c in encontrados] == cercanos_fuerza_bruta(publicaciones, consulta, 5)
+        assert all(c['puntaje'] == c['distancia_km'] for c in encontrados)
+
+
+def test_lote_igual_que_consultas_sueltas(publicaciones):
+    indice = IndiceComparables(publicaciones)
+    consultas = [{'tipo': 'Casa', 'latitud': -33.46, 'longitud': -70.6, 'superficie_util': 120, 'dormitorios': 3},
+                 {'tipo': 'departamento', 'latitud': -33.5, 'longitud': -70.75, 'banos': None},
+                 {'tipo': 'parcela', 'latitud': -33.5, 'longitud': -70.75}]
+
+    lote = indice.buscar_lote(consultas, k=3)
+
+    assert lote == [indice.buscar(c, k=3) for c in consultas]
+    assert lote[2] is None
+    assert all(c['tipo'] == 'casa' for c in lote[0]) and len(lote[1]) == 3
+    c = lote[0][0]
+    assert c['uf_m2'] == round(c['precio_uf'] / c['superficie_util'], 2)
+
+
+def test_atributos_acercan_publicaciones_parecidas():
+    df = pd.DataFrame({'id': [1, 2], 'tipo': 'casa', 'Comuna': 'Ñuñoa', 'latitud': [-33.45, -33.46],
+                       'longitud': [-70.6, -70.6], 'precio': [5000.0, 9000.0],
+                       'superficie_util': [60.0, 200.0], 'superficie_total': [80.0, 300.0],
+                       'dormitorios': [2.0, 4.0], 'banos': [1.0, 3.0]})
+    consulta = {'tipo': 'casa', 'latitud': -33.45, 'longitud': -70.6, 'superficie_util': 190,
+                'superficie_total': 280, 'dormitorios': 4, 'banos': 3}
+
+    assert IndiceComparables(df, km_por_desvio=0.0).buscar(consulta, k=1)[0]['id'] == 1
+    assert IndiceComparables(df, km_por_desvio=5.0).buscar(consulta, k=1)[0]['id'] == 2
+
+
+def test_k_limitado(publicaciones, monkeypatch):
+    monkeypatch.setattr(comparables, 'COMPARABLES_K_MAX', 4)
+    indice = IndiceComparables(publicaciones.head(3))
+    consulta = {'tipo': publicaciones['tipo'].iloc[0], 'latitud': -33.5, 'longitud': -70.7}
+
+    assert len(indice.buscar(consulta, k=100)) == min(4, indice.stats()['por_tipo'][consulta['tipo']])
+    assert len(IndiceComparables(publicaciones).buscar(consulta, k=100)) == 4
+
+
+def test_dtypes_compactos_y_exportacion(publicaciones, tmp_path):
+    compacto = publicaciones.drop(columns=['URL']).astype({'latitud': 'float32', 'longitud': 'float32',
+                                                            'dormitorios': 'Int16', 'tipo': 'category'})
+    compacto.loc[0, 'dormitorios'] = pd.NA
+    origen = str(tmp_path / 'df_metrics.parquet')
+    compacto.to_parquet(origen)
+    destino = str(tmp_path / 'comparables.parquet')
+
+    exportar_comparables(origen, destino)
+
+    exportado = leer_publicaciones(destino)
+    assert 'URL' not in exportado and exportado['dormitorios'].dtype == float and np.isnan(exportado['dormitorios'][0])
+    consulta = {'tipo': 'casa', 'latitud': -33.46, 'longitud': -70.6, 'dormitorios': 2}
+    encontrado = IndiceComparables(exportado).buscar(consulta)[0]
+    assert 'url' not in encontrado and isinstance(encontrado['id'], int)
+
+
+def test_cache_se_reconstruye_si_cambia_el_archivo(publicaciones, tmp_path):
+    path = str(tmp_path / 'df_metrics.parquet')
+    publicaciones.to_parquet(path)
+    cache = ComparablesCache(path)
+    indice = cache.get()
+    assert cache.get() is indice and indice.n == len(publicaciones)
+
+    publicaciones.head(10).to_parquet(path)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert cache.get().n == 10
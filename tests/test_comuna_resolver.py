@@ -0,0 +1,59 @@
+import pickle
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from comuna_resolver import ComunaResolver
+
+
+@pytest.fixture
+def comunas_gdf():
+    # Polígonos irregulares y contiguos, para que la grilla tenga celdas de borde
+    centro = shapely.Point(-70.65, -33.47).buffer(0.06)
+    oriente = shapely.Polygon([(-70.60, -33.52), (-70.52, -33.50), (-70.55, -33.42), (-70.61, -33.44)]).difference(centro)
+    return gpd.GeoDataFrame({'Comuna': ['Santiago', 'Ñuñoa'], 'Region': ['RM', 'RM']},
+                            geometry=[centro, oriente], crs="EPSG:4326")
+
+
+@pytest.fixture
+def puntos():
+    rng = np.random.default_rng(4)
+    return rng.uniform(-33.56, -33.38, 2000), rng.uniform(-70.74, -70.50, 2000)
+
+
+def comunas_sjoin(comunas_gdf, lats, lons) -> list:
+    # Método original: sjoin de los puntos contra los polígonos
+    pts = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lons, lats), crs="EPSG:4326")
+    joined = gpd.sjoin(pts, comunas_gdf, how='left', predicate='within')
+    joined = joined[~joined.index.duplicated()]
+    return [c if isinstance(c, str) else None for c in joined['Comuna']]
+
+
+@pytest.mark.parametrize('grid_res', [None, 0.01, 0.002])
+def test_resolver_igual_que_sjoin(comunas_gdf, puntos, grid_res):
+    lats, lons = puntos
+    resolver = ComunaResolver(comunas_gdf, grid_res=grid_res)
+
+    assert resolver.comunas(lats, lons) == comunas_sjoin(comunas_gdf, lats, lons)
+
+
+def test_grilla_solo_marca_celdas_completamente_dentro(comunas_gdf):
+    resolver = ComunaResolver(comunas_gdf, grid_res=0.01)
+    minx, miny, _, _ = resolver.grid_bounds
+    jj, ii = np.nonzero(resolver.grid >= 0)
+    assert len(jj) > 0 and (resolver.grid < 0).any()
+    celdas = shapely.box(minx + ii * 0.01, miny + jj * 0.01, minx + (ii + 1) * 0.01, miny + (jj + 1) * 0.01)
+    assert shapely.contains(resolver.geoms[resolver.grid[jj, ii]], celdas).all()
+
+
+def test_resolver_serializado_y_atributos(comunas_gdf, puntos):
+    lats, lons = puntos
+    resolver = pickle.loads(pickle.dumps(ComunaResolver(comunas_gdf.to_crs(epsg=32719), grid_res=0.01)))
+
+    out = resolver.resolver(lats, lons)
+
+    assert [c if isinstance(c, str) else None for c in out['Comuna']] == comunas_sjoin(comunas_gdf, lats, lons)
+    assert (out['Region'].notna() == out['Comuna'].notna()).all()
+    assert (out['index_right'].isna() == out['Comuna'].isna()).all()
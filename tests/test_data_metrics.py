@@ -0,0 +1,58 @@
+import os
+
+import pandas as pd
+import pytest
+
+from data_metrics import MetricasComunaCache, metricas_comuna, tabla_metricas
+from utils import normalize_str
+
+
+@pytest.fixture
+def df_metrics(tmp_path):
+    path = str(tmp_path / 'df_metrics.parquet')
+    pd.DataFrame({'Comuna': ['Ñuñoa', 'Ñuñoa', 'Ñuñoa', 'Maipú', 'Maipú', 'ñuñoa'],
+                  'precio': [5000.0, 7000.0, 6500.0, 3000.0, 3400.0, 99999.0],
+                  'superficie_util': [80.0, 100.0, 90.0, 60.0, 70.0, 10.0],
+                  'URL': ['u'] * 6}).to_parquet(path)
+    return path
+
+
+def metricas_filtrando(path: str, comuna: str):
+    # Cálculo original por request: agregar todo, normalizar cada fila y filtrar
+    df = metricas_comuna(path)
+    fila = df[df['Comuna'].apply(normalize_str) == comuna]
+    if fila.empty:
+        return None
+    return tuple(fila.iloc[0][['avg_price_uf', 'superficie', 'n_properties']])
+
+
+def test_tabla_igual_que_filtrar_el_dataframe(df_metrics):
+    tabla = tabla_metricas(df_metrics)
+
+    assert set(tabla) == {'nunoa', 'maipu'}
+    for comuna in ('nunoa', 'maipu', 'providencia'):
+        assert tabla.get(comuna) == metricas_filtrando(df_metrics, comuna)
+    assert tabla['nunoa'] == (6500.0, 90.0, 3)
+
+
+def test_cache_se_recalcula_si_cambia_el_archivo(df_metrics):
+    cache = MetricasComunaCache(df_metrics)
+    assert cache.get('maipu') == (3200.0, 65.0, 2)
+
+    pd.DataFrame({'Comuna': ['Maipú'], 'precio': [4000.0], 'superficie_util': [50.0]}).to_parquet(df_metrics)
+    st = os.stat(df_metrics)
+    os.utime(df_metrics, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert cache.get('maipu') == (4000.0, 50.0, 1)
+    assert cache.get('nunoa') is None
+
+
+def test_tabla_fija_hasta_invalidate(df_metrics):
+    cache = MetricasComunaCache(df_metrics, tabla={'maipu': (1.0, 2.0, 3)})
+    assert cache.get('maipu') == (1.0, 2.0, 3)
+
+    cache.invalidate()
+    assert cache.get('maipu') == (3200.0, 65.0, 2)
+
+    cache.set_tabla({'maipu': (4.0, 5.0, 6)})
+    assert cache.get('maipu') == (4.0, 5.0, 6)
@@ -0,0 +1,52 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from comuna_resolver import ComunaResolver
+from distance_tiles import DistanceTiles
+from spatial_index import SpatialIndexRegistry
+
+
+@pytest.fixture(scope='module')
+def comunas():
+    return ComunaResolver(gpd.GeoDataFrame(
+        {'Comuna': ['Ñuñoa', 'Providencia']},
+        geometry=[shapely.box(-70.62, -33.48, -70.56, -33.44), shapely.box(-70.64, -33.44, -70.58, -33.40)],
+        crs="EPSG:4326"))
+
+
+def capas(rng):
+    def puntos(n):
+        return gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(-70.7, -70.5, n), rng.uniform(-33.5, -33.38, n)),
+                                crs="EPSG:4326")
+    metro = gpd.GeoDataFrame(geometry=[shapely.LineString([(-70.66, -33.45), (-70.60, -33.43), (-70.55, -33.41)])],
+                             crs="EPSG:4326")
+    return {'salud': puntos(30), 'comisarias': puntos(8), 'metro': metro}
+
+
+@pytest.mark.parametrize('modo', ['planar', 'geodesic'])
+def test_interpolacion_dentro_de_la_cota(comunas, modo):
+    rng = np.random.default_rng(0)
+    layers = capas(rng)
+    indice = SpatialIndexRegistry.from_layers(layers, modes={name: modo for name in layers})
+    teselas = DistanceTiles.construir(indice, comunas, res=0.004, tile=4)
+
+    lats, lons = rng.uniform(-33.48, -33.40, 2000), rng.uniform(-70.64, -70.56, 2000)
+    puntos = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lons, lats), crs="EPSG:4326")
+    interpoladas = teselas.distancias(lats, lons, list(layers))
+    for name in layers:
+        exactas = indice.nearest_km(name, puntos)
+        assert np.isfinite(interpoladas[name]).all()
+        assert np.abs(interpoladas[name] - exactas).max() <= teselas.cota_km
+
+
+def test_puntos_fuera_de_los_bloques_usan_el_indice_exacto(comunas):
+    layers = capas(np.random.default_rng(1))
+    indice = SpatialIndexRegistry.from_layers(layers)
+    teselas = DistanceTiles.construir(indice, comunas, res=0.004, tile=4)
+
+    lats, lons = np.array([-33.0, -33.45]), np.array([-71.5, -70.59])
+    puntos = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lons, lats), crs="EPSG:4326")
+    assert np.isnan(teselas.interpolar('salud', lats, lons)[0])
+    assert teselas.nearest_km('salud', puntos)[0] == indice.nearest_km('salud', puntos)[0]
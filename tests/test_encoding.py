@@ -0,0 +1,118 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from catboost import CatBoostRegressor
+from lightgbm import LGBMRegressor
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import cross_val_score
+from sklearn.pipeline import Pipeline
+
+import encoding
+import model
+from fast_inference import compilar_pipeline
+
+
+@pytest.fixture
+def modo_nativo(monkeypatch):
+    monkeypatch.setattr(encoding, 'ENCODING_MODE', 'native')
+    monkeypatch.setattr(model, 'ENCODING_MODE', 'native')
+    # Los tres candidatos de siempre, chicos para que la prueba sea rápida
+    monkeypatch.setattr(model, 'models', {
+        'LightGBM': LGBMRegressor(n_estimators=20, random_state=42, verbose=-1),
+        'CatBoost': CatBoostRegressor(iterations=20, verbose=0, random_state=42, allow_writing_files=False),
+        'Random Forest': RandomForestRegressor(n_estimators=10, random_state=42),
+    })
+
+
+def nuevas(df):
+    # Una comuna que no estaba en el entrenamiento y una fila sin comuna
+    filas = df.drop(columns='precio').head(2).copy()
+    filas['Comuna'] = ['vitacura', None]
+    return filas
+
+
+def test_los_tres_modelos_nativos_predicen_comunas_desconocidas(df_propiedades, modo_nativo):
+    X, y = df_propiedades.drop(columns='precio'), df_propiedades['precio']
+    preproc = model.preparar_datos_para_modelo(df_propiedades)[-1]
+    for name, (estimador, pre) in model.configurar_candidatos(preproc).items():
+        pipe = Pipeline([('preprocessor', pre), ('model', estimador)]).fit(X, y)
+        pred = pipe.predict(nuevas(df_propiedades))
+        assert np.isfinite(pred).all(), name
+
+
+def test_entrenamiento_nativo_completo(df_propiedades, modo_nativo, tmp_path):
+    model_path = str(tmp_path / 'modelo_valoracion.pkl')
+    results, best = model.entrenar_y_guardar_modelo(df_propiedades, model_path)
+    assert set(results) == {'LightGBM', 'CatBoost', 'Random Forest'}
+    assert np.isfinite(joblib.load(model_path).predict(nuevas(df_propiedades))).all()
+
+
+def test_catboost_recibe_texto_con_centinela():
+    categoria = encoding.ACategoria(como_texto=True).fit(pd.DataFrame({'Comuna': ['nunoa', 'maipu']}))
+    salida = categoria.transform(pd.DataFrame({'Comuna': ['maipu', 'vitacura', np.nan]}))
+    assert salida['Comuna'].tolist() == ['maipu', encoding.CATEGORIA_DESCONOCIDA, encoding.CATEGORIA_DESCONOCIDA]
+
+
+def columnas(df):
+    X = df.drop(columns='precio')
+    return X, X.select_dtypes(include='number').columns.tolist(), ['tipo', 'Comuna', 'Region', 'divisa']
+
+
+def test_onehot_disperso_igual_que_denso(df_propiedades):
+    X, num_cols, cat_cols = columnas(df_propiedades)
+
+    denso = encoding.construir_preprocesador(num_cols, cat_cols, 'onehot').fit_transform(X)
+    disperso = encoding.construir_preprocesador(num_cols, cat_cols, 'sparse').fit_transform(X)
+
+    assert sparse.issparse(disperso) and not sparse.issparse(denso)
+    np.testing.assert_array_equal(disperso.toarray(), denso)
+
+
+def pipeline(codificacion, estimador, num_cols, cat_cols):
+    return Pipeline([('preprocessor', encoding.construir_preprocesador(num_cols, cat_cols, codificacion)),
+                     ('model', estimador)])
+
+
+def test_lightgbm_con_onehot_disperso_predice_igual(df_propiedades):
+    X, num_cols, cat_cols = columnas(df_propiedades)
+    y = df_propiedades['precio']
+    predicciones = {}
+    for codificacion in ('onehot', 'sparse'):
+        pipe = pipeline(codificacion, LGBMRegressor(n_estimators=20, random_state=0, verbose=-1), num_cols, cat_cols)
+        predicciones[codificacion] = pipe.fit(X, y).predict(X)
+        # El modelo compilado de serving también acepta la variante dispersa
+        np.testing.assert_allclose(compilar_pipeline(pipe).predict_records(X.to_dict('records')),
+                                   predicciones[codificacion], rtol=1e-6)
+    np.testing.assert_allclose(predicciones['sparse'], predicciones['onehot'], rtol=1e-9)
+
+
+def test_random_forest_con_onehot_disperso_rinde_igual(df_propiedades):
+    # El splitter disperso de sklearn desempata distinto: mismos resultados en calidad, no árbol a árbol
+    X, num_cols, cat_cols = columnas(df_propiedades)
+    y = df_propiedades['precio']
+    r2 = {codificacion: cross_val_score(pipeline(codificacion, RandomForestRegressor(n_estimators=10, random_state=0),
+                                                 num_cols, cat_cols), X, y, cv=3, scoring='r2').mean()
+          for codificacion in ('onehot', 'sparse')}
+    assert r2['sparse'] == pytest.approx(r2['onehot'], abs=0.005)
+
+
+def test_codificacion_por_modelo():
+    lgbm, cat, rf = LGBMRegressor(), CatBoostRegressor(), RandomForestRegressor()
+    assert [encoding.codificacion_para(m, 'onehot') for m in (lgbm, cat, rf)] == ['onehot'] * 3
+    assert [encoding.codificacion_para(m, 'sparse') for m in (lgbm, cat, rf)] == ['sparse'] * 3
+    assert [encoding.codificacion_para(m, 'native') for m in (lgbm, cat, rf)] == ['native', 'native', 'sparse']
+    with pytest.raises(ValueError):
+        encoding.codificacion_para(rf, 'ordinal')
+
+
+def test_lightgbm_nativo_recibe_category(df_propiedades):
+    X, num_cols, cat_cols = columnas(df_propiedades)
+
+    salida = encoding.construir_preprocesador(num_cols, cat_cols, 'native').fit_transform(X)
+
+    assert list(salida.columns) == num_cols + cat_cols
+    assert all(isinstance(salida[col].dtype, pd.CategoricalDtype) for col in cat_cols)
+    # Una comuna no vista queda como faltante
+    assert encoding.ACategoria().fit(X[['Comuna']]).transform(pd.DataFrame({'Comuna': ['vitacura']}))['Comuna'].isna().all()
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import train_model
+from comparables import IndiceComparables, leer_publicaciones
+from data_metrics import tabla_metricas
+from esquema import ESQUEMA, columnas_df_metrics, compactar, memoria_mb
+
+
+def test_compactar_aplica_el_esquema():
+    df = pd.DataFrame({'dormitorios': ['3', 2.6, 'sin dato', 99999, None], 'tipo': ['casa', 'depto', 'casa', None, 'casa'],
+                       'precio': ['5000', 1.5, None, 'x', 7e3], 'latitud': [-33.4] * 5, 'URL': ['u'] * 5})
+
+    out = compactar(df)
+
+    assert out['dormitorios'].dtype == 'Int16'
+    assert out['dormitorios'].tolist() == [3, 3, pd.NA, pd.NA, pd.NA]
+    assert out['tipo'].dtype == 'category' and out['precio'].dtype == 'float32'
+    np.testing.assert_array_equal(out['precio'], np.array([5000, 1.5, np.nan, np.nan, 7000], dtype='float32'))
+    # Sin esquema o en float64 a propósito: sin cambios
+    assert out['latitud'].dtype == 'float64' and out['URL'].dtype == df['URL'].dtype
+    assert df['dormitorios'].dtype == object
+    assert compactar(pd.DataFrame()).empty
+
+
+def test_compactar_despues_de_concat_recupera_las_categorias():
+    a = compactar(pd.DataFrame({'Comuna': ['Ñuñoa', 'Maipú'], 'precio': [1.0, 2.0]}))
+    b = compactar(pd.DataFrame({'Comuna': ['Santiago'], 'precio': [3.0]}))
+    unidos = pd.concat([a, b], ignore_index=True)
+    assert unidos['Comuna'].dtype != 'category'
+
+    out = compactar(unidos)
+
+    assert out['Comuna'].dtype == 'category' and out['Comuna'].tolist() == ['Ñuñoa', 'Maipú', 'Santiago']
+    assert all(str(out[c].dtype) == ESQUEMA[c] for c in out.columns)
+
+
+@pytest.fixture
+def crudos():
+    """Filas como las de witness_scrapper, con texto libre y números como texto."""
+    rng = np.random.default_rng(0)
+    n = 30
+    return pd.DataFrame({
+        'id': np.arange(n), 'divisa': rng.choice(['UF', '$'], n), 'precio': rng.uniform(1000, 9000, n),
+        'desc': [f"casa con {i % 4 + 1} dormitorios y {i % 3} estacionamientos" for i in range(n)],
+        'tipo': rng.choice(['casa', 'departamento'], n),
+        'superficie_total': [f"{v:.0f} m2" for v in rng.uniform(40, 300, n)],
+        'superficie_util': rng.uniform(30, 200, n),
+        'dormitorios': [None if i % 5 == 0 else str(i % 4 + 1) for i in range(n)],
+        'banos': rng.integers(1, 4, n).astype(float), 'estacionamientos': [None] * n,
+        'antiguedad': rng.choice([5.0, 2010.0], n),
+        'latitud': rng.uniform(-33.6, -33.3, n), 'longitud': rng.uniform(-70.8, -70.5, n),
+    })
+
+
+def test_limpiar_compacto_da_los_mismos_valores(crudos, monkeypatch):
+    monkeypatch.setattr(train_model, 'TRAIN_COMPACT_DTYPES', False)
+    original = train_model.limpiar(crudos.copy())
+    monkeypatch.setattr(train_model, 'TRAIN_COMPACT_DTYPES', True)
+    compacto = train_model.limpiar(crudos.copy())
+
+    assert 'desc' not in compacto and 'desc' in original
+    assert memoria_mb(compacto) < memoria_mb(original)
+    for col in compacto.columns:
+        esperado = pd.to_numeric(original[col], errors='coerce') if col in ESQUEMA and ESQUEMA[col] != 'category' \
+            else original[col]
+        if compacto[col].dtype == 'category':
+            assert compacto[col].astype(object).tolist() == esperado.tolist()
+        else:
+            np.testing.assert_allclose(compacto[col].astype(float), esperado.astype(float), rtol=1e-6)
+
+
+def test_df_metrics_recortado_sirve_igual(fuentes_geo, tmp_path):
+    completo = pd.read_parquet(fuentes_geo['metrics_path']).assign(desc='texto largo', name='aviso')
+    recortado = compactar(columnas_df_metrics(completo))
+    path_completo, path_recortado = str(tmp_path / 'completo.parquet'), str(tmp_path / 'recortado.parquet')
+    completo.to_parquet(path_completo)
+    recortado.to_parquet(path_recortado)
+
+    assert 'desc' not in recortado and 'name' not in recortado
+    esperado = tabla_metricas(path_completo)
+    obtenido = tabla_metricas(path_recortado)
+    assert set(obtenido) == set(esperado)
+    for comuna, metricas in esperado.items():
+        assert obtenido[comuna] == pytest.approx(metricas)
+    consulta = {'tipo': 'casa', 'latitud': -33.46, 'longitud': -70.6, 'superficie_util': 90}
+    assert [c['id'] for c in IndiceComparables(leer_publicaciones(path_recortado)).buscar(consulta, k=5)] == \
+        [c['id'] for c in IndiceComparables(leer_publicaciones(path_completo)).buscar(consulta, k=5)]
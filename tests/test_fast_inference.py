@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from lightgbm import LGBMRegressor
+from sklearn.pipeline import Pipeline
+
+from encoding import construir_preprocesador
+from fast_inference import compilar_pipeline
+
+
+@pytest.fixture
+def modelos(df_propiedades):
+    X, y = df_propiedades.drop(columns='precio'), df_propiedades['precio']
+    num_cols = X.select_dtypes(include='number').columns.tolist()
+    cat_cols = X.select_dtypes(include=['object', 'category', 'string']).columns.tolist()
+    pipe = Pipeline([('preprocessor', construir_preprocesador(num_cols, cat_cols, 'onehot')),
+                     ('model', LGBMRegressor(n_estimators=20, verbose=-1, random_state=0))])
+    pipe.fit(X, y)
+    return pipe, compilar_pipeline(pipe), X
+
+
+def test_compilado_reproduce_pipeline(modelos):
+    pipe, compilado, X = modelos
+    np.testing.assert_allclose(compilado.predict_records(X.to_dict('records')), pipe.predict(X), rtol=1e-6)
+
+
+def test_columna_ausente_es_error_en_ambos(modelos):
+    pipe, compilado, X = modelos
+    sin_tipo = X.drop(columns='tipo')
+    with pytest.raises(ValueError, match='tipo'):
+        pipe.predict(sin_tipo.head(1))
+    with pytest.raises(ValueError, match='tipo'):
+        compilado.predict_records(sin_tipo.head(1).to_dict('records'))
+    with pytest.raises(ValueError, match='tipo'):
+        compilado.predict(sin_tipo.head(1))
+    # Basta con que falte en una fila del lote
+    registros = X.head(3).to_dict('records')
+    del registros[1]['tipo']
+    with pytest.raises(ValueError, match='tipo'):
+        compilado.predict_records(registros)
+
+
+def test_nulo_explicito_se_imputa_en_ambos(modelos):
+    pipe, compilado, X = modelos
+    fila = X.head(1).copy()
+    fila['tipo'] = None
+    fila['superficie_util'] = np.nan
+    np.testing.assert_allclose(compilado.predict_records(fila.to_dict('records')), pipe.predict(fila), rtol=1e-6)
@@ -0,0 +1,55 @@
+import geopandas as gpd
+import pandas as pd
+
+from feature_store import FeatureStore
+
+
+def tabla(fechas: dict) -> pd.DataFrame:
+    """Columnas id y fecha_modificacion, como las consulta train_model.py."""
+    return pd.DataFrame({'id': list(fechas), 'fecha_modificacion': pd.to_datetime(list(fechas.values()))})
+
+
+def procesadas(ids, valor) -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame({'id': ids, 'precio': [valor] * len(ids)},
+                            geometry=gpd.points_from_xy([-70.6] * len(ids), [-33.45] * len(ids)), crs="EPSG:4326")
+
+
+def test_solo_se_procesa_lo_nuevo_o_modificado(tmp_path):
+    store = FeatureStore(str(tmp_path / 'fs'), 'ctx')
+    v1 = tabla({1: '2025-01-01', 2: '2025-01-01', 3: '2025-01-01'})
+    assert store.pendientes(v1).tolist() == [1, 2, 3]
+    store.agregar(procesadas([1, 2, 3], 100.0), v1)
+    assert store.pendientes(v1).tolist() == []
+
+    # 2 se modifica, 3 se borra de la tabla y 4 es nuevo
+    v2 = tabla({1: '2025-01-01', 2: '2025-02-01', 4: '2025-02-01'})
+    pendientes = store.pendientes(v2)
+    assert sorted(pendientes.tolist()) == [2, 4]
+    store.agregar(procesadas(pendientes.tolist(), 200.0), v2)
+
+    df = store.leer(v2['id'])
+    assert df['id'].tolist() == [1, 2, 4]
+    assert df['precio'].tolist() == [100.0, 200.0, 200.0]
+    assert isinstance(df, gpd.GeoDataFrame) and '_fecha_origen' not in df
+    assert store.pendientes(v2).tolist() == []
+
+
+def test_compacta_con_demasiadas_partes(tmp_path):
+    store = FeatureStore(str(tmp_path / 'fs'), 'ctx', max_partes=2)
+    actuales = tabla({i: '2025-01-01' for i in range(3)})
+    for i in range(3):
+        store.agregar(procesadas([i], float(i)), actuales)
+    assert len(store.partes()) == 3
+
+    antes = store.leer(actuales['id'])
+    assert len(store.partes()) == 1
+    pd.testing.assert_frame_equal(store.leer(actuales['id']), antes)
+    assert store.pendientes(actuales).tolist() == []
+
+
+def test_otro_contexto_reconstruye_el_store(tmp_path):
+    actuales = tabla({1: '2025-01-01'})
+    FeatureStore(str(tmp_path / 'fs'), 'ctx').agregar(procesadas([1], 1.0), actuales)
+    assert FeatureStore(str(tmp_path / 'fs'), 'ctx').pendientes(actuales).tolist() == []
+    assert FeatureStore(str(tmp_path / 'fs'), 'otras-capas').vacio
+    assert FeatureStore(str(tmp_path / 'fs'), 'otras-capas', reiniciar=True).pendientes(actuales).tolist() == [1]
@@ -0,0 +1,36 @@
+import pytest
+
+from features import preparar_lote, DISTANCE_FEATURES, ERROR_FUERA_LIMITES
+
+
+REGIONES = {'nunoa': 'Región Metropolitana de Santiago'}
+VALIDO = {'tipo': 'departamento', 'latitud': -33.45, 'longitud': -70.6}
+
+
+@pytest.fixture
+def preparar(resolver_fijo, indice_fijo):
+    return lambda items: preparar_lote(items, resolver_fijo, REGIONES, indice_fijo)
+
+
+def test_lote_valido(preparar):
+    features, errores = preparar([VALIDO, {**VALIDO, 'Comuna': 'Ñuñoa'}])
+    assert errores == [None, None]
+    for f in features:
+        assert f['Comuna'] == 'nunoa' and f['divisa'] == 'UF'
+        assert all(f[col] == 1.5 for col in DISTANCE_FEATURES)
+
+
+def test_un_elemento_invalido_no_afecta_al_resto(preparar):
+    items = [VALIDO, {**VALIDO, 'Comuna': 123}, {**VALIDO, 'latitud': float('nan')},
+             {**VALIDO, 'longitud': float('inf')}, {**VALIDO, 'latitud': 'x'}, 'no es objeto',
+             {'tipo': 'casa'}, {**VALIDO, 'latitud': 10.0}, {**VALIDO, 'Comuna': 'Arica'}, VALIDO]
+    features, errores = preparar(items)
+    assert errores[0] is None and errores[-1] is None
+    assert features[0]['distancia_metro_km'] == 1.5 and features[-1]['Comuna'] == 'nunoa'
+    assert 'texto' in errores[1]
+    assert 'finitos' in errores[2] and 'finitos' in errores[3]
+    assert 'numéricas' in errores[4]
+    assert errores[5] and errores[6]
+    assert errores[7] == ERROR_FUERA_LIMITES
+    assert 'arica' in errores[8]
+    assert all(features[i] is None for i in range(1, 9))
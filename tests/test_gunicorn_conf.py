@@ -0,0 +1,29 @@
+import gc
+import importlib.util
+import os
+
+import pytest
+
+
+@pytest.fixture
+def conf(monkeypatch):
+    monkeypatch.delenv('GUNICORN_PRELOAD', raising=False)
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', path)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def test_preload_por_defecto(conf):
+    assert conf.preload_app is True
+
+
+def test_pre_fork_congela_los_objetos_cargados(conf):
+    cargado = [object() for _ in range(100)]
+    try:
+        conf.pre_fork(None, None)
+        # Lo cargado antes del fork queda en la generación permanente, fuera del GC de los workers
+        assert gc.get_freeze_count() >= len(cargado)
+    finally:
+        gc.unfreeze()
@@ -0,0 +1,110 @@
+import json
+import os
+import time
+
+import instrumentation
+from instrumentation import PerfiladorMuestreo, Registro
+
+
+def registro_de_prueba(multiproc_dir: str = '') -> Registro:
+    registro = Registro(multiproc_dir)
+    registro.definir('stage_seconds', 'histogram', 'Etapas.', (0.01, 0.1))
+    registro.definir('requests_total', 'counter', 'Requests.')
+    return registro
+
+
+def lineas(texto: str, prefijo: str) -> list:
+    return [linea for linea in texto.splitlines() if linea.startswith(prefijo)]
+
+
+def test_histograma_acumulado_en_formato_prometheus():
+    registro = registro_de_prueba()
+    for valor in (0.005, 0.05, 0.05, 3.0):
+        registro.observar('stage_seconds', valor, stage='modelo')
+    registro.incrementar('requests_total', endpoint='/predict', status='200')
+    registro.incrementar('requests_total', endpoint='/predict', status='200')
+
+    texto = registro.exponer()
+
+    assert '# TYPE valuaciones_stage_seconds histogram' in texto
+    assert lineas(texto, 'valuaciones_stage_seconds_') == [
+        'valuaciones_stage_seconds_bucket{stage="modelo",le="0.01"} 1',
+        'valuaciones_stage_seconds_bucket{stage="modelo",le="0.1"} 3',
+        'valuaciones_stage_seconds_bucket{stage="modelo",le="+Inf"} 4',
+        'valuaciones_stage_seconds_sum{stage="modelo"} 3.105',
+        'valuaciones_stage_seconds_count{stage="modelo"} 4',
+    ]
+    assert 'valuaciones_requests_total{endpoint="/predict",status="200"} 2' in texto
+    assert registro.resumen('stage_seconds') == {'stage=modelo': {'n': 4, 'segundos': 3.105}}
+
+
+def test_gauges_de_colectores_y_colector_que_falla():
+    registro = registro_de_prueba()
+    registro.colector(lambda: [('model_info', 'gauge', 'Versión.', [({'version': 'v"1'}, 1)])])
+
+    @registro.colector
+    def roto():
+        raise RuntimeError('sin datos')
+
+    texto = registro.exponer()
+
+    assert 'valuaciones_model_info{version="v\\"1"} 1' in texto
+
+
+def test_varios_procesos_suman_contadores_y_omiten_gauges_de_muertos(tmp_path):
+    registro = registro_de_prueba(str(tmp_path))
+    registro.colector(lambda: [('cache_size', 'gauge', 'Tamaño.', [({'cache': 'prediction'}, 5)])])
+    registro.incrementar('requests_total', endpoint='/predict', status='200')
+    # Volcado de un worker que ya terminó (pid inexistente)
+    muerto = registro_de_prueba()
+    muerto.incrementar('requests_total', 3, endpoint='/predict', status='200')
+    muerto.observar('stage_seconds', 0.05, stage='bd')
+    with open(tmp_path / 'metricas-999999999.json', 'w', encoding='utf-8') as f:
+        json.dump({'pid': 999999999, 'metricas': muerto._snapshot(),
+                   'gauges': [['cache_size', 'gauge', 'Tamaño.', [[[['cache', 'prediction']], 99]]]]}, f)
+
+    texto = registro.exponer()
+
+    assert 'valuaciones_requests_total{endpoint="/predict",status="200"} 4' in texto
+    assert 'valuaciones_stage_seconds_count{stage="bd"} 1' in texto
+    assert lineas(texto, 'valuaciones_cache_size') == [f'valuaciones_cache_size{{cache="prediction",pid="{os.getpid()}"}} 5']
+
+    instrumentation.limpiar_multiproceso(str(tmp_path))
+    assert not list(tmp_path.glob('metricas-*.json'))
+
+
+def test_etapas_del_request():
+    instrumentation.iniciar_request()
+    with instrumentation.etapa('comuna'):
+        pass
+    with instrumentation.etapa('modelo'):
+        pass
+
+    assert [nombre for nombre, _ in instrumentation.etapas_request()] == ['comuna', 'modelo']
+    # Fuera de un request no se acumulan
+    with instrumentation.etapa('modelo'):
+        pass
+    assert instrumentation.etapas_request() == []
+
+
+def request_lento(segundos: float):
+    fin = time.perf_counter() + segundos
+    while time.perf_counter() < fin:
+        pass
+
+
+def test_perfilador_solo_guarda_requests_lentos(tmp_path):
+    perfilador = PerfiladorMuestreo(umbral_ms=50, intervalo_ms=1, directorio=str(tmp_path))
+
+    perfilador.iniciar()
+    t0 = time.perf_counter()
+    request_lento(0.2)
+    path = perfilador.terminar('/predict', time.perf_counter() - t0)
+
+    assert path is not None and path.endswith('.folded')
+    with open(path, encoding='utf-8') as f:
+        pilas = f.read()
+    assert 'request_lento' in pilas
+
+    perfilador.iniciar()
+    assert perfilador.terminar('/predict', 0.001) is None
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from lightgbm import LGBMRegressor
+from sklearn.dummy import DummyRegressor
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold, cross_val_predict
+from sklearn.pipeline import Pipeline
+
+import model
+
+
+@pytest.fixture
+def candidatos():
+    return {'LightGBM': LGBMRegressor(n_estimators=20, random_state=42, verbose=-1),
+            'Random Forest': RandomForestRegressor(n_estimators=10, random_state=42),
+            'Lineal': LinearRegression()}
+
+
+@pytest.mark.parametrize('estrategia', ['full', 'halving'])
+def test_presupuesto_vencido_antes_del_primer_fold(df_propiedades, candidatos, estrategia):
+    X_train, _, y_train, _, preproc = model.preparar_datos_para_modelo(df_propiedades)
+    results, best = model.seleccionar_modelo(X_train, y_train, preproc, cv=3, candidatos=candidatos,
+                                             estrategia=estrategia, presupuesto_s=1e-9, workers=1, hilos=1)
+    assert set(results) == set(candidatos)
+    assert best in results and np.isfinite(results[best]['rmse'])
+
+
+def evaluar_cv_original(X, y, preprocessor, candidatos, cv):
+    # evaluar_modelo_cv original: cross_val_predict secuencial, refit del ColumnTransformer por fold
+    kf = KFold(n_splits=cv, shuffle=True, random_state=42)
+    results = {}
+    for name, estimador in candidatos.items():
+        y_pred = cross_val_predict(Pipeline([('preproc', preprocessor), ('model', estimador)]), X, y, cv=kf)
+        results[name] = {'rmse': np.sqrt(mean_squared_error(y, y_pred)), 'r2': r2_score(y, y_pred),
+                         'mape': np.mean(np.abs((y - y_pred) / y)) * 100}
+    return results
+
+
+def test_full_cv_igual_que_la_evaluacion_original(df_propiedades, candidatos):
+    X_train, _, y_train, _, preproc = model.preparar_datos_para_modelo(df_propiedades)
+
+    results, best = model.seleccionar_modelo(X_train, y_train, preproc, cv=3, candidatos=candidatos,
+                                             estrategia='full', presupuesto_s=0, workers=2, hilos=1)
+
+    esperado = evaluar_cv_original(X_train, y_train, preproc, candidatos, cv=3)
+    assert set(results) == set(esperado)
+    for name in esperado:
+        for metrica in ('rmse', 'r2', 'mape'):
+            assert results[name][metrica] == pytest.approx(esperado[name][metrica], rel=1e-6), (name, metrica)
+    assert best == min(esperado, key=lambda m: esperado[m]['rmse'])
+
+
+def test_rondas_de_halving():
+    assert model._rondas(5, 'full') == [[0, 1, 2, 3, 4]]
+    assert model._rondas(5, 'halving') == [[0], [1], [2, 3], [4]]
+    with pytest.raises(ValueError):
+        model._rondas(5, 'otra')
+
+
+def test_halving_descarta_a_los_peores(df_propiedades, candidatos):
+    X_train, _, y_train, _, preproc = model.preparar_datos_para_modelo(df_propiedades)
+    candidatos = {**candidatos, 'Media': DummyRegressor()}
+
+    results, best = model.seleccionar_modelo(X_train, y_train, preproc, cv=4, candidatos=candidatos,
+                                             estrategia='halving', presupuesto_s=0, workers=2, hilos=1)
+
+    # La media queda fuera tras el primer fold pero conserva sus métricas parciales
+    assert set(results) == set(candidatos)
+    assert best != 'Media'
+    assert results['Media']['rmse'] > results[best]['rmse']
+
+
+def test_presupuesto_cpu_no_sobresuscribe(monkeypatch):
+    monkeypatch.setattr(model.os, 'cpu_count', lambda: 8)
+    assert model.presupuesto_cpu(15) == (8, 1)
+    assert model.presupuesto_cpu(3) == (3, 2)
+    assert model.presupuesto_cpu(15, workers=2) == (2, 4)
+    assert model.con_hilos(LGBMRegressor(n_jobs=-1), 2).get_params()['n_jobs'] == 2
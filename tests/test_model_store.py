@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+import model_store
+from model_store import ModelHolder
+
+
+def publicar(version, models_dir):
+    # publicar_version exige que exista el modelo de la versión
+    os.makedirs(model_store.directorio_version(version, models_dir), exist_ok=True)
+    open(model_store.ruta_modelo(version, models_dir), 'wb').close()
+    model_store.publicar_version(version, models_dir)
+
+
+def test_cambio_de_version_no_bloquea_los_requests(tmp_path):
+    models_dir = str(tmp_path)
+    publicar('v1', models_dir)
+    liberar = threading.Event()
+    cargas, cambios = [], []
+
+    def loader(version):
+        cargas.append(version)
+        if version == 'v2':
+            assert liberar.wait(5)
+        return f"modelo-{version}"
+
+    holder = ModelHolder(loader, models_dir, check_interval=0, on_swap=cambios.append)
+    publicar('v2', models_dir)
+
+    # Mientras v2 carga, get() devuelve v1 al instante y no dispara otra carga
+    for _ in range(3):
+        t0 = time.perf_counter()
+        assert holder.get() == ('v1', 'modelo-v1')
+        assert time.perf_counter() - t0 < 1
+    assert cargas == ['v1', 'v2'] and cambios == []
+
+    liberar.set()
+    assert holder.refresh(esperar=True) == ('v2', 'modelo-v2')
+    assert cargas == ['v1', 'v2'] and cambios == ['v2']
+
+
+def test_carga_fallida_sigue_con_el_modelo_anterior(tmp_path):
+    models_dir = str(tmp_path)
+    publicar('v1', models_dir)
+
+    def loader(version):
+        if version == 'v2':
+            raise FileNotFoundError(version)
+        return f"modelo-{version}"
+
+    holder = ModelHolder(loader, models_dir, check_interval=0)
+    publicar('v2', models_dir)
+    assert holder.refresh(esperar=True) == ('v1', 'modelo-v1')
+
+
+def test_on_swap_corre_antes_de_servir_el_modelo_nuevo(tmp_path):
+    models_dir = str(tmp_path)
+    publicar('v1', models_dir)
+    vistos = []
+    holder = ModelHolder(lambda version: f"modelo-{version}", models_dir, check_interval=0,
+                         on_swap=lambda version: vistos.append(holder.get()))
+    publicar('v2', models_dir)
+    assert holder.refresh(esperar=True) == ('v2', 'modelo-v2')
+    # Mientras se cambian los recursos de la versión, los requests siguen con el modelo anterior
+    assert vistos == [('v1', 'modelo-v1')]
+
+
+def test_on_swap_fallido_no_cambia_el_modelo(tmp_path):
+    models_dir = str(tmp_path)
+    publicar('v1', models_dir)
+
+    def on_swap(version):
+        raise ValueError("bundle inválido")
+
+    holder = ModelHolder(lambda version: f"modelo-{version}", models_dir, check_interval=0, on_swap=on_swap)
+    publicar('v2', models_dir)
+    assert holder.refresh(esperar=True) == ('v1', 'modelo-v1')
@@ -0,0 +1,108 @@
+import fcntl
+import glob
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from persistence import PredictionWriter, PREDICTION_COLUMNS, crear_engine, crear_tabla_sqlite
+
+
+def registros(desde, hasta):
+    return [{**{col: None for col in PREDICTION_COLUMNS}, 'tipo': 'departamento', 'Comuna': 'Ñuñoa',
+             'prediction_uf': 5000.0 + i, 'n_properties': i, 'requested_at': datetime(2025, 1, 1, 12, 0, i)}
+            for i in range(desde, hasta)]
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    engine = crear_engine(f"sqlite:///{tmp_path / 'bd.sqlite'}")
+    crear_tabla_sqlite(engine)
+    w = PredictionWriter(engine, batch_size=3, spill_path=str(tmp_path / 'pendientes.jsonl'), retry_interval=0)
+    # BD caída a voluntad: cuántos lotes más se dejan insertar antes de fallar (None = sin límite)
+    w.lotes_disponibles = None
+    insertar = w._insertar
+
+    def insertar_o_fallar(lote):
+        if w.lotes_disponibles is not None:
+            if w.lotes_disponibles == 0:
+                raise ConnectionError("BD caída")
+            w.lotes_disponibles -= 1
+        insertar(lote)
+
+    monkeypatch.setattr(w, '_insertar', insertar_o_fallar)
+    return w
+
+
+def filas_bd(writer):
+    with writer.engine.connect() as conn:
+        return sorted(r[0] for r in conn.execute(text("SELECT n_properties FROM model_predictions")))
+
+
+def test_derrame_y_reinsercion_sin_perdidas_ni_duplicados(writer):
+    writer.lotes_disponibles = 0
+    writer._flush(registros(0, 3))
+    writer._flush(registros(3, 8))
+    assert filas_bd(writer) == []
+    assert writer.stats_counters['derramados'] == 8
+
+    # La BD vuelve a medias: entra un lote de la reinserción y el resto queda en el archivo
+    writer.lotes_disponibles = 1
+    writer._flush([])
+    assert filas_bd(writer) == [0, 1, 2]
+    assert len(glob.glob(f"{writer.spill_path}.*.reintento")) == 1
+
+    # Mientras tanto llegan más registros que también se derraman
+    writer.lotes_disponibles = 0
+    writer._flush(registros(8, 10))
+
+    writer.lotes_disponibles = None
+    writer._flush([])
+    assert filas_bd(writer) == list(range(10))
+    assert glob.glob(f"{writer.spill_path}*") == []
+    assert writer.stats_counters['reinsertados'] == 10
+
+
+def test_reintento_bloqueado_por_otro_worker_no_se_duplica(writer):
+    writer.lotes_disponibles = 0
+    writer._flush(registros(0, 4))
+    writer.lotes_disponibles = 1
+    writer._flush([])
+    pendiente, = glob.glob(f"{writer.spill_path}.*.reintento")
+
+    # Otro worker tiene el archivo tomado: este lo salta en vez de reinsertarlo también
+    writer.lotes_disponibles = None
+    with open(pendiente) as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        writer._flush([])
+        assert filas_bd(writer) == [0, 1, 2]
+    writer._flush([])
+    assert filas_bd(writer) == [0, 1, 2, 3]
+
+
+def test_cola_llena_se_derrama_y_close_vacia_lo_pendiente(writer):
+    writer._queue.maxsize = 2
+    writer._stop.set()
+    writer._asegurar_hilo = lambda: None
+    writer.submit(registros(0, 5))
+    assert writer.stats_counters['encolados'] == 2 and writer.stats_counters['derramados'] == 3
+
+    writer.close()
+    assert filas_bd(writer) == list(range(5))
+    assert glob.glob(f"{writer.spill_path}*") == []
+
+
+def test_contadores_con_varios_hilos(writer):
+    writer._queue.maxsize = 1000
+    writer._asegurar_hilo = lambda: None
+    lote = registros(0, 1)
+    hilos = [threading.Thread(target=lambda: [writer.submit(lote) for _ in range(250)]) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    # 2000 registros: 1000 entran a la cola y el resto se derrama; ninguno se pierde en los contadores
+    stats = writer.stats()
+    assert stats['encolados'] == 1000 and stats['derramados'] == 1000
+    assert stats['profundidad_cola'] == 1000
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import prediction_cache
+from features import calcular_distancias, distancias_con_cache
+from prediction_cache import LRUCache, cache_desde_env, clave_canonica
+
+
+def test_clave_canonica_normaliza_tipos_y_orden():
+    base = clave_canonica({'superficie_util': 80, 'Comuna': 'nunoa', 'banos': 2}, 'v1')
+
+    assert clave_canonica({'banos': 2.0, 'Comuna': 'nunoa', 'superficie_util': np.float64(80)}, 'v1') == base
+    assert clave_canonica({'superficie_util': 80, 'Comuna': 'nunoa', 'banos': 2}, 'v2') != base
+    assert clave_canonica({'superficie_util': 81, 'Comuna': 'nunoa', 'banos': 2}, 'v1') != base
+    # True no se confunde con 1.0
+    assert clave_canonica({'x': True}) != clave_canonica({'x': 1})
+
+
+def test_lru_desaloja_y_vence(monkeypatch):
+    ahora = [100.0]
+    monkeypatch.setattr(prediction_cache.time, 'monotonic', lambda: ahora[0])
+    cache = LRUCache(max_items=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    # 'b' era el menos usado
+    assert cache.get('b') is None and cache.get('c') == 3
+
+    ahora[0] += 11
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['expired']) == (2, 2, 1, 1)
+    assert stats['size'] == 1 and stats['hit_rate'] == 0.5
+
+
+def test_cache_desde_env(monkeypatch):
+    monkeypatch.setenv('PREDICTION_CACHE_SIZE', '0')
+    assert cache_desde_env('prediction', 10000, 3600) is None
+
+    monkeypatch.setenv('PREDICTION_CACHE_SIZE', '5')
+    monkeypatch.setenv('PREDICTION_CACHE_TTL', '7')
+    cache = cache_desde_env('prediction', 10000, 3600)
+    assert (cache.max_items, cache.ttl) == (5, 7.0)
+
+    monkeypatch.setenv('PREDICTION_CACHE_BACKEND', 'memcached')
+    with pytest.raises(ValueError):
+        cache_desde_env('prediction', 10000, 3600)
+
+
+class IndiceContado:
+    firma = {'salud': (1, 2)}
+    modes = {'salud': 'planar'}
+
+    def __init__(self):
+        self.consultas = 0
+
+    def nearest_km(self, layer, puntos):
+        self.consultas += 1
+        return puntos.geometry.x.to_numpy() * 0 + puntos.geometry.y.to_numpy()
+
+
+def test_distancias_se_reutilizan_por_coordenada():
+    indice = IndiceContado()
+    cache = LRUCache()
+    coords = [(-33.45, -70.6), (-33.5, -70.7)]
+    firma = prediction_cache.firma_indice(indice)
+
+    primera = distancias_con_cache(coords, indice, cache, firma)
+    consultas = indice.consultas
+    # Una coordenada repetida y una nueva: solo la nueva va al índice
+    segunda = distancias_con_cache([coords[1], (-33.4, -70.5)], indice, cache, firma)
+
+    assert indice.consultas == 2 * consultas
+    assert segunda[0] == primera[1] and cache.stats()['hits'] == 1
+    esperado = calcular_distancias(np.array([-33.45, -33.5]), np.array([-70.6, -70.7]), indice)
+    assert [d['distancia_est_salud_km'] for d in primera] == list(esperado['distancia_est_salud_km'])
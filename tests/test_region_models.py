@@ -0,0 +1,103 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import Pipeline
+
+from region_models import (entrenar_modelos_grupo, con_modelos_por_grupo, ModelosPorGrupo, directorio_grupos,
+                           borrar_modelos_grupo)
+
+
+def datos(n=600, seed=0):
+    # Precio por m2 muy distinto entre regiones: un modelo por región le gana al global
+    rng = np.random.default_rng(seed)
+    region = rng.choice(['Metropolitana', 'Valparaíso', 'Ñuble'], n, p=[0.45, 0.45, 0.1])
+    superficie = rng.uniform(40, 200, n)
+    precio = np.where(region == 'Metropolitana', 80, 30) * superficie + rng.normal(0, 50, n)
+    X = pd.DataFrame({'superficie_util': superficie, 'Region': region, 'Comuna': 'x'})
+    return X, pd.Series(precio)
+
+
+def plantilla():
+    return Pipeline([('cols', ColumnTransformer([('num', 'passthrough', ['superficie_util'])])),
+                     ('reg', LinearRegression())])
+
+
+@pytest.fixture
+def entrenado(tmp_path):
+    X, y = datos()
+    model_path = str(tmp_path / 'modelo_valoracion.pkl')
+    modelo_global = plantilla().fit(X, y)
+    joblib.dump(modelo_global, model_path)
+    manifest = entrenar_modelos_grupo(X, y, plantilla(), model_path, grupos={}, min_filas=200)
+    return model_path, modelo_global, manifest
+
+
+def test_entrena_solo_los_grupos_que_mejoran_al_global(entrenado):
+    model_path, _, manifest = entrenado
+    assert sorted(manifest['modelos']) == ['Metropolitana', 'Valparaíso']
+    assert 'Ñuble' in manifest['descartados']
+    for m in manifest['modelos'].values():
+        assert m['rmse'] < m['rmse_global']
+        assert os.path.exists(os.path.join(directorio_grupos(model_path), m['archivo']))
+    with open(os.path.join(directorio_grupos(model_path), 'regiones.json'), encoding='utf-8') as f:
+        assert json.load(f) == manifest
+
+
+def test_cada_fila_va_al_modelo_de_su_region(entrenado):
+    model_path, modelo_global, _ = entrenado
+    modelos = con_modelos_por_grupo(modelo_global, model_path, joblib.load)
+    assert isinstance(modelos, ModelosPorGrupo)
+
+    filas = [{'superficie_util': 100.0, 'Region': r, 'Comuna': 'x'} for r in ('Metropolitana', 'Valparaíso', 'Ñuble', None)]
+    pred = modelos.predict_records(filas)
+    assert pred[0] == pytest.approx(8000, rel=0.02) and pred[1] == pytest.approx(3000, rel=0.02)
+    # Sin modelo propio o sin región: el global
+    np.testing.assert_allclose(pred[2:], modelo_global.predict(pd.DataFrame(filas[2:])))
+    np.testing.assert_allclose(modelos.predict(pd.DataFrame(filas)), pred)
+    assert modelos.stats()['filas_global'] == 4
+
+
+def test_lru_respeta_el_presupuesto(entrenado):
+    model_path, modelo_global, _ = entrenado
+    modelos = con_modelos_por_grupo(modelo_global, model_path, joblib.load, presupuesto_mb=1e-6)
+    for region in ('Metropolitana', 'Valparaíso', 'Metropolitana'):
+        modelos.predict_records([{'superficie_util': 100.0, 'Region': region, 'Comuna': 'x'}])
+    stats = modelos.stats()
+    assert stats['residentes'] == ['Metropolitana']
+    assert stats['cargas'] == 3 and stats['desalojos'] == 2
+
+
+def test_sin_modelos_por_grupo_queda_el_global(tmp_path):
+    modelo_global = object()
+    assert con_modelos_por_grupo(modelo_global, str(tmp_path / 'modelo_valoracion.pkl'), joblib.load) is modelo_global
+
+
+def test_solo_se_borra_un_directorio_propio(tmp_path):
+    X, y = datos()
+    model_path = str(tmp_path / 'modelo_valoracion.pkl')
+    ajeno = tmp_path / 'regiones'
+    ajeno.mkdir()
+    (ajeno / 'notas.txt').write_text('no es del entrenamiento')
+
+    borrar_modelos_grupo(model_path)
+    assert (ajeno / 'notas.txt').exists()
+    with pytest.raises(ValueError, match='no es un directorio de modelos por grupo'):
+        entrenar_modelos_grupo(X, y, plantilla(), model_path, grupos={}, min_filas=200)
+    assert (ajeno / 'notas.txt').exists()
+
+
+def test_reentrenar_reemplaza_y_desactivar_borra(entrenado):
+    model_path, _, _ = entrenado
+    X, y = datos(seed=1)
+    manifest = entrenar_modelos_grupo(X, y, plantilla(), model_path, grupos={}, min_filas=10_000)
+    directorio = directorio_grupos(model_path)
+    assert manifest['modelos'] == {} and sorted(os.listdir(directorio)) == ['regiones.json']
+
+    borrar_modelos_grupo(model_path)
+    assert not os.path.exists(directorio)
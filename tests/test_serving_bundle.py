@@ -0,0 +1,77 @@
+import os
+import threading
+
+import geopandas as gpd
+
+import serving_bundle
+from comuna_resolver import ComunaResolver
+from distance_tiles import DistanceTiles
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS
+
+
+def construir(fuentes, destino, version, **kwargs):
+    return serving_bundle.construir_bundle(destino, fuentes['shp_paths'], fuentes['mapping_file'],
+                                           fuentes['metrics_path'], version=version, **kwargs)
+
+
+def test_bundle_reproduce_las_fuentes(fuentes_geo, tmp_path):
+    destino = str(tmp_path / 'serving_bundle')
+    construir(fuentes_geo, destino, 'v1')
+    bundle = serving_bundle.cargar_bundle(destino)
+
+    assert bundle.version == 'v1'
+    assert bundle.comuna_region == {'nunoa': 'Región Metropolitana de Santiago', 'maipu': 'Región Metropolitana de Santiago'}
+    assert bundle.comuna_resolver.comunas([-33.46, -33.50, -33.0], [-70.59, -70.75, -70.0]) == ['Ñuñoa', 'Maipú', None]
+    assert set(bundle.metricas) == {'nunoa', 'maipu'}
+    assert os.path.exists(bundle.comparables_path)
+
+
+def test_publicar_otro_bundle_nunca_deja_el_destino_vacio(fuentes_geo, tmp_path):
+    destino = str(tmp_path / 'serving_bundle')
+    construir(fuentes_geo, destino, 'v1')
+    anterior = serving_bundle.cargar_bundle(destino)
+
+    # Un arranque concurrente revisa el destino una y otra vez mientras se publican bundles nuevos
+    vistos, errores, terminado = set(), [], threading.Event()
+
+    def arranques():
+        while not terminado.is_set():
+            try:
+                vistos.add(serving_bundle.leer_manifest(destino)['version'])
+            except Exception as e:
+                errores.append(e)
+
+    lector = threading.Thread(target=arranques)
+    lector.start()
+    try:
+        for version in ('v2', 'v3'):
+            construir(fuentes_geo, destino, version)
+    finally:
+        terminado.set()
+        lector.join()
+
+    assert errores == [] and vistos <= {'v1', 'v2', 'v3'}
+    assert os.path.islink(destino) and serving_bundle.cargar_bundle(destino).version == 'v3'
+    # Queda el bundle actual y el anterior (v2, que algún worker puede seguir leyendo); v1 se borró
+    hermanos = [n for n in os.listdir(tmp_path) if n.startswith('serving_bundle.')]
+    assert len(hermanos) == 2
+    assert not os.path.exists(anterior.path)
+
+
+def test_teselas_incompatibles_no_se_usan(fuentes_geo, tmp_path):
+    shp = fuentes_geo['shp_paths']
+    capas = {name: shp[name] for name in POINT_LAYERS + LINE_LAYERS}
+    destino = str(tmp_path / 'serving_bundle')
+    teselas = str(tmp_path / 'teselas')
+    resolver = ComunaResolver(gpd.read_parquet(shp['comunas']))
+    DistanceTiles.construir(SpatialIndexRegistry.from_paths(capas), resolver, res=0.01, tile=4).save(teselas)
+
+    construir(fuentes_geo, destino, 'v1', tiles_path=teselas)
+    assert isinstance(serving_bundle.cargar_bundle(destino, verificar=False).spatial_index, DistanceTiles)
+
+    # Teselas de otras capas copiadas dentro del bundle: se sirve con los índices exactos
+    otras = SpatialIndexRegistry.from_paths(capas, modes={name: 'geodesic' for name in capas})
+    DistanceTiles.construir(otras, resolver, res=0.01, tile=4).save(os.path.join(os.path.realpath(destino), 'distance_tiles'))
+    bundle = serving_bundle.cargar_bundle(destino, verificar=False)
+    assert isinstance(bundle.spatial_index, SpatialIndexRegistry)
+    assert getattr(bundle.comuna_resolver, 'teselas', None) is None
@@ -0,0 +1,95 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pytest
+
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS, distance_modes_from_env
+from scipy.spatial import cKDTree
+
+from utils import calculate_nearest_distances, calculate_nearest_distances_metro
+
+
+@pytest.fixture
+def puntos():
+    rng = np.random.default_rng(1)
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(-70.8, -70.55, 50), rng.uniform(-33.55, -33.4, 50)),
+                            crs="EPSG:4326")
+
+
+@pytest.fixture
+def capas(fuentes_geo):
+    return {name: fuentes_geo['shp_paths'][name] for name in POINT_LAYERS + LINE_LAYERS}
+
+
+def test_registro_igual_que_un_arbol_por_consulta(capas, puntos):
+    registry = SpatialIndexRegistry.from_paths(capas)
+
+    for name in POINT_LAYERS:
+        esperado = calculate_nearest_distances(puntos, gpd.read_parquet(capas[name]))
+        np.testing.assert_allclose(registry.nearest_km(name, puntos), esperado)
+    esperado = calculate_nearest_distances_metro(puntos, gpd.read_parquet(capas['metro']))
+    np.testing.assert_allclose(registry.nearest_km('metro', puntos), esperado)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_indice_guardado_da_las_mismas_distancias(capas, puntos, tmp_path, mmap):
+    registry = SpatialIndexRegistry.from_paths(capas, modes={'salud': 'geodesic', 'metro': 'geodesic'})
+    registry.save(str(tmp_path))
+
+    cargado = SpatialIndexRegistry.load(str(tmp_path), mmap=mmap)
+
+    assert cargado.modes == registry.modes and cargado.firma == registry.firma
+    for name in capas:
+        np.testing.assert_allclose(cargado.nearest_km(name, puntos), registry.nearest_km(name, puntos))
+
+
+def test_load_or_build_reconstruye_si_cambia_una_capa(capas, tmp_path):
+    destino = str(tmp_path / 'indice')
+    SpatialIndexRegistry.load_or_build(capas, destino)
+    manifest = os.path.join(destino, 'manifest.json')
+    antes = os.stat(manifest).st_mtime_ns
+
+    # Mismos archivos y modos: se reutiliza el índice guardado
+    SpatialIndexRegistry.load_or_build(capas, destino)
+    assert os.stat(manifest).st_mtime_ns == antes
+
+    # Otro modo de distancia: se reconstruye
+    registry = SpatialIndexRegistry.load_or_build(capas, destino, modes={'metro': 'geodesic'})
+    assert registry.modes['metro'] == 'geodesic'
+    assert SpatialIndexRegistry.load(destino).modes['metro'] == 'geodesic'
+
+
+def test_modos_de_distancia_por_capa(monkeypatch):
+    monkeypatch.setenv('DISTANCE_MODE', 'planar')
+    monkeypatch.setenv('DISTANCE_MODES', 'metro=geodesic, salud=GEODESIC')
+    modes = distance_modes_from_env()
+    assert modes['metro'] == modes['salud'] == 'geodesic' and modes['comisarias'] == 'planar'
+
+    monkeypatch.setenv('DISTANCE_MODES', 'metro=haversine')
+    with pytest.raises(ValueError):
+        distance_modes_from_env()
+
+
+def test_load_con_mmap_no_copia_las_coordenadas(capas, tmp_path):
+    SpatialIndexRegistry.from_paths(capas).save(str(tmp_path))
+
+    mapeado = SpatialIndexRegistry.load(str(tmp_path), mmap=True)
+    copiado = SpatialIndexRegistry.load(str(tmp_path), mmap=False)
+
+    for name in POINT_LAYERS:
+        assert isinstance(mapeado.trees[name], cKDTree)
+        assert isinstance(mapeado.trees[name].data.base, np.memmap)
+        assert not isinstance(copiado.trees[name].data.base, np.memmap)
+
+
+def test_guardar_encima_no_cambia_un_indice_ya_mapeado(capas, puntos, tmp_path):
+    SpatialIndexRegistry.from_paths(capas).save(str(tmp_path))
+    mapeado = SpatialIndexRegistry.load(str(tmp_path), mmap=True)
+    antes = mapeado.nearest_km('salud', puntos)
+
+    # Otra capa guardada en el mismo directorio: archivo nuevo + rename, el mapeo viejo sigue intacto
+    SpatialIndexRegistry.from_paths({**capas, 'salud': capas['ed_escolar']}).save(str(tmp_path))
+
+    np.testing.assert_array_equal(mapeado.nearest_km('salud', puntos), antes)
+    assert not np.allclose(SpatialIndexRegistry.load(str(tmp_path)).nearest_km('salud', puntos), antes)
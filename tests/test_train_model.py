@@ -0,0 +1,116 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import bindparam, create_engine, text
+
+import train_model
+from comuna_resolver import ComunaResolver
+from esquema import COLUMNAS_EXTRACCION
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """witness_scrapper en SQLite, con texto libre y valores como los del scraper."""
+    rng = np.random.default_rng(0)
+    n = 23
+    df = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'divisa': rng.choice(['UF', '$', 'US$'], n),
+        'precio': rng.uniform(1000, 9000, n),
+        'desc': [f"depto con {i % 4 + 1} dormitorios y {i % 2} estacionamientos" for i in range(n)],
+        'tipo': rng.choice(['casa', 'departamento'], n),
+        'superficie_total': [f"{v:.0f} m2" for v in rng.uniform(40, 300, n)],
+        'superficie_util': rng.uniform(30, 200, n),
+        'dormitorios': [None if i % 5 == 0 else str(i % 4 + 1) for i in range(n)],
+        'banos': rng.integers(1, 4, n).astype(float),
+        'estacionamientos': [None] * n,
+        'antiguedad': rng.choice([5.0, 2010.0], n),
+        'latitud': rng.uniform(-33.6, -33.3, n),
+        'longitud': rng.uniform(-70.8, -70.5, n),
+    })
+    engine = create_engine(f"sqlite:///{tmp_path / 'scrapper.sqlite'}")
+    df[list(COLUMNAS_EXTRACCION)].to_sql('witness_scrapper', engine, index=False)
+    return engine
+
+
+@pytest.fixture
+def carga_compacta(monkeypatch):
+    monkeypatch.setattr(train_model, 'TRAIN_COMPACT_DTYPES', True)
+    monkeypatch.setattr(train_model, 'query_extraccion', train_model.query_compacta)
+    monkeypatch.setattr(train_model, 'query_por_ids', text(train_model.query_compacta.text + " WHERE id IN :ids")
+                        .bindparams(bindparam('ids', expanding=True)))
+    monkeypatch.setattr(train_model, 'SQL_CHUNKSIZE', 5)
+
+
+def test_limpiar_por_bloque_igual_que_la_lectura_completa(engine, carga_compacta):
+    completa = train_model.limpiar(train_model.extraer(engine))
+
+    por_bloque = train_model.extraer(engine, por_bloque=train_model.limpiar)
+
+    assert 'desc' not in por_bloque.columns
+    pd.testing.assert_frame_equal(por_bloque, completa)
+
+
+def test_limpiar_por_bloque_con_ids(engine, carga_compacta, monkeypatch):
+    monkeypatch.setattr(train_model, 'IDS_POR_CONSULTA', 4)
+    ids = [3, 7, 8, 15, 16, 22]
+
+    por_bloque = train_model.extraer(engine, ids, por_bloque=train_model.limpiar)
+
+    assert por_bloque['id'].tolist() == ids
+    completa = train_model.limpiar(train_model.extraer(engine))
+    pd.testing.assert_frame_equal(por_bloque, completa[completa['id'].isin(ids)].reset_index(drop=True))
+
+
+def test_etapa_cacheada_calcula_una_vez_por_clave(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_model, 'PIPELINE_CACHE_DIR', str(tmp_path))
+    llamadas = []
+
+    def calcular():
+        llamadas.append(1)
+        return pd.DataFrame({'x': [1.0, 2.0]})
+
+    primera = train_model.etapa_cacheada('limpieza', 'clave1', calcular)()
+    segunda = train_model.etapa_cacheada('limpieza', 'clave1', calcular)()
+    assert len(llamadas) == 1
+    pd.testing.assert_frame_equal(primera, segunda)
+
+    # Otra clave (entrada distinta): se recalcula y queda solo la última salida de la etapa
+    train_model.etapa_cacheada('limpieza', 'clave2', calcular)()
+    assert len(llamadas) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['limpieza-clave2.parquet']
+
+    # PIPELINE_FORCE ignora el cache
+    monkeypatch.setattr(train_model, 'PIPELINE_FORCE', True)
+    train_model.etapa_cacheada('limpieza', 'clave2', calcular)()
+    assert len(llamadas) == 3
+
+
+def test_etapa_cacheada_es_perezosa(tmp_path, monkeypatch):
+    monkeypatch.setattr(train_model, 'PIPELINE_CACHE_DIR', str(tmp_path))
+
+    def no_llamar():
+        raise AssertionError("no debería calcularse")
+
+    # Sin llamar a la función devuelta no se calcula ni se lee nada
+    train_model.etapa_cacheada('extraccion', 'x', no_llamar)
+
+
+@pytest.mark.parametrize('compacto', [False, True])
+def test_calcular_geo_en_procesos_igual_que_en_serie(fuentes_geo, monkeypatch, compacto):
+    monkeypatch.setattr(train_model, 'TRAIN_COMPACT_DTYPES', compacto)
+    shp_paths = fuentes_geo['shp_paths']
+    spatial_index = SpatialIndexRegistry.from_paths({name: shp_paths[name] for name in POINT_LAYERS + LINE_LAYERS})
+    comuna_resolver = ComunaResolver(gpd.read_parquet(shp_paths['comunas']))
+    rng = np.random.default_rng(5)
+    n = 12000
+    df = pd.DataFrame({'id': np.arange(n), 'latitud': rng.uniform(-33.56, -33.43, n),
+                       'longitud': rng.uniform(-70.82, -70.55, n)})
+
+    serie = train_model.calcular_geo(df, spatial_index, comuna_resolver, workers=1)
+    procesos = train_model.calcular_geo(df, spatial_index, comuna_resolver, workers=2)
+
+    pd.testing.assert_frame_equal(pd.DataFrame(procesos), pd.DataFrame(serie))
+    assert serie['Comuna'].notna().any() and serie['Comuna'].isna().any()
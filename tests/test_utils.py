@@ -0,0 +1,139 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from pyproj import Geod
+
+from utils import (
+    calculate_nearest_distances,
+    calculate_nearest_distances_geodesic,
+    calculate_nearest_distances_metro,
+    calculate_nearest_distances_metro_geodesic,
+    build_segment_tree,
+    geometry_points,
+    limpieza,
+    limpieza_serie,
+    preprocesar_nulos
+)
+
+R = 6371
+
+
+def distancias_metro_bucle(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame) -> np.ndarray:
+    # Implementación original: recorre todas las líneas para cada punto
+    return np.array([min(p.distance(line) for line in tgt.geometry) for p in src.geometry]) * R * np.pi / 180
+
+
+def lineas_metro():
+    return gpd.GeoDataFrame(geometry=[
+        shapely.LineString([(-70.78, -33.51), (-70.66, -33.46), (-70.57, -33.45)]),
+        shapely.MultiLineString([[(-70.60, -33.40), (-70.60, -33.50)], [(-70.70, -33.60), (-70.65, -33.55)]]),
+    ], crs="EPSG:4326")
+
+
+def test_metro_vectorizado_igual_que_el_bucle():
+    rng = np.random.default_rng(2)
+    # Puntos al azar, uno sobre un vértice y uno sobre un tramo
+    xs = np.r_[rng.uniform(-70.85, -70.5, 300), -70.66, -70.60]
+    ys = np.r_[rng.uniform(-33.65, -33.35, 300), -33.46, -33.45]
+    src = gpd.GeoDataFrame(geometry=gpd.points_from_xy(xs, ys), crs="EPSG:4326")
+    tgt = lineas_metro()
+
+    esperado = distancias_metro_bucle(src, tgt)
+
+    np.testing.assert_allclose(calculate_nearest_distances_metro(src, tgt), esperado, rtol=1e-12, atol=1e-12)
+    # Con el árbol de segmentos construido una vez y reutilizado
+    arbol = build_segment_tree(tgt)
+    np.testing.assert_allclose(calculate_nearest_distances_metro(src, None, tree=arbol), esperado,
+                               rtol=1e-12, atol=1e-12)
+    assert esperado[-2:].tolist() == [0.0, 0.0]
+
+
+def test_arbol_de_segmentos_no_une_partes_distintas():
+    # Las dos partes del MultiLineString no se conectan: un punto entre ellas no está sobre un segmento ficticio
+    arbol = build_segment_tree(lineas_metro())
+    assert len(arbol.geometries) == 2 + 1 + 1
+    src = gpd.GeoDataFrame(geometry=[shapely.Point(-70.625, -33.525)], crs="EPSG:4326")
+    assert calculate_nearest_distances_metro(src, None, tree=arbol)[0] > 0
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * R * np.arcsin(np.sqrt(a))
+
+
+def test_geodesica_igual_que_haversine_por_fuerza_bruta():
+    rng = np.random.default_rng(3)
+    src = gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(-70.8, -70.5, 100), rng.uniform(-33.6, -33.3, 100)),
+                           crs="EPSG:4326")
+    tgt = gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(-70.8, -70.5, 40), rng.uniform(-33.6, -33.3, 40)),
+                           crs="EPSG:4326")
+
+    esperado = haversine_km(src.geometry.x.to_numpy()[:, None], src.geometry.y.to_numpy()[:, None],
+                            tgt.geometry.x.to_numpy()[None, :], tgt.geometry.y.to_numpy()[None, :]).min(axis=1)
+
+    np.testing.assert_allclose(calculate_nearest_distances_geodesic(src, tgt), esperado, rtol=1e-9)
+
+
+def test_geodesica_elige_el_poi_realmente_mas_cercano():
+    # A -33.5° un grado de longitud mide ~0.83 de uno de latitud: el POI al este está más cerca
+    src = gpd.GeoDataFrame(geometry=[shapely.Point(-70.6, -33.5)], crs="EPSG:4326")
+    tgt = gpd.GeoDataFrame(geometry=[shapely.Point(-70.591, -33.5), shapely.Point(-70.6, -33.492)], crs="EPSG:4326")
+    este = haversine_km(-70.6, -33.5, -70.591, -33.5)
+    norte = haversine_km(-70.6, -33.5, -70.6, -33.492)
+    assert este < norte
+
+    # El método planar compara grados crudos y se queda con el del norte
+    assert calculate_nearest_distances(src, tgt)[0] == pytest.approx(0.008 * R * np.pi / 180)
+    assert calculate_nearest_distances_geodesic(src, tgt)[0] == pytest.approx(este, rel=1e-9)
+
+
+def test_metro_geodesico_en_km_reales():
+    # Punto a 0.01° al este de un tramo norte-sur: la distancia es la del pie de la perpendicular
+    tgt = gpd.GeoDataFrame(geometry=[shapely.LineString([(-70.6, -33.55), (-70.6, -33.45)])], crs="EPSG:4326")
+    src = gpd.GeoDataFrame(geometry=[shapely.Point(-70.59, -33.5)], crs="EPSG:4326")
+    _, _, metros = Geod(ellps='WGS84').inv(-70.59, -33.5, -70.6, -33.5)
+
+    assert calculate_nearest_distances_metro_geodesic(src, tgt)[0] == pytest.approx(metros / 1000, rel=1e-3)
+    # El planar sobreestima la distancia este-oeste en ~1/cos(33.5°)
+    assert calculate_nearest_distances_metro(src, tgt)[0] > metros / 1000 * 1.15
+
+
+def test_limpieza_serie_igual_que_limpieza_por_fila():
+    valores = ["85 m2", "1.234,5", "", None, 70, 3.5, "sin dato", "12,5 m2", np.nan, "  ", "3 dorm"]
+    s = pd.Series(valores, dtype=object)
+
+    esperado = s.apply(limpieza).astype(float)
+
+    pd.testing.assert_series_equal(limpieza_serie(s), esperado)
+    # Columnas ya numéricas no se tocan
+    numerica = pd.Series([1.0, np.nan, 3.0])
+    pd.testing.assert_series_equal(limpieza_serie(numerica), numerica)
+
+
+def test_preprocesar_nulos_igual_que_el_apply_por_fila():
+    null_vals = ["", " ", "nan", "NaN", "null", "NULL", "na", "NA", "n/a", "N/A", "-", "none", "None"]
+
+    def original(df):
+        for col in df.columns:
+            if df[col].dtype == 'object':
+                df[col] = df[col].replace(null_vals, np.nan)
+                df[col] = df[col].apply(lambda x: np.nan if isinstance(x, str) and x.strip() == "" else x)
+        return df
+
+    df = pd.DataFrame({'texto': pd.Series(['casa', 'NULL', '   ', '-', 'depto', None], dtype=object),
+                       'mixta': pd.Series(['2', 3, '\t', 'n/a', 4.5, ''], dtype=object),
+                       'numerica': [1.0, 2.0, np.nan, 4.0, 5.0, 6.0]})
+
+    pd.testing.assert_frame_equal(preprocesar_nulos(df.copy()), original(df.copy()))
+
+
+def test_geometry_points_desde_columnas():
+    df = pd.DataFrame({'latitud': [-33.45, -33.5], 'longitud': [-70.6, -70.7], 'id': [1, 2]}, index=[10, 20])
+
+    gp = geometry_points(df)
+
+    assert gp.crs.to_epsg() == 4326 and list(gp.index) == [0, 1]
+    assert gp.geometry.x.tolist() == [-70.6, -70.7] and gp.geometry.y.tolist() == [-33.45, -33.5]
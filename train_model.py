@@ -1,7 +1,13 @@
 import os
+import glob
+import json
+import shutil
+import hashlib
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from sqlalchemy import create_engine, text
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine, text, bindparam
 from dotenv import load_dotenv
 import requests
 
@@ -12,15 +18,22 @@ load_dotenv()
 
 from utils import (
     convertir_precio,
-    limpieza,
+    limpieza_serie,
     preprocesar_nulos,
     rellenar_estacionamientos,
     rellenar_dormitorios,
-    geometry_points,
-    calculate_nearest_distances,
-    calculate_nearest_distances_metro
+    geometry_points
 )
 from model import entrenar_y_guardar_modelo
+import model_store
+import serving_bundle
+from comuna_resolver import ComunaResolver
+from distance_tiles import aplicar_teselas, leer_manifest as manifest_teselas
+from spatial_index import SpatialIndexRegistry, POINT_LAYERS, LINE_LAYERS, distance_modes_from_env, firma_archivos
+from features import calcular_distancias
+from feature_store import FeatureStore
+from instrumentation import etapa, registro
+from esquema import TRAIN_COMPACT_DTYPES, COLUMNAS_EXTRACCION, COLUMNAS_TEXTO, compactar, columnas_df_metrics, memoria_mb
 
 # --- 1) Configuración de conexión a BD y rutas SHP ---
 DB_URI = (
@@ -30,13 +43,32 @@ DB_URI = (
     f"{os.getenv('DATABASE','ml_valoranet')}"
 )
 SHP_PATHS = {
-    'ed_superior': os.environ['ED_SUPERIOR_SHP'],
-    'ed_escolar':  os.environ['ED_ESCOLAR_SHP'],
-    'comisarias':  os.environ['COMISARIAS_SHP'],
-    'salud':       os.environ['SALUD_SHP'],
-    'metro':       os.environ['METRO_SHP'],
-    'comunas':     os.environ['COMUNAS_SHP']
+    'ed_superior': os.getenv('ED_SUPERIOR_SHP'),
+    'ed_escolar':  os.getenv('ED_ESCOLAR_SHP'),
+    'comisarias':  os.getenv('COMISARIAS_SHP'),
+    'salud':       os.getenv('SALUD_SHP'),
+    'metro':       os.getenv('METRO_SHP'),
+    'comunas':     os.getenv('COMUNAS_SHP')
 }
+RESULTADOS_QA_FILE = 'resultados_qa.xlsx'
+# Publicaciones filtradas para métricas por comuna y comparables (DATA_METRICS_FILE de la API)
+DF_METRICS_FILENAME = 'df_metrics.parquet'
+DF_METRICS_PATH = os.path.join('data_preprocessed', DF_METRICS_FILENAME)
+
+# Features ya procesadas de witness_scrapper, por id y fecha_modificacion (ver feature_store.py)
+FEATURE_STORE_PATH = os.getenv('FEATURE_STORE_PATH', 'data_preprocessed/feature_store')
+# Histograma de instrumentation.py para los tiempos de cada etapa
+ETAPAS = 'training_stage_seconds'
+# Teselas de distancias (ver distance_tiles.py): las mismas que usa la API
+DISTANCE_TILES_PATH = os.getenv('DISTANCE_TILES_PATH', '')
+# Cache de etapas: <PIPELINE_CACHE_DIR>/<etapa>-<clave>.parquet, la clave es un hash de la entrada
+PIPELINE_CACHE_DIR = os.getenv('PIPELINE_CACHE_DIR', 'data_preprocessed/cache')
+PIPELINE_FORCE = os.getenv('PIPELINE_FORCE', 'false').lower() == 'true'
+SQL_CHUNKSIZE = int(os.getenv('SQL_CHUNKSIZE', 50000))
+IDS_POR_CONSULTA = 5000
+TRAIN_WORKERS = int(os.getenv('TRAIN_WORKERS', os.cpu_count() or 1))
+# Se sube al cambiar la lógica de alguna etapa, para no reutilizar resultados viejos
+PIPELINE_VERSION = 1
 
 query = text("""
     SELECT
@@ -65,78 +97,288 @@ query = text("""
     FROM witness_scrapper
 """)
 
+# Carga compacta: solo las columnas que se usan (ver esquema.py)
+query_compacta = text("SELECT " + ", ".join(f"`{col}`" for col in COLUMNAS_EXTRACCION) + " FROM witness_scrapper")
+query_extraccion = query_compacta if TRAIN_COMPACT_DTYPES else query
+
+query_por_ids = text(query_extraccion.text + " WHERE id IN :ids").bindparams(bindparam('ids', expanding=True))
+
+# Versión de cada fila, para detectar las nuevas o modificadas desde la última corrida
+versiones_query = text("""
+    SELECT id, fecha_modificacion
+    FROM witness_scrapper
+""")
+
+
+def clave(*partes) -> str:
+    return hashlib.sha256(json.dumps([PIPELINE_VERSION, *partes], default=str).encode()).hexdigest()[:16]
+
+
+def ruta_etapa(etapa: str, key: str) -> str:
+    return os.path.join(PIPELINE_CACHE_DIR, f"{etapa}-{key}.parquet")
+
+
+def etapa_cacheada(etapa: str, key: str, calcular, geo: bool = False):
+    """
+    Devuelve una función que entrega la salida de la etapa para `key`: la lee
+    del cache si existe o la calcula y la guarda. Es perezosa para que, si las
+    etapas siguientes ya están en cache, las anteriores ni se lean.
+    """
+    path = ruta_etapa(etapa, key)
+
+    def leer():
+        return gpd.read_parquet(path) if geo else pd.read_parquet(path)
+
+    def cargar() -> pd.DataFrame:
+        if os.path.exists(path) and not PIPELINE_FORCE:
+            print(f"[{etapa}] cache {path}")
+            return leer()
+
+        os.makedirs(PIPELINE_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        calcular().to_parquet(tmp)
+        os.replace(tmp, path)
+        # Solo se conserva la última salida de cada etapa
+        for viejo in glob.glob(os.path.join(glob.escape(PIPELINE_CACHE_DIR), f"{etapa}-*.parquet")):
+            if viejo != path:
+                os.remove(viejo)
+        print(f"[{etapa}] calculada {path}")
+        # Se devuelve lo leído del parquet, así una corrida con cache ve exactamente los mismos tipos
+        return leer()
+
+    return cargar
+
+
 # --- 2) Cargar datos brutos desde MySQL ---
-engine = create_engine(DB_URI)
-with engine.connect() as conn:
-    df = pd.read_sql(sql=query, con=conn)
+def _leer_sql(engine, sql, por_bloque=None, **params) -> pd.DataFrame:
+    """
+    Con `por_bloque` la consulta se lee por bloques (cursor del lado del
+    servidor) y cada bloque se reduce apenas llega: el pico de memoria es un
+    bloque crudo más lo ya reducido. Sin `por_bloque` se lee de una vez,
+    porque juntar bloques crudos ocupa lo mismo que la lectura completa.
+    """
+    with engine.connect() as conn:
+        if por_bloque is None:
+            return pd.read_sql(sql=sql, con=conn, params=params or None)
+        conn = conn.execution_options(stream_results=True)
+        bloques = [por_bloque(bloque)
+                   for bloque in pd.read_sql(sql=sql, con=conn, params=params or None, chunksize=SQL_CHUNKSIZE)]
+    return pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame()
 
-# --- 2.1) Cargar datos validados desde la API
-resultados_api=pd.read_excel('resultados_qa.xlsx')
-resultados_api = resultados_api.fillna('')
 
-df=pd.concat([df, resultados_api], ignore_index=True)
+def extraer(engine, ids=None, por_bloque=None) -> pd.DataFrame:
+    """
+    Filas de witness_scrapper (todas las columnas, o las de la carga compacta); con `ids`, solo esas.
+    `por_bloque` se aplica a cada bloque leído (ver _leer_sql).
+    """
+    if ids is None:
+        bloques = [_leer_sql(engine, query_extraccion, por_bloque)]
+    else:
+        bloques = [_leer_sql(engine, query_por_ids, por_bloque, ids=[int(i) for i in ids[k:k + IDS_POR_CONSULTA]])
+                   for k in range(0, len(ids), IDS_POR_CONSULTA)]
+    df = pd.concat(bloques, ignore_index=True)
+    # Bloques ya limpios y compactados con distintas categorías se concatenan como texto
+    return compactar(df) if por_bloque is not None and TRAIN_COMPACT_DTYPES else df
 
 
 # --- 3) Preprocessing idéntico al de tu API ---
-# 3.1 Convertir precios a UF (asegura que 'precio' sea float para evitar warnings)
-df['precio'] = df['precio'].astype(float)
-df = convertir_precio(df, valor_uf=39300)
+def limpiar(df: pd.DataFrame) -> pd.DataFrame:
+    # 3.1 Convertir precios a UF (asegura que 'precio' sea float para evitar warnings)
+    df['precio'] = df['precio'].astype(float)
+    df = convertir_precio(df, valor_uf=39300)
 
-# 3.2 Limpiar columnas numéricas
-for col in ['superficie_util', 'superficie_total', 'antiguedad', 'banos', 'dormitorios']:
-    df[col] = df[col].apply(limpieza)
+    # 3.2 Limpiar columnas numéricas
+    for col in ['superficie_util', 'superficie_total', 'antiguedad', 'banos', 'dormitorios']:
+        df[col] = limpieza_serie(df[col])
 
-# 3.3 Normalizar nulos y rellenar a partir de 'desc'
-df = preprocesar_nulos(df)
-df = rellenar_estacionamientos(df)
-df = rellenar_dormitorios(df)
-df['antiguedad'] = df['antiguedad'].apply(lambda x: 2025 - x if x >= 1000 else x)
+    # 3.3 Normalizar nulos y rellenar a partir de 'desc'
+    df = preprocesar_nulos(df)
+    df = rellenar_estacionamientos(df)
+    df = rellenar_dormitorios(df)
+    df['antiguedad'] = np.where(df['antiguedad'] >= 1000, 2025 - df['antiguedad'], df['antiguedad'])
+    if TRAIN_COMPACT_DTYPES:
+        # El texto libre ya no hace falta después de las extracciones con regex
+        df = compactar(df.drop(columns=[col for col in COLUMNAS_TEXTO if col in df.columns]))
+    return df
 
-# 3.4 Calcular distancias geoespaciales
-gp = geometry_points(df)
-ed_sup = gpd.read_parquet(SHP_PATHS['ed_superior'])
-ed_esc = gpd.read_parquet(SHP_PATHS['ed_escolar'])
-comi   = gpd.read_parquet(SHP_PATHS['comisarias'])
-salud  = gpd.read_parquet(SHP_PATHS['salud'])
-metro  = gpd.read_parquet(SHP_PATHS['metro'])
 
-comunas_gdf = gpd.read_parquet(SHP_PATHS['comunas'])
+def leer_resultados_qa() -> pd.DataFrame:
+    # 2.1) Datos validados desde la API
+    if TRAIN_COMPACT_DTYPES:
+        resultados_api = pd.read_excel(RESULTADOS_QA_FILE, usecols=lambda col: col in COLUMNAS_EXTRACCION)
+    else:
+        resultados_api = pd.read_excel(RESULTADOS_QA_FILE)
+    return resultados_api.fillna('')
 
 
-comunas_gdf = comunas_gdf.to_crs(gp.crs)
+# --- 3.4) Comunas y distancias geoespaciales, repartidas en procesos ---
+_worker = {}
 
-df = gpd.sjoin(gp, comunas_gdf[['geometry', 'Comuna','Region']], how="left")
 
+def _iniciar_worker(spatial_index, comuna_resolver):
+    _worker['spatial_index'] = spatial_index
+    _worker['comuna_resolver'] = comuna_resolver
 
-df['distancia_ed_superior_km'] = calculate_nearest_distances(gp, ed_sup)
-df['distancia_ed_escolar_km']  = calculate_nearest_distances(gp, ed_esc)
-df['distancia_comisaria_km']   = calculate_nearest_distances(gp, comi)
-df['distancia_est_salud_km']   = calculate_nearest_distances(gp, salud)
-df['distancia_metro_km']       = calculate_nearest_distances_metro(gp, metro)
 
-# 3.5 Filtrar outliers (misma máscara que en tu script original)
-mask = (
-    (df['dormitorios'] > 0) & (df['dormitorios'] < 15) &
-    (df['banos']       > 0) & (df['banos']       < 10) &
-    (df['superficie_total'] > 0) & (df['superficie_total'] < 20000) &
-    (df['superficie_util']  > 0) & (df['superficie_util']  < 20000) &
-    (df['precio']      > 0) & (df['precio']      < 25000)
-)
+def _geo_bloque(lats: np.ndarray, lons: np.ndarray) -> pd.DataFrame:
+    out = _worker['comuna_resolver'].resolver(lats, lons)
+    for col, valores in calcular_distancias(lats, lons, _worker['spatial_index']).items():
+        out[col] = valores
+    return out
+
+
+def calcular_geo(df: pd.DataFrame, spatial_index, comuna_resolver, workers: int = TRAIN_WORKERS) -> gpd.GeoDataFrame:
+    if TRAIN_COMPACT_DTYPES:
+        # Sin puntos de shapely: un objeto Python por fila que después no se usa
+        gp = df.reset_index(drop=True)
+        lats, lons = np.asarray(gp['latitud'], dtype=float), np.asarray(gp['longitud'], dtype=float)
+    else:
+        gp = geometry_points(df)
+        lats, lons = gp.geometry.y.to_numpy(), gp.geometry.x.to_numpy()
+    if workers <= 1 or len(gp) < 10000:
+        _iniciar_worker(spatial_index, comuna_resolver)
+        geo = _geo_bloque(lats, lons)
+    else:
+        cortes = np.array_split(np.arange(len(gp)), workers * 4)
+        with ProcessPoolExecutor(workers, initializer=_iniciar_worker,
+                                 initargs=(spatial_index, comuna_resolver)) as pool:
+            partes = pool.map(_geo_bloque, [lats[c] for c in cortes], [lons[c] for c in cortes])
+            geo = pd.concat(list(partes), ignore_index=True)
+    if TRAIN_COMPACT_DTYPES:
+        return compactar(gp.join(geo.drop(columns=['index_right'])))
+    return gp.join(geo)
+
+
+class RecursosGeo:
+    """Índices espaciales y resolvedor de comunas, construidos solo si hay filas que procesar."""
+
+    def __init__(self, modes: dict):
+        self.modes = modes
+        self._recursos = None
+
+    def get(self) -> tuple:
+        if self._recursos is None:
+            # Mismos índices y modos de distancia que usa la API (ver spatial_index.py)
+            spatial_index = SpatialIndexRegistry.from_paths(
+                {name: SHP_PATHS[name] for name in POINT_LAYERS + LINE_LAYERS}, modes=self.modes)
+            # Misma asignación de comunas que la API (ver comuna_resolver.py)
+            comunas_gdf = gpd.read_parquet(SHP_PATHS['comunas'])
+            comuna_resolver = ComunaResolver(comunas_gdf[['geometry', 'Comuna', 'Region']])
+            spatial_index = aplicar_teselas(DISTANCE_TILES_PATH, spatial_index, comuna_resolver)
+            self._recursos = (spatial_index, comuna_resolver)
+        return self._recursos
+
+
+def procesar(crudos: pd.DataFrame, recursos: RecursosGeo) -> gpd.GeoDataFrame:
+    return calcular_geo(limpiar(crudos), *recursos.get())
+
+
+def features_scraper(engine, contexto: str, recursos: RecursosGeo) -> gpd.GeoDataFrame:
+    """
+    Features de witness_scrapper desde el feature store: solo se extraen y
+    procesan las filas nuevas o con otra fecha_modificacion.
+    """
+    store = FeatureStore(FEATURE_STORE_PATH, contexto, reiniciar=PIPELINE_FORCE)
+    with engine.connect() as conn:
+        actuales = pd.read_sql(sql=versiones_query, con=conn)
+    pendientes = store.pendientes(actuales)
+    print(f"[feature store] {len(pendientes)} filas nuevas o modificadas de {len(actuales)}")
+    if len(pendientes):
+        # Carga compacta: limpiar() es fila a fila y se aplica a cada bloque de la consulta, así el
+        # texto libre se descarta antes de tener toda la tabla en memoria (la etapa 'extraccion' la incluye)
+        with etapa('extraccion', ETAPAS):
+            crudos = extraer(engine, None if store.vacio else pendientes,
+                             por_bloque=limpiar if TRAIN_COMPACT_DTYPES else None)
+        with etapa('limpieza_y_geo', ETAPAS):
+            limpias = crudos if TRAIN_COMPACT_DTYPES else limpiar(crudos)
+            procesadas = calcular_geo(limpias, *recursos.get())
+        store.agregar(procesadas, actuales)
+    return store.leer(actuales['id'])
+
+
+def main():
+    faltantes = [name for name, path in SHP_PATHS.items() if not path]
+    if faltantes:
+        raise KeyError(f"Faltan las rutas de: {faltantes}")
+
+    engine = create_engine(DB_URI)
+    modes = distance_modes_from_env()
+    recursos = RecursosGeo(modes)
+    # Si cambia una capa POI, las comunas, los modos de distancia o las teselas, se recalcula todo
+    contexto = clave('features', firma_archivos(SHP_PATHS), modes, manifest_teselas(DISTANCE_TILES_PATH),
+                     *(['dtypes_compactos'] if TRAIN_COMPACT_DTYPES else []))
+
+    with etapa('features_scraper', ETAPAS):
+        scraper = features_scraper(engine, contexto, recursos)
+    with etapa('features_qa', ETAPAS):
+        qa = etapa_cacheada('qa', clave('qa', contexto, firma_archivos({'qa': RESULTADOS_QA_FILE})),
+                            lambda: procesar(leer_resultados_qa(), recursos), geo=not TRAIN_COMPACT_DTYPES)()
+    if TRAIN_COMPACT_DTYPES:
+        df = compactar(pd.concat([scraper, qa], ignore_index=True))
+    else:
+        df = gpd.GeoDataFrame(pd.concat([scraper, qa], ignore_index=True), geometry='geometry', crs=qa.crs)
+    print(f"[memoria] {len(df)} filas, {memoria_mb(df):.1f} MB")
+
+    # 3.5 Filtrar outliers (misma máscara que en tu script original)
+    mask = (
+        (df['dormitorios'] > 0) & (df['dormitorios'] < 15) &
+        (df['banos']       > 0) & (df['banos']       < 10) &
+        (df['superficie_total'] > 0) & (df['superficie_total'] < 20000) &
+        (df['superficie_util']  > 0) & (df['superficie_util']  < 20000) &
+        (df['precio']      > 0) & (df['precio']      < 25000)
+    )
+
+    # Con MODEL_VERSION (reentrenamiento desde la API) los artefactos van a su directorio de versión
+    MODEL_VERSION = os.getenv('MODEL_VERSION')
+    model_path = None
+    if MODEL_VERSION:
+        model_path = model_store.ruta_modelo(MODEL_VERSION)
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+
+    # Con la carga compacta, solo las columnas que se leen al servir. Con versión, df_metrics queda
+    # en su directorio: la API mira el mtime del compartido y no debe verlo antes que el modelo
+    df_metrics = columnas_df_metrics(df[mask]) if TRAIN_COMPACT_DTYPES else df[mask].copy()
+    metrics_path = (os.path.join(os.path.dirname(model_path), DF_METRICS_FILENAME) if MODEL_VERSION
+                    else DF_METRICS_PATH)
+    df_metrics.to_parquet(metrics_path)
+
+    df=df.drop(columns=['geometry','source','comuna','URL','disponible','fecha_creacion',
+                        'fecha_modificacion','orientacion','id','name','desc','ubicacion','estacionamientos','index_right','antiguedad'],
+               errors='ignore')
+
+
+    df_model = df[mask].copy()
 
-df_metrics = df[mask].copy()
+    # --- 4) Entrenar y guardar el modelo ---
+    with etapa('entrenamiento', ETAPAS):
+        RESULTADO, MEJOR = entrenar_y_guardar_modelo(df_model, model_path)
 
-df_metrics.to_parquet('data_preprocessed/df_metrics.parquet')
+    # --- 5) Bundle de serving (mapa comuna-región, polígonos, índices espaciales y métricas) ---
+    bundle_path = serving_bundle.ruta_bundle_version(MODEL_VERSION) if MODEL_VERSION else None
+    with etapa('bundle', ETAPAS):
+        serving_bundle.construir_desde_env(bundle_path, version=MODEL_VERSION, metrics_path=metrics_path)
 
-df=df.drop(columns=['geometry','source','comuna','URL','disponible','fecha_creacion',
-                    'fecha_modificacion','orientacion','id','name','desc','ubicacion','estacionamientos','index_right','antiguedad'],axis=1)
+    # Tiempos por etapa junto a metrics.json; la API los expone en /metrics/prometheus
+    etapas = registro.resumen(ETAPAS)
+    stages_path = os.path.join(os.path.dirname(model_path) if model_path else '.', 'training_stages.json')
+    with open(stages_path, 'w', encoding='utf-8') as f:
+        json.dump({nombre.split('=', 1)[1]: v for nombre, v in etapas.items()}, f, indent=4)
+    for nombre, v in etapas.items():
+        print(f"[etapa] {nombre.split('=', 1)[1]}: {v['segundos']:.1f}s")
 
+    # Publicar la versión: cada worker de la API la carga en su próximo chequeo del puntero
+    if MODEL_VERSION:
+        model_store.publicar_version(MODEL_VERSION)
+        print(f"Versión publicada: {MODEL_VERSION}")
+        # Recién ahora el df_metrics compartido (herramientas y arranques sin bundle) pasa a la versión nueva
+        tmp = f"{DF_METRICS_PATH}.{os.getpid()}.tmp"
+        shutil.copyfile(metrics_path, tmp)
+        os.replace(tmp, DF_METRICS_PATH)
 
-df_model = df[mask].copy()
+    print("Resultados CV de cada modelo:", RESULTADO)
+    print("Mejor modelo seleccionado:", MEJOR)
+    print(f"Archivo '{model_path or 'modelo_valoracion.pkl'}' creado correctamente.")
 
-# --- 4) Entrenar y guardar el modelo ---
-# Ahora pasamos df_model, SHP_PATHS y la ruta del modelo
-RESULTADO, MEJOR = entrenar_y_guardar_modelo(df_model)
 
-print("Resultados CV de cada modelo:", RESULTADO)
-print("Mejor modelo seleccionado:", MEJOR)
-print("Archivo 'modelo_valoracion.pkl' creado correctamente.")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
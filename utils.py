@@ -1,10 +1,20 @@
 import os
 import re
+import unicodedata
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 from shapely.geometry import Point
 from scipy.spatial import cKDTree
+from pyproj import Transformer
+
+
+def normalize_str(s: str) -> str:
+    nfkd = unicodedata.normalize('NFD', s)
+    only_base = ''.join(ch for ch in nfkd if unicodedata.category(ch) != 'Mn')
+    return only_base.lower().strip()
 
 
 def convertir_precio(df: pd.DataFrame, valor_uf: float) -> pd.DataFrame:
@@ -29,6 +39,33 @@ def limpieza(valor):
     return np.nan
 
 
+NUMERO_PATTERN = r'(\d+(?:[\.,]\d+)?)'
+
+
+def _mascara_texto(s: pd.Series) -> pd.Series:
+    # .str devuelve NaN para los elementos que no son texto
+    try:
+        return s.str.len().notna()
+    except AttributeError:
+        return pd.Series(False, index=s.index)
+
+
+def limpieza_serie(s: pd.Series) -> pd.Series:
+    """Versión vectorizada de `limpieza` para una columna completa."""
+    if pd.api.types.is_numeric_dtype(s):
+        return s
+    es_texto = _mascara_texto(s).to_numpy()
+    out = np.full(len(s), np.nan)
+    if es_texto.any():
+        out[es_texto] = (s[es_texto].str.extract(NUMERO_PATTERN, expand=False)
+                                    .str.replace(',', '.', regex=False)
+                                    .astype(float)
+                                    .to_numpy())
+    if (~es_texto).any():
+        out[~es_texto] = pd.to_numeric(s[~es_texto], errors='coerce').to_numpy(dtype=float)
+    return pd.Series(out, index=s.index, name=s.name)
+
+
 def recalcula_antiguedad(valor: float) -> float:
     return 2025 - valor if valor >= 1000 else valor
 
@@ -62,34 +99,93 @@ def preprocesar_nulos(df: pd.DataFrame) -> pd.DataFrame:
     null_vals = ["", " ", "nan", "NaN", "null", "NULL", "na", "NA", "n/a", "N/A", "-", "none", "None"]
     for col in df.columns:
         if df[col].dtype == 'object':
-            df[col] = df[col].replace(null_vals, np.nan)
-            df[col] = df[col].apply(lambda x: np.nan if isinstance(x, str) and x.strip() == "" else x)
+            valores = df[col].replace(null_vals, np.nan)
+            es_texto = _mascara_texto(valores).to_numpy()
+            solo_espacios = np.zeros(len(valores), dtype=bool)
+            if es_texto.any():
+                solo_espacios[es_texto] = valores[es_texto].str.strip().eq('').to_numpy()
+            # infer_objects: mismas conversiones de tipo que hacía el antiguo .apply por fila
+            df[col] = valores.mask(solo_espacios, np.nan).infer_objects()
     return df
 
 
 def geometry_points(df: pd.DataFrame, lon_col: str='longitud', lat_col: str='latitud') -> gpd.GeoDataFrame:
-    geom = [Point(xy) for xy in zip(df[lon_col], df[lat_col])]
+    geom = gpd.points_from_xy(np.asarray(df[lon_col], dtype=float), np.asarray(df[lat_col], dtype=float))
     return gpd.GeoDataFrame(df, geometry=geom, crs="EPSG:4326").reset_index(drop=True)
 
 
-def calculate_nearest_distances(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame) -> np.ndarray:
+def calculate_nearest_distances(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame, tree: cKDTree=None) -> np.ndarray:
     src_coords = np.column_stack((src.geometry.x, src.geometry.y))
-    tgt_coords = np.column_stack((tgt.geometry.x, tgt.geometry.y))
-    tree = cKDTree(tgt_coords)
+    if tree is None:
+        tgt_coords = np.column_stack((tgt.geometry.x, tgt.geometry.y))
+        tree = cKDTree(tgt_coords)
     dists, _ = tree.query(src_coords)
     R = 6371
     return dists * R * np.pi / 180
 
 
-def calculate_nearest_distances_metro(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame) -> np.ndarray:
-    dists = []
-    for p in src.geometry:
-        dists.append(min(p.distance(line) for line in tgt.geometry))
-    arr = np.array(dists)
+def lonlat_to_unit_xyz(lon, lat) -> np.ndarray:
+    # Coordenadas ECEF sobre la esfera unitaria: la distancia euclidiana (cuerda) es monótona con la geodésica
+    lon_r = np.radians(np.asarray(lon, dtype=float))
+    lat_r = np.radians(np.asarray(lat, dtype=float))
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+
+def calculate_nearest_distances_geodesic(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame, tree: cKDTree=None) -> np.ndarray:
+    src_xyz = lonlat_to_unit_xyz(src.geometry.x, src.geometry.y)
+    if tree is None:
+        tgt = tgt.to_crs(epsg=4326)
+        tree = cKDTree(lonlat_to_unit_xyz(tgt.geometry.x, tgt.geometry.y))
+    chord, _ = tree.query(src_xyz)
+    R = 6371
+    return 2 * R * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def local_aeqd_crs(gdf: gpd.GeoDataFrame) -> str:
+    # Proyección azimutal equidistante centrada en la capa: error de escala despreciable a escala urbana
+    minx, miny, maxx, maxy = gdf.to_crs(epsg=4326).total_bounds
+    return (f"+proj=aeqd +lat_0={(miny + maxy) / 2:.6f} +lon_0={(minx + maxx) / 2:.6f} "
+            "+datum=WGS84 +units=m +no_defs")
+
+
+@lru_cache(maxsize=None)
+def _transformer_desde_wgs84(crs: str) -> Transformer:
+    return Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+def build_segment_tree(tgt: gpd.GeoDataFrame) -> shapely.STRtree:
+    # Descompone cada (Multi)LineString en segmentos de 2 vértices: cajas más ajustadas en el STRtree
+    partes = shapely.get_parts(np.asarray(tgt.geometry.values))
+    coords, idx = shapely.get_coordinates(partes, return_index=True)
+    misma_parte = idx[:-1] == idx[1:]
+    segmentos = shapely.linestrings(np.stack((coords[:-1][misma_parte], coords[1:][misma_parte]), axis=1))
+    return shapely.STRtree(segmentos)
+
+
+def calculate_nearest_distances_metro(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame, tree: shapely.STRtree=None) -> np.ndarray:
+    if tree is None:
+        tree = build_segment_tree(tgt)
+    # Distancia mínima punto-línea para todos los puntos en una sola consulta vectorizada
+    idx, dists = tree.query_nearest(np.asarray(src.geometry.values), return_distance=True, all_matches=False)
+    arr = np.full(len(src), np.nan)
+    arr[idx[0]] = dists
     R = 6371
     return arr * R * np.pi / 180
 
 
+def calculate_nearest_distances_metro_geodesic(src: gpd.GeoDataFrame, tgt: gpd.GeoDataFrame,
+                                               tree: shapely.STRtree=None, crs: str=None) -> np.ndarray:
+    if tree is None:
+        crs = local_aeqd_crs(tgt)
+        tree = build_segment_tree(tgt.to_crs(crs))
+    x, y = _transformer_desde_wgs84(crs).transform(src.geometry.x.to_numpy(), src.geometry.y.to_numpy())
+    idx, dists = tree.query_nearest(shapely.points(x, y), return_distance=True, all_matches=False)
+    arr = np.full(len(src), np.nan)
+    arr[idx[0]] = dists
+    return arr / 1000
+
+
 def eliminar_outliers_iqr(df: pd.DataFrame, cols: list) -> pd.DataFrame:
     for col in cols:
         q1, q3 = df[col].quantile([0.25, 0.75])